@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк формата ответа: JSON против CBOR
+
+Строит списки заметок разного размера (как в ответе GET /api/notes) и
+сравнивает для json (стандартная библиотека) и common/cbor.py:
+- размер ответа без сжатия и после gzip;
+- время кодирования и декодирования (лучшее из нескольких повторов).
+
+Примеры:
+    python bench_cbor.py
+    python bench_cbor.py --notes 100 1000 10000 --note-size 2000 --repeat 7
+"""
+import argparse
+import gzip
+import json
+import random
+import string
+import sys
+import time
+import uuid
+
+from common import cbor
+
+CYRILLIC = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def make_notes(count, note_size, rng):
+    """Список заметок со смешанным русским и латинским текстом"""
+    alphabet = CYRILLIC + string.ascii_lowercase
+    notes = []
+    for i in range(count):
+        words = []
+        length = 0
+        while length < note_size:
+            word = ''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 10)))
+            words.append(word)
+            length += len(word) + 1
+        stamp = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00"
+        notes.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'title': f"Заметка {i}",
+            'content': ' '.join(words),
+            'created_at': stamp,
+            'updated_at': stamp,
+        })
+    return {'notes': notes}
+
+
+def best_time(func, arg, repeat):
+    """Лучшее время вызова из repeat повторов, мс"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def json_dumps(payload):
+    # Как jsonify во Flask: без экранирования не-ASCII символов
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def measure(payload, repeat):
+    formats = {
+        'json': (json_dumps, json.loads),
+        'cbor': (cbor.dumps, cbor.loads),
+    }
+    result = {}
+    for name, (dumps, loads) in formats.items():
+        data = dumps(payload)
+        if loads(data) != payload:
+            raise RuntimeError(f"{name}: данные не совпадают после декодирования")
+        result[name] = {
+            'size': len(data),
+            'gzip': len(gzip.compress(data, 6)),
+            'encode_ms': best_time(dumps, payload, repeat),
+            'decode_ms': best_time(loads, data, repeat),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение JSON и CBOR для списков заметок")
+    parser.add_argument('--notes', type=int, nargs='+', default=[10, 100, 1000, 5000],
+                        help="размеры списков заметок")
+    parser.add_argument('--note-size', type=int, default=500, help="длина текста заметки, символов")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'Заметок':>8} {'Формат':<6} {'Размер':>10} {'gzip':>10} "
+          f"{'Кодир., мс':>11} {'Декод., мс':>11}")
+    for count in args.notes:
+        payload = make_notes(count, args.note_size, rng)
+        result = measure(payload, args.repeat)
+        for name, r in result.items():
+            print(f"{count:>8} {name:<6} {r['size']:>10} {r['gzip']:>10} "
+                  f"{r['encode_ms']:>11.2f} {r['decode_ms']:>11.2f}")
+        ratio = result['cbor']['size'] / result['json']['size']
+        print(f"{'':>8} CBOR/JSON по размеру: {ratio:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
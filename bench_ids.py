@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк вставки заметок: текстовый UUIDv4 против rowid + UUIDv7
+
+Заполняет две базы SQLite одинаковыми заметками:
+- uuid4: прежняя схема - id TEXT PRIMARY KEY (строка UUIDv4), индекс
+  (user_id, updated_at, id);
+- uuid7: текущая схема из server/schema.py - целочисленный rowid и
+  16-байтный uid (UUIDv7), индекс (user_id, updated_at).
+
+Случайный ключ вставляет строки по всему B-дереву: когда таблица
+перестает помещаться в кэш страниц, почти каждая вставка читает и
+расщепляет страницу с диска. Бенчмарк печатает скорость вставки по ходу
+заполнения (последний отрезок - установившийся режим), размер файла и
+число страниц индексов.
+
+Примеры:
+    python bench_ids.py
+    python bench_ids.py --rows 1000000 --cache-mb 16 --dir /tmp
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+import ids
+import schema
+
+LEGACY_SCHEMA = [
+    '''
+    CREATE TABLE notes (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX idx_notes_user_updated ON notes (user_id, updated_at, id)',
+]
+
+
+def create_legacy(conn):
+    for sql in LEGACY_SCHEMA:
+        conn.execute(sql)
+
+
+def create_current(conn):
+    conn.execute(schema.NOTE_TABLES['notes'].format(table='notes'))
+    conn.execute('CREATE INDEX idx_notes_updated ON notes (user_id, updated_at)')
+
+
+VARIANTS = {
+    # имя -> (создание схемы, INSERT, новый ключ)
+    'uuid4': (create_legacy,
+              'INSERT INTO notes (id, user_id, title, content, updated_at) VALUES (?, ?, ?, ?, ?)',
+              lambda: str(uuid.uuid4())),
+    'uuid7': (create_current,
+              'INSERT INTO notes (uid, user_id, title, content, updated_at) VALUES (?, ?, ?, ?, ?)',
+              ids.new_uid),
+}
+
+
+def index_pages(conn):
+    """Страниц в B-деревьях таблицы и индексов notes (по dbstat, если есть)"""
+    try:
+        return dict(conn.execute(
+            "SELECT name, COUNT(*) FROM dbstat WHERE tbl_name = 'notes' GROUP BY name"
+        ).fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def run(name, args, directory):
+    create, insert, new_key = VARIANTS[name]
+    path = os.path.join(directory, f'bench_ids_{name}.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = {-args.cache_mb * 1024}')
+    create(conn)
+
+    rng = random.Random(args.seed)
+    content = 'x' * args.note_size
+    report_every = max(args.batch, args.rows // args.reports)
+    inserted = 0
+    started = segment_started = time.perf_counter()
+    segment_rows = 0
+    last_rate = 0.0
+    print(f"{name}:")
+    while inserted < args.rows:
+        count = min(args.batch, args.rows - inserted)
+        rows = [(new_key(), rng.randrange(args.users), 'Заметка', content, '2025-01-01 00:00:00')
+                for _ in range(count)]
+        conn.execute('BEGIN')
+        conn.executemany(insert, rows)
+        conn.execute('COMMIT')
+        inserted += count
+        segment_rows += count
+        if segment_rows >= report_every or inserted == args.rows:
+            now = time.perf_counter()
+            last_rate = segment_rows / (now - segment_started)
+            print(f"  {inserted:>10} строк: {last_rate:>9.0f} строк/с")
+            segment_started, segment_rows = now, 0
+    elapsed = time.perf_counter() - started
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    pages = index_pages(conn)
+    conn.close()
+    size = os.path.getsize(path)
+    if not args.keep:
+        os.remove(path)
+    return {'rate': args.rows / elapsed, 'last_rate': last_rate, 'seconds': elapsed,
+            'size': size, 'pages': pages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость вставки заметок: UUIDv4 TEXT и rowid + UUIDv7")
+    parser.add_argument('--rows', type=int, default=10_000_000, help="заметок в каждой базе")
+    parser.add_argument('--batch', type=int, default=1000, help="строк в одной транзакции")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--note-size', type=int, default=100, help="длина содержимого, символов")
+    parser.add_argument('--cache-mb', type=int, default=64, help="кэш страниц SQLite, МБ")
+    parser.add_argument('--reports', type=int, default=10, help="отчетов о скорости по ходу вставки")
+    parser.add_argument('--dir', default=None, help="каталог для баз (по умолчанию временный)")
+    parser.add_argument('--keep', action='store_true', help="не удалять базы после прогона")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='bench_ids_')
+    results = {name: run(name, args, directory) for name in VARIANTS}
+
+    print(f"\n{'Схема':<6} {'Всего, с':>9} {'Строк/с':>9} {'В конце':>9} {'Файл, МБ':>9}")
+    for name, r in results.items():
+        print(f"{name:<6} {r['seconds']:>9.1f} {r['rate']:>9.0f} {r['last_rate']:>9.0f} "
+              f"{r['size'] / 1024 / 1024:>9.1f}")
+        if r['pages']:
+            print('       страниц: ' + ', '.join(f"{k} {v}" for k, v in sorted(r['pages'].items())))
+    old, new = results['uuid4'], results['uuid7']
+    print(f"\nuuid7/uuid4: скорость x{new['rate'] / old['rate']:.2f} "
+          f"(в конце x{new['last_rate'] / old['last_rate']:.2f}), "
+          f"размер {new['size'] / old['size']:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рендеринга Markdown: правка, затем рендеринг большой заметки
+
+Строит заметку заданной длины (абзацы, списки, таблицы, блоки кода на
+разных языках) и сравнивает для server/render.py:
+- рендеринг целиком (без кэшей) - как было до инкрементального рендеринга;
+- первый инкрементальный рендеринг (пустые кэши);
+- правку случайного абзаца и правку строки в блоке кода с последующим
+  рендерингом (медиана и p95 по нескольким правкам).
+
+После каждой правки результат сверяется с рендерингом целиком.
+
+Примеры:
+    python bench_render.py
+    python bench_render.py --lines 2000 10000 --edits 50
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+import render
+
+CODE_SAMPLES = {
+    'python': "def handler(request):\n    items = [x * 2 for x in range({n})]\n    return {{'total': sum(items)}}\n",
+    'javascript': "function render(items) {{\n  return items.map((x) => x + {n}).join(', ');\n}}\n",
+    'sql': "SELECT id, title FROM notes\nWHERE user_id = ? AND updated_at > '{n}'\nORDER BY updated_at DESC;\n",
+    'bash': "for f in *.md; do\n  echo \"$f: {n}\"\ndone\n",
+}
+
+
+def make_note(lines, rng):
+    """Заметка примерно из lines строк; возвращает список блоков"""
+    blocks = []
+    total = 0
+    n = 0
+    while total < lines:
+        n += 1
+        kind = rng.choices(['paragraph', 'list', 'code', 'table', 'heading'], [5, 2, 2, 1, 1])[0]
+        if kind == 'paragraph':
+            block = ' '.join(f"слово{rng.randint(1, 999)}" for _ in range(rng.randint(20, 60)))
+            block = f"Абзац {n}: {block} с **выделением** и [ссылкой](http://example.com/{n})."
+        elif kind == 'list':
+            block = '\n'.join(f"- пункт {n}.{i} с `кодом`" for i in range(rng.randint(3, 8)))
+        elif kind == 'code':
+            language = rng.choice(list(CODE_SAMPLES))
+            block = f"```{language}\n{CODE_SAMPLES[language].format(n=n) * rng.randint(2, 6)}```"
+        elif kind == 'table':
+            rows = '\n'.join(f"| {n}.{i} | {rng.randint(1, 100)} |" for i in range(rng.randint(2, 6)))
+            block = f"| Ключ | Значение |\n|---|---|\n{rows}"
+        else:
+            block = f"## Раздел {n}"
+        blocks.append(block)
+        total += block.count('\n') + 2
+    return blocks
+
+
+def clear_caches():
+    render.block_cache.clear()
+    render.code_cache.clear()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def edit_paragraph(blocks, rng, step):
+    candidates = [i for i, b in enumerate(blocks) if b.startswith('Абзац')]
+    i = rng.choice(candidates)
+    blocks[i] += f" Правка {step}."
+
+
+def edit_code(blocks, rng, step):
+    candidates = [i for i, b in enumerate(blocks) if b.startswith('```')]
+    i = rng.choice(candidates)
+    body = blocks[i].split('\n')
+    body.insert(len(body) - 1, f"# правка {step}" if 'python' in body[0] or 'bash' in body[0] else f"-- {step}")
+    blocks[i] = '\n'.join(body)
+
+
+def run(lines, edits, rng, check):
+    blocks = make_note(lines, rng)
+    text = '\n\n'.join(blocks)
+
+    full_times = []
+    for _ in range(3):
+        clear_caches()
+        elapsed, expected = timed(render.render_full, text)
+        full_times.append(elapsed)
+    clear_caches()
+    cold, html = timed(render.render_markdown, text)
+    if check and html != expected:
+        raise RuntimeError("Инкрементальный рендеринг отличается от рендеринга целиком")
+
+    result = {
+        'lines': text.count('\n') + 1,
+        'blocks': len(render.split_blocks(text)[0]),
+        'full_ms': min(full_times),
+        'cold_ms': cold,
+    }
+    for name, edit in (('paragraph', edit_paragraph), ('code', edit_code)):
+        times = []
+        for step in range(edits):
+            edit(blocks, rng, step)
+            text = '\n\n'.join(blocks)
+            elapsed, html = timed(render.render_markdown, text)
+            times.append(elapsed)
+            if check and html != render.render_full(text):
+                raise RuntimeError(f"Расхождение после правки ({name}, шаг {step})")
+        result[f'{name}_p50_ms'] = percentile(times, 50)
+        result[f'{name}_p95_ms'] = percentile(times, 95)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время рендеринга большой заметки после правки")
+    parser.add_argument('--lines', type=int, nargs='+', default=[500, 2000, 5000],
+                        help="размеры заметок, строк")
+    parser.add_argument('--edits', type=int, default=20, help="правок каждого вида")
+    parser.add_argument('--no-check', action='store_true', help="не сверять с рендерингом целиком")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    render.warm_up()
+    print(f"{'Строк':>6} {'Блоков':>7} {'Целиком':>9} {'Холодный':>9} "
+          f"{'Абзац p50':>10} {'p95':>7} {'Код p50':>9} {'p95':>7}  (мс)")
+    for lines in args.lines:
+        r = run(lines, args.edits, rng, not args.no_check)
+        print(f"{r['lines']:>6} {r['blocks']:>7} {r['full_ms']:>9.1f} {r['cold_ms']:>9.1f} "
+              f"{r['paragraph_p50_ms']:>10.2f} {r['paragraph_p95_ms']:>7.2f} "
+              f"{r['code_p50_ms']:>9.2f} {r['code_p95_ms']:>7.2f}")
+        print(f"{'':>6} ускорение правки абзаца: {r['full_ms'] / r['paragraph_p50_ms']:.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
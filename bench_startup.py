@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта сервера
+
+Несколько раз запускает сервер с нуля и измеряет:
+- import_ms  - импорт server/app.py и create_app() без фоновых служб;
+- healthz_ms - от запуска процесса до первого ответа /healthz;
+- readyz_ms  - от запуска процесса до готовности /readyz (с прогревом).
+
+Результат сохраняется в JSON и сравнивается с базовым прогоном.
+
+Примеры:
+    python bench_startup.py --runs 5 --save-baseline startup.json
+    python bench_startup.py --runs 5 --compare startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(ROOT, 'server')
+SERVER_URL = 'http://localhost:5000'
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app
+app.create_app(start_background=False)
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def measure_import():
+    """Время импорта приложения и create_app() в свежем процессе, мс"""
+    result = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET],
+        cwd=SERVER_DIR, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_server(timeout):
+    """Время до ответа /healthz и до готовности /readyz, мс"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, 'app.py')],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    healthz_ms = readyz_ms = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError("Сервер завершился при запуске")
+            path = '/healthz' if healthz_ms is None else '/readyz'
+            try:
+                response = requests.get(SERVER_URL + path, timeout=1)
+                elapsed = (time.perf_counter() - started) * 1000
+                if healthz_ms is None:
+                    healthz_ms = elapsed
+                    continue
+                if response.status_code == 200:
+                    readyz_ms = elapsed
+                    break
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    if readyz_ms is None:
+        raise RuntimeError("Сервер не стал готов за отведенное время")
+    return healthz_ms, readyz_ms
+
+
+def summarize(values):
+    return {
+        'min': round(min(values), 1),
+        'median': round(statistics.median(values), 1),
+        'max': round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта сервера")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--save-baseline', metavar='PATH', help="сохранить результат в JSON")
+    parser.add_argument('--compare', metavar='PATH', help="сравнить с базовым JSON")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="допустимое ухудшение медианы (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    try:
+        requests.get(SERVER_URL + '/healthz', timeout=0.5)
+        print("Порт 5000 занят: остановите работающий сервер перед бенчмарком")
+        return 1
+    except requests.exceptions.RequestException:
+        pass
+
+    samples = {'import_ms': [], 'healthz_ms': [], 'readyz_ms': []}
+    for run in range(1, args.runs + 1):
+        import_ms = measure_import()
+        healthz_ms, readyz_ms = measure_server(args.timeout)
+        samples['import_ms'].append(import_ms)
+        samples['healthz_ms'].append(healthz_ms)
+        samples['readyz_ms'].append(readyz_ms)
+        print(f"Прогон {run}: import {import_ms:.0f} мс, healthz {healthz_ms:.0f} мс, "
+              f"readyz {readyz_ms:.0f} мс")
+
+    result = {key: summarize(values) for key, values in samples.items()}
+    result['meta'] = {'timestamp': datetime.now().isoformat(), 'runs': args.runs}
+
+    print(f"\n{'Метрика':<12} {'min':>9} {'median':>9} {'max':>9}")
+    for key in samples:
+        s = result[key]
+        print(f"{key:<12} {s['min']:>9} {s['median']:>9} {s['max']:>9}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат сохранен: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = [
+            f"{key}: {baseline[key]['median']} -> {result[key]['median']} мс"
+            for key in samples
+            if key in baseline and result[key]['median'] > baseline[key]['median'] * (1 + args.tolerance)
+        ]
+        if regressions:
+            print(f"\n✗ Старт замедлился (допуск {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n✓ Регрессий относительно {args.compare} не обнаружено")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,7 +30,13 @@ def create_distribution():
         'run_server.py',
         'test_api.py',
         'full_test.py',
+        'load_test.py',
+        'bench_startup.py',
+        'bench_cbor.py',
+        'bench_render.py',
+        'bench_ids.py',
         'clean_db.py',
+        'seed_db.py',
         'build_dist.py'
     ]
     
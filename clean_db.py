@@ -4,9 +4,13 @@
 """
 import os
 import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+from config import DATABASE
 
 def clean_database():
-    db_path = '/workspace/server/notes.db'
+    db_path = DATABASE
     
     if os.path.exists(db_path):
         print(f"Удаление существующей базы данных: {db_path}")
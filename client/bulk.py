@@ -0,0 +1,378 @@
+"""
+Пакетная синхронизация каталога .md файлов с сервером
+
+Каталог зеркалируется в заметки пользователя: файл - заметка, имя файла
+без расширения - заголовок. Запросы выполняются пулом потоков через общий
+ApiClient (его пул соединений должен быть не меньше числа потоков):
+- push - пакетами по BATCH_SIZE файлов (POST /api/notes/batch), пакеты
+  отправляются параллельно;
+- pull - изменения с прошлого pull (GET /api/sync), без запроса на заметку;
+- render - пакетами по BATCH_SIZE заметок (POST /api/notes/html); сервер
+  рендерит заметки пакета параллельно.
+
+Состояние хранится в <каталог>/.notes_state.json: для каждого файла -
+id заметки, mtime, размер и хеш содержимого, плюс граница последнего pull.
+Неизмененные файлы пропускаются без чтения (совпали mtime и размер) или
+без отправки (совпал хеш).
+
+    python console_client.py --user alice push ~/notes
+    python console_client.py --user alice pull ~/notes
+    python console_client.py --user alice sync ~/notes
+    python console_client.py --user alice render ~/notes
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from common.api_client import ApiError
+
+STATE_FILE = '.notes_state.json'
+HTML_DIR = 'html'
+DEFAULT_WORKERS = 8
+# Операций в одном POST /notes/batch (и заметок в POST /notes/html)
+# и заметок на странице GET /sync
+BATCH_SIZE = 100
+SYNC_PAGE_SIZE = 500
+UNSAFE_CHARS = '/\\:*?"<>|'
+# Серверная версия файла, измененного и локально, и на сервере
+CONFLICT_SUFFIX = ' (сервер).md'
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def safe_filename(title):
+    """Имя файла из заголовка заметки"""
+    name = ''.join('_' if ch in UNSAFE_CHARS or ord(ch) < 32 else ch for ch in title).strip(' .')
+    return name or 'Без названия'
+
+
+class Stats:
+    """Счетчики и прогресс одной операции"""
+    def __init__(self, action, total):
+        self.action = action
+        self.total = total
+        self.done = 0
+        self.counts = {}
+        self.bytes = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, result, name, size=0, error=None):
+        with self.lock:
+            self.done += 1
+            self.counts[result] = self.counts.get(result, 0) + 1
+            self.bytes += size
+            if error:
+                self.errors.append(f"{name}: {error}")
+            self._progress(name)
+
+    def _progress(self, name):
+        line = f"[{self.done:>{len(str(self.total))}}/{self.total}] {self.action}: {name}"
+        if sys.stdout.isatty():
+            print(f"\r{line[:100]:<100}", end='', flush=True)
+        elif self.done == self.total or self.done % 100 == 0:
+            print(line)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        if sys.stdout.isatty() and self.total:
+            print()
+        counts = ', '.join(f"{key}: {value}" for key, value in sorted(self.counts.items()))
+        rate = self.done / elapsed if elapsed > 0 else 0
+        mb_rate = self.bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0
+        print(f"{self.action}: {self.done} файлов за {elapsed:.2f} с ({counts or 'нет файлов'})")
+        print(f"  {rate:.1f} файлов/с, передано {self.bytes / 1024:.1f} КБ ({mb_rate:.2f} МБ/с)")
+        for error in self.errors[:20]:
+            print(f"  ✗ {error}")
+        if len(self.errors) > 20:
+            print(f"  ... и еще {len(self.errors) - 20} ошибок")
+        return not self.errors
+
+
+class DirectoryMirror:
+    """Зеркало каталога .md файлов в заметках пользователя"""
+    def __init__(self, client, directory, workers=DEFAULT_WORKERS):
+        self.client = client
+        self.directory = os.path.abspath(directory)
+        self.workers = workers
+        self.state_path = os.path.join(self.directory, STATE_FILE)
+        self.state = self._load_state()
+        self.state_lock = threading.Lock()
+
+    # --- Состояние ---
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        owner = {'server': self.client.base_url, 'user_id': self.client.user_id}
+        if state.get('owner') != owner:
+            # Каталог раньше синхронизировался с другим сервером или пользователем
+            state = {'owner': owner, 'files': {}}
+        return state
+
+    def save_state(self):
+        with self.state_lock:
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.state_path)
+
+    @property
+    def files(self):
+        return self.state['files']
+
+    def _record(self, path, **fields):
+        with self.state_lock:
+            self.files.setdefault(path, {}).update(fields)
+
+    # --- Запросы ---
+
+    def _run(self, stats, jobs):
+        """Выполнить задачи (имя, функция) пулом потоков
+
+        Функция возвращает (результат, байт) или None, если сама учла
+        свои файлы в stats.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(func): name for name, func in jobs}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    stats.add('ошибка', name, error=e)
+                    continue
+                if outcome is not None:
+                    stats.add(outcome[0], name, outcome[1])
+        self.save_state()
+
+    # --- push ---
+
+    def scan(self):
+        """Относительные пути .md файлов каталога"""
+        paths = []
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and
+                       os.path.join(root, d) != os.path.join(self.directory, HTML_DIR)]
+            for name in names:
+                if name.endswith('.md') and not name.endswith(CONFLICT_SUFFIX):
+                    paths.append(os.path.relpath(os.path.join(root, name), self.directory))
+        return sorted(paths)
+
+    def push(self):
+        """Отправить новые и измененные файлы пакетами"""
+        paths = self.scan()
+        stats = Stats('push', len(paths))
+        changed = []
+        for path in paths:
+            entry = self.files.get(path, {})
+            stat = os.stat(os.path.join(self.directory, path))
+            if entry.get('id') and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+                # Файл не трогали - даже не читаем его
+                stats.add('без изменений', path)
+                continue
+            changed.append((path, stat))
+        batches = [changed[i:i + BATCH_SIZE] for i in range(0, len(changed), BATCH_SIZE)]
+        self._run(stats, [(f"пакет {i + 1}", lambda batch=batch: self._push_batch(batch, stats))
+                          for i, batch in enumerate(batches)])
+        return stats.summary()
+
+    def _push_batch(self, batch, stats):
+        """Один POST /notes/batch на до BATCH_SIZE файлов"""
+        operations, sent = [], []
+        for path, stat in batch:
+            with open(os.path.join(self.directory, path), 'rb') as f:
+                data = f.read()
+            digest = file_hash(data)
+            entry = self.files.get(path, {})
+            if entry.get('id') and entry.get('hash') == digest:
+                self._record(path, mtime=stat.st_mtime, size=stat.st_size)
+                stats.add('без изменений', path)
+                continue
+            try:
+                content = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                # Ошибка одного файла не отменяет остальные файлы пакета
+                stats.add('ошибка', path, error=f"файл не в кодировке UTF-8 ({e.reason}, байт {e.start})")
+                continue
+            operation = {
+                'title': os.path.splitext(os.path.basename(path))[0],
+                'content': content,
+            }
+            if entry.get('id'):
+                operation.update(op='update', id=entry['id'])
+            else:
+                # Временный id - путь файла, сервер вернет настоящий в ids
+                operation.update(op='create', id=path)
+            operations.append(operation)
+            sent.append((path, stat, digest, len(data)))
+        if not operations:
+            return
+
+        try:
+            result = self.client.push_batch(operations)
+        except ApiError as e:
+            for path, *_ in sent:
+                stats.add('ошибка', path, error=e)
+            return
+        recreate = []
+        for (path, stat, digest, size), operation, item in zip(sent, operations, result['results']):
+            if item['status'] == 'not_found':
+                # Заметку удалили на сервере - создадим заново
+                recreate.append((path, stat, digest, size, dict(operation, op='create', id=path)))
+                continue
+            if item['status'] not in ('created', 'updated'):
+                stats.add('ошибка', path, error=item.get('error', item['status']))
+                continue
+            self._record(path, id=item['id'], mtime=stat.st_mtime, size=stat.st_size, hash=digest)
+            stats.add('создано' if item['status'] == 'created' else 'обновлено', path, size)
+
+        if recreate:
+            try:
+                result = self.client.push_batch([operation for *_, operation in recreate])
+            except ApiError as e:
+                for path, *_ in recreate:
+                    stats.add('ошибка', path, error=e)
+                return
+            for (path, stat, digest, size, _), item in zip(recreate, result['results']):
+                if item['status'] != 'created':
+                    stats.add('ошибка', path, error=item.get('error', item['status']))
+                    continue
+                self._record(path, id=item['id'], mtime=stat.st_mtime, size=stat.st_size, hash=digest)
+                stats.add('создано', path, size)
+
+    # --- pull ---
+
+    def pull(self):
+        """Скачать заметки, измененные на сервере с прошлого pull"""
+        by_id = {entry['id']: path for path, entry in self.files.items() if entry.get('id')}
+        taken = set(self.files)
+        since = self.state.get('since')
+        stats = Stats('pull', 0)
+        cursor = None
+        server_time = None
+        while True:
+            page = self.client.sync_changes(since, cursor, limit=SYNC_PAGE_SIZE)
+            # Граница следующего pull - по первой странице
+            server_time = server_time or page['server_time']
+            stats.total += len(page['notes']) + len(page['deleted'])
+            for note in page['notes']:
+                path = by_id.get(note['id'])
+                if path is None:
+                    path = self._new_path(note, taken)
+                    by_id[note['id']] = path
+                self._pull_note(note, path, stats)
+            for note_id in page['deleted']:
+                self._pull_deleted(by_id.get(note_id), note_id, stats)
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.state['since'] = server_time
+        self.save_state()
+        return stats.summary()
+
+    def _new_path(self, note, taken):
+        path = safe_filename(note['title']) + '.md'
+        if path in taken or os.path.exists(os.path.join(self.directory, path)):
+            # Конец id, а не начало: начало UUIDv7 - время создания
+            path = f"{safe_filename(note['title'])} ({note['id'][-8:]}).md"
+        taken.add(path)
+        return path
+
+    def _local_changed(self, path, entry):
+        """Файл изменен после последней синхронизации"""
+        file_path = os.path.join(self.directory, path)
+        if not entry.get('hash') or not os.path.exists(file_path):
+            return False
+        with open(file_path, 'rb') as f:
+            return file_hash(f.read()) != entry['hash']
+
+    def _pull_note(self, note, path, stats):
+        data = note['content'].encode('utf-8')
+        digest = file_hash(data)
+        entry = self.files.get(path, {})
+        file_path = os.path.join(self.directory, path)
+
+        if entry.get('hash') == digest and os.path.exists(file_path):
+            # Содержимое совпадает (например, после push)
+            stats.add('без изменений', path)
+            return
+
+        if self._local_changed(path, entry):
+            # Файл изменен локально и на сервере - не затираем, сохраняем рядом
+            with open(os.path.splitext(file_path)[0] + CONFLICT_SUFFIX, 'wb') as f:
+                f.write(data)
+            stats.add('конфликт', path, len(data))
+            return
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        stat = os.stat(file_path)
+        self._record(path, id=note['id'], mtime=stat.st_mtime, size=stat.st_size, hash=digest)
+        stats.add('загружено', path, len(data))
+
+    def _pull_deleted(self, path, note_id, stats):
+        if path is None:
+            stats.add('без изменений', note_id)
+            return
+        entry = self.files.get(path, {})
+        if self._local_changed(path, entry):
+            # Локальные правки не теряем: при следующем push файл станет новой заметкой
+            self._record(path, id=None)
+            stats.add('конфликт', path)
+            return
+        file_path = os.path.join(self.directory, path)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        with self.state_lock:
+            self.files.pop(path, None)
+        stats.add('удалено', path)
+
+    # --- render ---
+
+    def render(self):
+        """Сохранить HTML версии заметок каталога в <каталог>/html"""
+        entries = [(path, entry) for path, entry in sorted(self.files.items()) if entry.get('id')]
+        stats = Stats('render', len(entries))
+        pending = []
+        for path, entry in entries:
+            html_path = os.path.join(self.directory, HTML_DIR, os.path.splitext(path)[0] + '.html')
+            if entry.get('rendered_hash') == entry.get('hash') and os.path.exists(html_path):
+                stats.add('без изменений', path)
+                continue
+            pending.append((path, entry, html_path))
+        batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+        self._run(stats, [(f"пакет {i + 1}", lambda batch=batch: self._render_batch(batch, stats))
+                          for i, batch in enumerate(batches)])
+        return stats.summary()
+
+    def _render_batch(self, batch, stats):
+        """Один POST /notes/html на до BATCH_SIZE заметок"""
+        try:
+            result = self.client.render_html_batch([entry['id'] for _, entry, _ in batch])
+        except ApiError as e:
+            for path, *_ in batch:
+                stats.add('ошибка', path, error=e)
+            return
+        for (path, entry, html_path), item in zip(batch, result['results']):
+            if item['status'] != 'ok':
+                # not_found, timeout, memory, ...
+                stats.add('ошибка', path, error=item['status'])
+                continue
+            data = item['html_content'].encode('utf-8')
+            os.makedirs(os.path.dirname(html_path), exist_ok=True)
+            with open(html_path, 'wb') as f:
+                f.write(data)
+            self._record(path, rendered_hash=entry.get('hash'))
+            stats.add('отрисовано', path, len(data))
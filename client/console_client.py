@@ -1,179 +1,154 @@
 """
 Консольный клиент для сервиса синхронизированных заметок
 """
-import requests
-import json
 import os
+import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.api_client import ApiClient, ApiError, ServerUnavailable, POOL_SIZE
+from local_store import LocalStore, store_path, remember_account, known_account
+from sync import SyncEngine
+
 # Адрес сервера
 BASE_URL = 'http://localhost:5000/api'
 
 class NotesClient:
-    def __init__(self, base_url=BASE_URL):
-        self.base_url = base_url
-        self.user_id = None
-        self.username = None
-        self.session = requests.Session()
+    def __init__(self, base_url=BASE_URL, use_cbor=True, pool_size=POOL_SIZE):
+        self.api = ApiClient(base_url, use_cbor=use_cbor, pool_size=pool_size)
+        # Локальная копия заметок и ее синхронизация с сервером (после входа)
+        self.store = None
+        self.sync = None
+
+    @property
+    def user_id(self):
+        return self.api.user_id
+
+    @property
+    def username(self):
+        return self.api.username
 
     def register(self, username, password):
         """Регистрация нового пользователя"""
-        url = f"{self.base_url}/register"
-        data = {
-            'username': username,
-            'password': password
-        }
-        
         try:
-            response = self.session.post(url, json=data)
-            if response.status_code == 201:
-                result = response.json()
-                self.user_id = result['user_id']
-                self.username = username
-                print(f"Пользователь {username} успешно зарегистрирован!")
-                return True
-            else:
-                print(f"Ошибка регистрации: {response.json().get('error', 'Неизвестная ошибка')}")
-                return False
-        except Exception as e:
+            self.api.register(username, password)
+        except ServerUnavailable as e:
             print(f"Ошибка подключения к серверу: {e}")
             return False
+        except ApiError as e:
+            print(f"Ошибка регистрации: {e}")
+            return False
+        print(f"Пользователь {username} успешно зарегистрирован!")
+        self.open_local()
+        return True
 
-    def login(self, username, password):
-        """Аутентификация пользователя"""
-        url = f"{self.base_url}/login"
-        data = {
-            'username': username,
-            'password': password
-        }
-        
+    def login(self, username, password, local=True):
+        """Аутентификация пользователя; local - открыть локальную копию заметок"""
         try:
-            response = self.session.post(url, json=data)
-            if response.status_code == 200:
-                result = response.json()
-                self.user_id = result['user_id']
-                self.username = result['username']
-                print(f"Добро пожаловать, {self.username}!")
-                return True
-            else:
-                print(f"Ошибка входа: {response.json().get('error', 'Неизвестная ошибка')}")
+            self.api.login(username, password)
+        except ServerUnavailable as e:
+            # Без сети открываем локальную копию заметок, если вход на этом устройстве уже был
+            user_id = known_account(self.api.base_url, username) if local else None
+            if user_id is None:
+                print(f"Ошибка подключения к серверу: {e}")
                 return False
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
+            self.api.user_id = user_id
+            self.api.username = username
+            print(f"Сервер недоступен, работа без сети. Добро пожаловать, {username}!")
+            self.open_local()
+            return True
+        except ApiError as e:
+            print(f"Ошибка входа: {e}")
             return False
+        print(f"Добро пожаловать, {self.username}!")
+        if local:
+            self.open_local()
+        return True
+
+    def open_local(self):
+        """Открыть локальную копию заметок пользователя и запустить синхронизацию"""
+        self.close()
+        remember_account(self.api.base_url, self.username, self.user_id)
+        self.store = LocalStore(store_path(self.api.base_url, self.user_id))
+        self.sync = SyncEngine(self.store, self.api)
+        self.sync.start()
+
+    def close(self):
+        """Отправить неотправленные изменения и закрыть локальную базу"""
+        if self.sync:
+            self.sync.stop()
+            pending = self.store.pending_count()
+            if pending:
+                print(f"Не отправлено изменений: {pending}; они будут отправлены при следующем запуске")
+            self.store.close()
+            self.sync = self.store = None
+
+    def sync_now(self):
+        """Синхронизировать сейчас и вывести состояние"""
+        if not self.sync:
+            print("Сначала войдите в систему")
+            return False
+        if self.sync.sync_once():
+            print(f"Синхронизировано. Заметок: {self.store.count()}")
+            return True
+        status = self.sync.status()
+        print(f"Сервер недоступен ({status['last_error']}). "
+              f"Ожидают отправки: {status['pending']}")
+        return False
 
     def create_note(self, title, content):
         """Создать новую заметку"""
         if not self.user_id:
             print("Сначала войдите в систему")
             return False
-            
-        url = f"{self.base_url}/notes"
-        data = {
-            'user_id': self.user_id,
-            'title': title,
-            'content': content
-        }
         
-        try:
-            response = self.session.post(url, json=data)
-            if response.status_code == 201:
-                result = response.json()
-                print(f"Заметка '{result['title']}' создана с ID: {result['id']}")
-                return True
-            else:
-                print(f"Ошибка создания заметки: {response.json().get('error', 'Неизвестная ошибка')}")
-                return False
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
-            return False
+        note = self.store.create_note(title, content)
+        self.sync.notify()
+        print(f"Заметка '{note['title']}' создана с ID: {note['id']}")
+        return True
 
     def get_notes(self):
-        """Получить все заметки пользователя"""
+        """Получить все заметки пользователя (из локальной копии)"""
         if not self.user_id:
             print("Сначала войдите в систему")
             return []
-            
-        url = f"{self.base_url}/notes?user_id={self.user_id}"
         
-        try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                result = response.json()
-                return result['notes']
-            else:
-                print(f"Ошибка получения заметок: {response.json().get('error', 'Неизвестная ошибка')}")
-                return []
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
-            return []
+        return self.store.list_notes()
 
     def get_note(self, note_id):
-        """Получить конкретную заметку"""
+        """Получить конкретную заметку (из локальной копии)"""
         if not self.user_id:
             print("Сначала войдите в систему")
             return None
-            
-        url = f"{self.base_url}/notes/{note_id}?user_id={self.user_id}"
         
-        try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Ошибка получения заметки: {response.json().get('error', 'Неизвестная ошибка')}")
-                return None
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
-            return None
+        return self.store.get_note(note_id)
 
     def update_note(self, note_id, title=None, content=None):
         """Обновить заметку"""
         if not self.user_id:
             print("Сначала войдите в систему")
             return False
-            
-        url = f"{self.base_url}/notes/{note_id}"
-        data = {
-            'user_id': self.user_id
-        }
-        if title is not None:
-            data['title'] = title
-        if content is not None:
-            data['content'] = content
         
-        try:
-            response = self.session.put(url, json=data)
-            if response.status_code == 200:
-                result = response.json()
-                print(f"Заметка обновлена: {result['title']}")
-                return True
-            else:
-                print(f"Ошибка обновления заметки: {response.json().get('error', 'Неизвестная ошибка')}")
-                return False
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
+        note = self.store.update_note(note_id, title, content)
+        if note is None:
+            print("Ошибка обновления заметки: Note not found")
             return False
+        self.sync.notify()
+        print(f"Заметка обновлена: {note['title']}")
+        return True
 
     def delete_note(self, note_id):
         """Удалить заметку"""
         if not self.user_id:
             print("Сначала войдите в систему")
             return False
-            
-        url = f"{self.base_url}/notes/{note_id}?user_id={self.user_id}"
         
-        try:
-            response = self.session.delete(url)
-            if response.status_code == 200:
-                print("Заметка успешно удалена")
-                return True
-            else:
-                print(f"Ошибка удаления заметки: {response.json().get('error', 'Неизвестная ошибка')}")
-                return False
-        except Exception as e:
-            print(f"Ошибка подключения к серверу: {e}")
+        if not self.store.delete_note(note_id):
+            print("Ошибка удаления заметки: Note not found")
             return False
+        self.sync.notify()
+        print("Заметка успешно удалена")
+        return True
 
 def print_menu():
     """Вывести меню приложения"""
@@ -185,15 +160,74 @@ def print_menu():
     print("5. Просмотреть конкретную заметку")
     print("6. Обновить заметку")
     print("7. Удалить заметку")
-    print("8. Выход")
+    print("8. Синхронизировать")
+    print("9. Выход")
     print("=============================")
 
+def cli(argv):
+    """Неинтерактивный режим: пакетная синхронизация каталога .md файлов"""
+    import argparse
+    import getpass
+    from bulk import DirectoryMirror, DEFAULT_WORKERS
+    
+    parser = argparse.ArgumentParser(
+        prog='console_client.py',
+        description="Синхронизация каталога .md файлов с сервисом заметок"
+    )
+    parser.add_argument('--server', default=BASE_URL, help="адрес API")
+    parser.add_argument('--user', default=os.environ.get('NOTES_USER'),
+                        help="имя пользователя (или NOTES_USER)")
+    parser.add_argument('--password', default=os.environ.get('NOTES_PASSWORD'),
+                        help="пароль (или NOTES_PASSWORD; иначе будет запрошен)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="число параллельных запросов")
+    parser.add_argument('--json', action='store_true', help="обмен в JSON вместо CBOR")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('push', "отправить новые и измененные файлы"),
+                            ('pull', "скачать новые и измененные заметки"),
+                            ('sync', "push, затем pull"),
+                            ('render', "сохранить HTML версии заметок в <каталог>/html")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('directory')
+    args = parser.parse_args(argv)
+    
+    if not args.user:
+        parser.error("укажите --user или NOTES_USER")
+    password = args.password or getpass.getpass("Пароль: ")
+    if not os.path.isdir(args.directory):
+        if args.command in ('pull', 'sync'):
+            os.makedirs(args.directory)
+        else:
+            parser.error(f"каталог не найден: {args.directory}")
+    
+    client = NotesClient(base_url=args.server, use_cbor=not args.json, pool_size=args.workers)
+    if not client.login(args.user, password, local=False):
+        return 1
+    mirror = DirectoryMirror(client.api, args.directory, workers=args.workers)
+    try:
+        if args.command == 'push':
+            ok = mirror.push()
+        elif args.command == 'pull':
+            ok = mirror.pull()
+        elif args.command == 'sync':
+            ok = mirror.push()
+            ok = mirror.pull() and ok
+        else:
+            ok = mirror.render()
+    except ApiError as e:
+        print(f"Ошибка: {e}")
+        return 1
+    return 0 if ok else 1
+
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    
     client = NotesClient()
     
     while True:
         print_menu()
-        choice = input("Выберите действие (1-8): ").strip()
+        choice = input("Выберите действие (1-9): ").strip()
         
         if choice == '1':
             # Регистрация
@@ -221,7 +255,7 @@ def main():
             if notes:
                 print(f"\nВаши заметки ({len(notes)}):")
                 for note in notes:
-                    print(f"- ID: {note['id'][:8]}... | {note['title']} | Обновлено: {note['updated_at']}")
+                    print(f"- ID: {note['id']} | {note['title']} | Обновлено: {note['updated_at']}")
             else:
                 print("У вас пока нет заметок.")
                 
@@ -265,12 +299,17 @@ def main():
                 client.delete_note(note_id)
                 
         elif choice == '8':
+            # Синхронизировать
+            client.sync_now()
+            
+        elif choice == '9':
             # Выход
+            client.close()
             print("До свидания!")
             break
             
         else:
-            print("Неверный выбор. Пожалуйста, выберите от 1 до 8.")
+            print("Неверный выбор. Пожалуйста, выберите от 1 до 9.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
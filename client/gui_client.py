@@ -2,130 +2,157 @@
 GUI клиент для сервиса синхронизированных заметок
 Использует PyQt5 для создания графического интерфейса
 """
+import os
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                             QHBoxLayout, QTextEdit, QPushButton, QListWidget, 
+                             QHBoxLayout, QTextEdit, QPushButton, QListView, 
                              QLineEdit, QLabel, QMessageBox, QSplitter, QMenuBar, 
-                             QMenu, QAction, QStatusBar)
-from PyQt5.QtCore import Qt
-import requests
-import json
+                             QMenu, QAction, QStatusBar, QProgressBar)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QObject, QTimer, pyqtSignal
 
-class NotesAPI:
-    """Класс для работы с API сервиса заметок"""
-    def __init__(self, base_url="http://localhost:5000/api"):
-        self.base_url = base_url
-        self.session = requests.Session()
-        self.user_id = None
-        self.username = None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.api_client import ApiClient, ServerUnavailable
+from workers import ApiWorker
+from local_store import CONFLICT_SUFFIX, LocalStore, store_path, remember_account, known_account
+from sync import SyncEngine
 
-    def register(self, username, password):
-        """Регистрация нового пользователя"""
-        try:
-            response = self.session.post(f"{self.base_url}/register", json={
-                'username': username,
-                'password': password
-            })
-            if response.status_code == 201:
-                result = response.json()
-                self.user_id = result['user_id']
-                self.username = username
-                return True, result
-            else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+# Адрес сервера
+BASE_URL = 'http://localhost:5000/api'
 
-    def login(self, username, password):
-        """Аутентификация пользователя"""
-        try:
-            response = self.session.post(f"{self.base_url}/login", json={
-                'username': username,
-                'password': password
-            })
-            if response.status_code == 200:
-                result = response.json()
-                self.user_id = result['user_id']
-                self.username = result['username']
-                return True, result
-            else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+# Заметок на страницу списка (краткий вид, без содержимого)
+PAGE_SIZE = 200
+# Больше изменений за раз - список перечитывается целиком
+RELOAD_THRESHOLD = 50
+# Пауза после последней правки перед автосохранением, мс
+AUTOSAVE_DELAY_MS = 1500
 
-    def get_notes(self):
-        """Получить все заметки пользователя"""
-        if not self.user_id:
-            return False, "Пользователь не авторизован"
-        
-        try:
-            response = self.session.get(f"{self.base_url}/notes", params={
-                'user_id': self.user_id
-            })
-            if response.status_code == 200:
-                return True, response.json()['notes']
-            else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+class SyncBridge(QObject):
+    """Передает события потока синхронизации в поток интерфейса"""
+    changed = pyqtSignal(object, object, object)
 
-    def create_note(self, title, content):
-        """Создать новую заметку"""
-        if not self.user_id:
-            return False, "Пользователь не авторизован"
-        
-        try:
-            response = self.session.post(f"{self.base_url}/notes", json={
-                'user_id': self.user_id,
-                'title': title,
-                'content': content
-            })
-            if response.status_code == 201:
-                return True, response.json()
-            else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+class NotesModel(QAbstractListModel):
+    """Список заметок из локальной базы; страницы подгружаются по мере прокрутки"""
+    NoteIdRole = Qt.UserRole
 
-    def update_note(self, note_id, title, content):
-        """Обновить заметку"""
-        if not self.user_id:
-            return False, "Пользователь не авторизован"
-        
-        try:
-            response = self.session.put(f"{self.base_url}/notes/{note_id}", json={
-                'user_id': self.user_id,
-                'title': title,
-                'content': content
-            })
-            if response.status_code == 200:
-                return True, response.json()
-            else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = None
+        self.ids = []
+        self.notes = {}
+        self.exhausted = True
 
-    def delete_note(self, note_id):
-        """Удалить заметку"""
-        if not self.user_id:
-            return False, "Пользователь не авторизован"
-        
-        try:
-            response = self.session.delete(f"{self.base_url}/notes/{note_id}", params={
-                'user_id': self.user_id
-            })
-            if response.status_code == 200:
-                return True, response.json()
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        note = self.notes[self.ids[index.row()]]
+        if role == Qt.DisplayRole:
+            return f"{note['title']} ({note['updated_at']})"
+        if role == self.NoteIdRole:
+            return note['id']
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        after = None
+        if self.ids:
+            last = self.notes[self.ids[-1]]
+            after = (last['updated_at'], last['id'])
+        notes = self.store.list_notes(limit=PAGE_SIZE, after=after)
+        self.exhausted = len(notes) < PAGE_SIZE
+        if not notes:
+            return
+        first = len(self.ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(notes) - 1)
+        for note in notes:
+            self.ids.append(note['id'])
+            self.notes[note['id']] = note
+        self.endInsertRows()
+
+    def set_store(self, store):
+        self.store = store
+        self.reload()
+
+    def reload(self):
+        """Сбросить список и прочитать первую страницу"""
+        self.beginResetModel()
+        self.ids = []
+        self.notes = {}
+        self.exhausted = self.store is None
+        self.endResetModel()
+        self.fetchMore()
+
+    def note(self, row):
+        return self.notes[self.ids[row]]
+
+    def _key(self, note):
+        return (note['updated_at'], note['id'])
+
+    def _position(self, note):
+        """Позиция заметки в списке (свежие сверху) - двоичный поиск"""
+        key = self._key(note)
+        low, high = 0, len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(self.notes[self.ids[middle]]) > key:
+                low = middle + 1
             else:
-                return False, response.json()
-        except Exception as e:
-            return False, str(e)
+                high = middle
+        return low
+
+    def put_note(self, note):
+        """Добавить или обновить заметку на ее месте в порядке сортировки"""
+        self.remove_note(note['id'])
+        row = self._position(note)
+        if row == len(self.ids) and not self.exhausted:
+            # Заметка за пределами прочитанных страниц - появится при прокрутке
+            return
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ids.insert(row, note['id'])
+        self.notes[note['id']] = {key: note[key] for key in ('id', 'title', 'created_at', 'updated_at')}
+        self.endInsertRows()
+
+    def remove_note(self, note_id):
+        if note_id not in self.notes:
+            return
+        row = self.ids.index(note_id)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.ids[row]
+        del self.notes[note_id]
+        self.endRemoveRows()
+
+    def remap(self, old_id, new_id):
+        """Временный id заметки заменен серверным"""
+        if old_id not in self.notes:
+            return
+        row = self.ids.index(old_id)
+        note = self.notes.pop(old_id)
+        note['id'] = new_id
+        self.notes[new_id] = note
+        self.ids[row] = new_id
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
 
 class NotesApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.api = NotesAPI()
+        self.api = ApiClient(BASE_URL)
+        self.worker = ApiWorker(self)
+        self.worker.activity.connect(self.show_activity)
+        # Локальная копия заметок и ее синхронизация (после входа)
+        self.store = None
+        self.sync = None
+        self.sync_bridge = SyncBridge(self)
+        self.sync_bridge.changed.connect(self.apply_sync_changes)
         self.current_note_id = None
+        # Заголовок и текст в редакторе на момент последнего сохранения
+        self.saved_state = ("", "")
         self.init_ui()
         
     def init_ui(self):
@@ -167,8 +194,12 @@ class NotesApp(QMainWindow):
         
         # Список заметок
         left_panel.addWidget(QLabel("Заметки:"))
-        self.notes_list = QListWidget()
-        self.notes_list.itemClicked.connect(self.load_note)
+        self.notes_model = NotesModel(self)
+        self.notes_list = QListView()
+        # Одинаковая высота строк: виджет не измеряет каждую из тысяч строк
+        self.notes_list.setUniformItemSizes(True)
+        self.notes_list.setModel(self.notes_model)
+        self.notes_list.clicked.connect(self.load_note)
         left_panel.addWidget(self.notes_list)
         
         # Кнопки управления заметками
@@ -201,6 +232,14 @@ class NotesApp(QMainWindow):
         self.save_btn.clicked.connect(self.save_note)
         right_panel.addWidget(self.save_btn)
         
+        # Автосохранение через паузу после последней правки
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.setInterval(AUTOSAVE_DELAY_MS)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.title_input.textEdited.connect(self.autosave_timer.start)
+        self.content_input.textChanged.connect(self.autosave_timer.start)
+        
         # Создаем splitter для разделения панелей
         splitter = QSplitter(Qt.Horizontal)
         
@@ -226,6 +265,24 @@ class NotesApp(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Не авторизован")
         
+        # Индикатор фоновых запросов и их отмена
+        self.activity_label = QLabel()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setMaximumWidth(120)
+        self.cancel_btn = QPushButton("Отмена")
+        self.cancel_btn.clicked.connect(self.worker.cancel_all)
+        for widget in (self.activity_label, self.progress_bar, self.cancel_btn):
+            self.status_bar.addPermanentWidget(widget)
+        self.show_activity(0, "")
+        
+        # Состояние синхронизации
+        self.sync_label = QLabel()
+        self.status_bar.addPermanentWidget(self.sync_label)
+        self.sync_timer = QTimer(self)
+        self.sync_timer.timeout.connect(self.show_sync_status)
+        self.sync_timer.start(5000)
+        
     def create_menu(self):
         menubar = self.menuBar()
         
@@ -247,6 +304,94 @@ class NotesApp(QMainWindow):
         about_action.triggered.connect(self.about)
         help_menu.addAction(about_action)
     
+    def show_activity(self, count, label):
+        """Индикатор фоновых запросов в строке состояния"""
+        busy = count > 0
+        self.activity_label.setText(f"{label}... ({count})" if busy else "")
+        self.activity_label.setVisible(busy)
+        self.progress_bar.setVisible(busy)
+        self.cancel_btn.setVisible(busy)
+    
+    def show_sync_status(self):
+        if not self.sync:
+            self.sync_label.clear()
+            return
+        status = self.sync.status()
+        state = {True: "онлайн", False: "нет сети", None: "подключение"}[status['online']]
+        pending = f", не отправлено: {status['pending']}" if status['pending'] else ""
+        self.sync_label.setText(f"Синхронизация: {state}{pending}")
+    
+    def open_local(self):
+        """Открыть локальную копию заметок и запустить синхронизацию"""
+        self.close_local()
+        remember_account(self.api.base_url, self.api.username, self.api.user_id)
+        self.store = LocalStore(store_path(self.api.base_url, self.api.user_id))
+        self.sync = SyncEngine(self.store, self.api, on_change=self.sync_bridge.changed.emit)
+        self.sync.start()
+        self.notes_model.set_store(self.store)
+        self.show_sync_status()
+    
+    def close_local(self):
+        if self.sync:
+            self.sync.stop()
+            self.store.close()
+            self.sync = self.store = None
+    
+    def apply_sync_changes(self, changed, removed, remapped):
+        """Изменения после синхронизации: серверные id, чужие правки и удаления"""
+        for old_id, new_id in remapped.items():
+            self.notes_model.remap(old_id, new_id)
+            if self.current_note_id == old_id:
+                self.current_note_id = new_id
+        if len(changed) + len(removed) > RELOAD_THRESHOLD:
+            self.notes_model.reload()
+        else:
+            for note_id in removed:
+                self.notes_model.remove_note(note_id)
+            for note_id in changed:
+                note = self.store.get_note(note_id)
+                if note:
+                    self.notes_model.put_note(note)
+        current = self.current_note_id and self.store.resolve(self.current_note_id)
+        if current and (current in changed or current in removed):
+            self.reload_current(current, current in removed)
+        self.show_sync_status()
+    
+    def reload_current(self, note_id, removed):
+        """Открытую заметку изменили или удалили на другом устройстве
+
+        Иначе автосохранение отправило бы старый текст редактора поверх
+        чужой правки. Несохраненные правки не теряются: при удалении они
+        сохранятся новой заметкой, при изменении - копией с пометкой
+        конфликта.
+        """
+        unsaved = self.editor_state() != self.saved_state
+        if removed:
+            self.current_note_id = None
+            if unsaved:
+                self.status_bar.showMessage(
+                    "Заметка удалена на другом устройстве; правки будут сохранены новой заметкой")
+            else:
+                self.new_note()
+                self.status_bar.showMessage("Заметка удалена на другом устройстве")
+            return
+        if unsaved:
+            title, content = self.editor_state()
+            copy = self.store.create_note((title or "Без названия") + CONFLICT_SUFFIX, content)
+            self.notes_model.put_note(copy)
+            self.sync.notify()
+            self.status_bar.showMessage(
+                "Заметка изменена на другом устройстве; ваши правки сохранены копией")
+        note = self.store.get_note(note_id)
+        if note:
+            self.show_note(note)
+    
+    def closeEvent(self, event):
+        self.autosave()
+        self.worker.shutdown()
+        self.close_local()
+        super().closeEvent(event)
+    
     def register(self):
         username = self.username_input.text().strip()
         password = self.password_input.text().strip()
@@ -255,10 +400,14 @@ class NotesApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Введите имя пользователя и пароль")
             return
         
-        success, result = self.api.register(username, password)
+        self.worker.run(self.api.register, username, password, key='auth', label="Регистрация",
+                        on_done=lambda success, result: self.register_done(username, success, result))
+    
+    def register_done(self, username, success, result):
         if success:
             QMessageBox.information(self, "Успех", f"Пользователь {username} зарегистрирован")
             self.status_bar.showMessage(f"Авторизован как: {username}")
+            self.open_local()
         else:
             QMessageBox.critical(self, "Ошибка", f"Ошибка регистрации: {result}")
     
@@ -270,71 +419,99 @@ class NotesApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Введите имя пользователя и пароль")
             return
         
-        success, result = self.api.login(username, password)
+        self.worker.run(self.login_request, username, password, key='auth', label="Вход",
+                        on_done=lambda success, result: self.login_done(username, success, result))
+    
+    def login_request(self, username, password):
+        """Вход (в потоке пула); без сети - по ранее сохраненному аккаунту"""
+        try:
+            return self.api.login(username, password)
+        except ServerUnavailable:
+            user_id = known_account(self.api.base_url, username)
+            if user_id is None:
+                raise
+            self.api.user_id = user_id
+            self.api.username = username
+            return {'user_id': user_id, 'username': username, 'offline': True}
+    
+    def login_done(self, username, success, result):
         if success:
-            QMessageBox.information(self, "Успех", f"Добро пожаловать, {username}!")
+            if result.get('offline'):
+                QMessageBox.information(self, "Нет сети",
+                                        "Сервер недоступен: работа с локальной копией заметок")
+            else:
+                QMessageBox.information(self, "Успех", f"Добро пожаловать, {username}!")
             self.status_bar.showMessage(f"Авторизован как: {username}")
-            self.load_notes()
+            self.open_local()
         else:
             QMessageBox.critical(self, "Ошибка", f"Ошибка входа: {result}")
     
     def load_notes(self):
-        if not self.api.user_id:
+        if not self.store:
             QMessageBox.warning(self, "Ошибка", "Сначала войдите в систему")
             return
         
-        success, result = self.api.get_notes()
-        if success:
-            self.notes_list.clear()
-            for note in result:
-                item_text = f"{note['title']} ({note['updated_at']})"
-                self.notes_list.addItem(item_text)
-            self.status_bar.showMessage(f"Загружено {len(result)} заметок")
-        else:
-            QMessageBox.critical(self, "Ошибка", f"Ошибка загрузки заметок: {result}")
+        # Список читается из локальной базы; обновление запускает синхронизацию
+        self.sync.notify()
+        self.notes_model.reload()
+        self.status_bar.showMessage(f"Заметок: {self.store.count()}")
     
-    def load_note(self, item):
-        if not self.api.user_id:
+    def load_note(self, index):
+        if not self.store:
             return
         
-        # Получаем индекс выбранного элемента
-        index = self.notes_list.currentRow()
-        success, notes = self.api.get_notes()
-        
-        if success and index < len(notes):
-            note = notes[index]
-            self.current_note_id = note['id']
-            self.title_input.setText(note['title'])
-            self.content_input.setText(note['content'])
+        # id берется до автосохранения: сохраненная заметка переезжает
+        # наверх списка, и строки index сдвигаются
+        note_id = index.data(NotesModel.NoteIdRole)
+        self.autosave()
+        note = self.store.get_note(note_id)
+        if note:
+            self.show_note(note)
+    
+    def show_note(self, note):
+        self.current_note_id = note['id']
+        self.saved_state = (note['title'], note['content'])
+        self.title_input.setText(note['title'])
+        self.content_input.setPlainText(note['content'])
+        self.autosave_timer.stop()
+    
+    def editor_state(self):
+        return self.title_input.text().strip(), self.content_input.toPlainText()
+    
+    def autosave(self):
+        """Сохранить правки, если они есть (по таймеру и перед сменой заметки)"""
+        self.autosave_timer.stop()
+        if not self.store or self.editor_state() == self.saved_state:
+            return
+        if not self.current_note_id and not any(self.editor_state()):
+            return
+        self.save_note()
     
     def save_note(self):
-        if not self.api.user_id:
+        if not self.store:
             QMessageBox.warning(self, "Ошибка", "Сначала войдите в систему")
             return
         
-        title = self.title_input.text().strip()
-        content = self.content_input.toPlainText()
+        self.autosave_timer.stop()
+        self.saved_state = self.editor_state()
+        title, content = self.saved_state
         
         if not title:
             title = "Без названия"
         
+        # Изменение сохраняется локально и уходит на сервер в фоне
         if self.current_note_id:
-            # Обновляем существующую заметку
-            success, result = self.api.update_note(self.current_note_id, title, content)
-            if success:
-                QMessageBox.information(self, "Успех", "Заметка обновлена")
-                self.load_notes()
-            else:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка обновления: {result}")
+            note = self.store.update_note(self.current_note_id, title, content)
+            if note is None:
+                QMessageBox.critical(self, "Ошибка", "Заметка не найдена")
+                return
+            self.status_bar.showMessage("Заметка обновлена")
         else:
-            # Создаем новую заметку
-            success, result = self.api.create_note(title, content)
-            if success:
-                QMessageBox.information(self, "Успех", "Заметка создана")
-                self.current_note_id = result['id']
-                self.load_notes()
-            else:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка создания: {result}")
+            note = self.store.create_note(title, content)
+            self.current_note_id = note['id']
+            self.status_bar.showMessage("Заметка создана")
+        self.notes_model.put_note(note)
+        self.sync.notify()
     
     def delete_note(self):
         if not self.current_note_id:
@@ -346,20 +523,23 @@ class NotesApp(QMainWindow):
                                    QMessageBox.Yes | QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            success, result = self.api.delete_note(self.current_note_id)
-            if success:
-                QMessageBox.information(self, "Успех", "Заметка удалена")
-                self.current_note_id = None
-                self.title_input.clear()
-                self.content_input.clear()
-                self.load_notes()
-            else:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка удаления: {result}")
+            note_id = self.store.resolve(self.current_note_id)
+            self.store.delete_note(note_id)
+            self.notes_model.remove_note(note_id)
+            self.sync.notify()
+            # Несохраненные правки удаленной заметки не нужны
+            self.current_note_id = None
+            self.saved_state = self.editor_state()
+            self.new_note()
+            self.status_bar.showMessage("Заметка удалена")
     
     def new_note(self):
+        self.autosave()
         self.current_note_id = None
+        self.saved_state = ("", "")
         self.title_input.clear()
         self.content_input.clear()
+        self.autosave_timer.stop()
     
     def about(self):
         QMessageBox.about(self, "О программе", 
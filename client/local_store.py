@@ -0,0 +1,411 @@
+"""
+Локальная копия заметок пользователя (офлайн-режим клиентов)
+
+Клиент читает и изменяет заметки в локальной базе SQLite, а изменения
+ставит в очередь (outbox). Движок синхронизации (sync.py) отправляет
+очередь на сервер пакетами и забирает изменения с сервера.
+
+Очередь сжимается: на каждую заметку в ней не больше одной операции
+(создание + правка = создание с новым текстом, правка + удаление =
+удаление, создание + удаление = ничего). Новая заметка получает
+временный id с префиксом local-; после отправки он заменяется на id,
+выданный сервером, а старый id остается в таблице id_map.
+
+Для каждой заметки хранится base_content - текст, который есть на
+сервере. Правка отправляется патчем относительно него (common/textdiff.py)
+с хешем базовой версии. Если сервер ответил, что версия другая (заметку
+изменили на другом устройстве), локальная правка сохраняется копией
+заметки с пометкой CONFLICT_SUFFIX, а сама заметка загружается с сервера
+заново. Правка заметки, удаленной на другом устройстве, создает ее на
+сервере заново.
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from common.hashtree import note_bucket, note_digest
+from common.textdiff import content_hash, make_patch, patch_size
+
+LOCAL_DIR = os.path.join(os.path.expanduser('~'), '.notes_sync')
+TEMP_PREFIX = 'local-'
+CONFLICT_SUFFIX = ' (конфликт)'
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS notes (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        base_content TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_notes_updated ON notes (updated_at, id);
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id TEXT NOT NULL UNIQUE,
+        op TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS id_map (
+        temp_id TEXT PRIMARY KEY,
+        id TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    ) WITHOUT ROWID;
+'''
+
+NOTE_FIELDS = ('id', 'title', 'content', 'created_at', 'updated_at')
+
+
+def utc_now():
+    """Текущее время в формате сервера (UTC, YYYY-MM-DD HH:MM:SS)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def store_path(base_url, user_id):
+    """Файл локальной базы для сервера и пользователя"""
+    host = base_url.split('://')[-1].split('/')[0].replace(':', '_')
+    return os.path.join(LOCAL_DIR, f'{host}_{user_id}.db')
+
+
+def remember_account(base_url, username, user_id):
+    """Запомнить пользователя, чтобы открыть его заметки без сети"""
+    accounts = _load_accounts()
+    accounts[f'{base_url} {username}'] = user_id
+    os.makedirs(LOCAL_DIR, exist_ok=True)
+    with open(os.path.join(LOCAL_DIR, 'accounts.json'), 'w', encoding='utf-8') as f:
+        json.dump(accounts, f, ensure_ascii=False)
+
+
+def known_account(base_url, username):
+    """user_id ранее входившего пользователя или None"""
+    return _load_accounts().get(f'{base_url} {username}')
+
+
+def _load_accounts():
+    try:
+        with open(os.path.join(LOCAL_DIR, 'accounts.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class LocalStore:
+    """Локальная база заметок одного пользователя с очередью изменений"""
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Базой пользуются и интерфейс, и поток синхронизации
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.executescript(SCHEMA)
+        columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(notes)')]
+        if 'base_content' not in columns:
+            # База, созданная до отправки правок патчами
+            self.conn.execute('ALTER TABLE notes ADD COLUMN base_content TEXT')
+        self.lock = threading.RLock()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- Чтение ---
+
+    def resolve(self, note_id):
+        """Текущий id заметки (временный id заменяется на серверный)"""
+        row = self.conn.execute('SELECT id FROM id_map WHERE temp_id = ?', (note_id,)).fetchone()
+        return row['id'] if row else note_id
+
+    def list_notes(self, limit=None, after=None):
+        """Заметки, свежие сверху; after - (updated_at, id) последней полученной"""
+        sql = 'SELECT id, title, created_at, updated_at FROM notes'
+        params = []
+        if after:
+            sql += ' WHERE (updated_at, id) < (?, ?)'
+            params += list(after)
+        sql += ' ORDER BY updated_at DESC, id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def get_note(self, note_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT id, title, content, created_at, updated_at FROM notes WHERE id = ?',
+                (self.resolve(note_id),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    # --- Локальные изменения ---
+
+    def create_note(self, title, content):
+        note = {
+            'id': TEMP_PREFIX + str(uuid.uuid4()),
+            'title': title,
+            'content': content,
+            'created_at': utc_now(),
+            'updated_at': utc_now(),
+        }
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO notes (id, title, content, created_at, updated_at) '
+                'VALUES (:id, :title, :content, :created_at, :updated_at)', note
+            )
+            self._enqueue(note['id'], 'create')
+        return note
+
+    def update_note(self, note_id, title=None, content=None):
+        """Изменить заметку; None, если ее нет"""
+        with self.lock, self.conn:
+            note_id = self.resolve(note_id)
+            updated = self.conn.execute('''
+                UPDATE notes
+                SET title = COALESCE(?, title), content = COALESCE(?, content), updated_at = ?
+                WHERE id = ?
+            ''', (title, content, utc_now(), note_id)).rowcount
+            if not updated:
+                return None
+            self._enqueue(note_id, 'update')
+        return self.get_note(note_id)
+
+    def delete_note(self, note_id):
+        with self.lock, self.conn:
+            note_id = self.resolve(note_id)
+            deleted = self.conn.execute('DELETE FROM notes WHERE id = ?', (note_id,)).rowcount
+            if deleted:
+                self._enqueue(note_id, 'delete')
+        return bool(deleted)
+
+    def _enqueue(self, note_id, op):
+        row = self.conn.execute('SELECT op FROM outbox WHERE note_id = ?', (note_id,)).fetchone()
+        if row is None:
+            self.conn.execute('INSERT INTO outbox (note_id, op) VALUES (?, ?)', (note_id, op))
+            return
+        if op == 'delete' and row['op'] == 'create':
+            # Заметка не дошла до сервера - отправлять нечего
+            self.conn.execute('DELETE FROM outbox WHERE note_id = ?', (note_id,))
+            return
+        # Создание остается созданием (с новым текстом), правка + удаление = удаление
+        op = 'create' if row['op'] == 'create' else op
+        self.conn.execute(
+            'UPDATE outbox SET op = ?, version = version + 1 WHERE note_id = ?', (op, note_id)
+        )
+
+    # --- Синхронизация ---
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def pending(self, limit):
+        """Операции очереди для отправки: (seq, version, операция для API, текст)"""
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT o.seq, o.version, o.op, o.note_id, n.title, n.content, n.base_content
+                FROM outbox o LEFT JOIN notes n ON n.id = o.note_id
+                ORDER BY o.seq LIMIT ?
+            ''', (limit,)).fetchall()
+        batch = []
+        for row in rows:
+            operation = {'op': row['op'], 'id': row['note_id']}
+            if row['op'] != 'delete':
+                operation['title'] = row['title']
+                operation['content'] = row['content']
+            if row['op'] == 'update' and row['base_content'] is not None:
+                patch = make_patch(row['base_content'], row['content'])
+                # Патч выгоден, только если он заметно меньше полного текста
+                if patch_size(patch) < len(row['content']) // 2:
+                    operation = {
+                        'op': 'patch',
+                        'id': row['note_id'],
+                        'title': row['title'],
+                        'base_hash': content_hash(row['base_content']),
+                        'patch': patch,
+                    }
+            batch.append((row['seq'], row['version'], operation, row['content']))
+        return batch
+
+    def pending_ids(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT note_id FROM outbox')}
+
+    def tree_entries(self):
+        """(корзина, отпечаток, id) заметок без неотправленных изменений, по корзинам"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, title, content FROM notes WHERE id NOT IN (SELECT note_id FROM outbox)'
+            ).fetchall()
+        return sorted((note_bucket(row['id']), note_digest(row['id'], row['title'], row['content']), row['id'])
+                      for row in rows)
+
+    def acknowledge(self, sent, results, ids):
+        """Учесть ответ сервера на пакет
+
+        Возвращает ({старый id: новый id}, {id заметки: id копии с
+        конфликтующей правкой}).
+        """
+        remapped, conflicts = {}, {}
+        with self.lock, self.conn:
+            for (seq, version, operation, content), result in zip(sent, results):
+                status = result.get('status')
+                note_id = operation['id']
+                if operation['op'] == 'patch' and status == 'conflict':
+                    copy_id = self._keep_conflict(note_id)
+                    if copy_id:
+                        conflicts[note_id] = copy_id
+                    continue
+                if operation['op'] == 'patch' and status == 'invalid':
+                    # Патч не подошел к той же версии: следующая отправка - полным текстом
+                    self.conn.execute(
+                        'UPDATE notes SET base_content = NULL WHERE id = ?', (note_id,)
+                    )
+                    continue
+                if operation['op'] in ('update', 'patch') and status == 'not_found':
+                    # Заметку удалили на другом устройстве, а здесь правили:
+                    # правку не теряем - заметка будет создана заново
+                    # (если ее успели удалить и здесь, удалять на сервере нечего)
+                    self.conn.execute("DELETE FROM outbox WHERE seq = ? AND op = 'delete'", (seq,))
+                    self.conn.execute(
+                        "UPDATE outbox SET op = 'create' WHERE seq = ?", (seq,)
+                    )
+                    self.conn.execute(
+                        'UPDATE notes SET base_content = NULL WHERE id = ?', (note_id,)
+                    )
+                    continue
+                if status == 'invalid':
+                    # Сервер не примет операцию и при повторе - убираем ее из очереди
+                    self.conn.execute('DELETE FROM outbox WHERE seq = ?', (seq,))
+                    continue
+                new_id = ids.get(note_id)
+                if operation['op'] == 'create' and new_id:
+                    self._remap(note_id, new_id)
+                    remapped[note_id] = new_id
+                    if not self.conn.execute(
+                        'SELECT 1 FROM outbox WHERE seq = ?', (seq,)
+                    ).fetchone():
+                        # Заметку удалили, пока пакет был в пути: удаляем и на сервере
+                        self.conn.execute(
+                            "INSERT INTO outbox (note_id, op) VALUES (?, 'delete')", (new_id,)
+                        )
+                        continue
+                if status in ('created', 'updated', 'patched'):
+                    # Отправленный текст теперь на сервере - база для следующего патча
+                    self.conn.execute(
+                        'UPDATE notes SET base_content = ? WHERE id = ?', (content, new_id or note_id)
+                    )
+                # Если заметку изменили, пока пакет был в пути, операция остается
+                # в очереди: созданная заметка теперь требует правки
+                changed = self.conn.execute(
+                    'SELECT 1 FROM outbox WHERE seq = ? AND version != ?', (seq, version)
+                ).fetchone()
+                if changed and new_id:
+                    self.conn.execute(
+                        "UPDATE outbox SET op = CASE op WHEN 'create' THEN 'update' ELSE op END "
+                        "WHERE seq = ?", (seq,)
+                    )
+                elif not changed:
+                    self.conn.execute('DELETE FROM outbox WHERE seq = ?', (seq,))
+        return remapped, conflicts
+
+    def _keep_conflict(self, note_id):
+        """Сохранить локальную правку копией заметки; вернуть id копии
+
+        Сама заметка больше не ждет отправки и попадает в список
+        refetch_ids: ее версия с сервера загружается при следующей
+        синхронизации. None - заметку удалили здесь, пока пакет был в пути.
+        """
+        note = self.conn.execute(
+            'SELECT title, content FROM notes WHERE id = ?', (note_id,)
+        ).fetchone()
+        if note is None:
+            return None
+        copy_id = TEMP_PREFIX + str(uuid.uuid4())
+        self.conn.execute(
+            'INSERT INTO notes (id, title, content, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (copy_id, note['title'] + CONFLICT_SUFFIX, note['content'], utc_now(), utc_now())
+        )
+        self._enqueue(copy_id, 'create')
+        self.conn.execute('DELETE FROM outbox WHERE note_id = ?', (note_id,))
+        self.conn.execute('UPDATE notes SET base_content = NULL WHERE id = ?', (note_id,))
+        refetch = set(json.loads(self._meta('refetch') or '[]')) | {note_id}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('refetch', ?)", (json.dumps(sorted(refetch)),)
+        )
+        return copy_id
+
+    def refetch_ids(self):
+        """Заметки, серверную версию которых нужно загрузить заново"""
+        with self.lock:
+            return json.loads(self._meta('refetch') or '[]')
+
+    def clear_refetch(self, note_ids):
+        with self.lock, self.conn:
+            refetch = set(json.loads(self._meta('refetch') or '[]')) - set(note_ids)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('refetch', ?)", (json.dumps(sorted(refetch)),)
+            )
+
+    def _remap(self, old_id, new_id):
+        self.conn.execute('UPDATE notes SET id = ? WHERE id = ?', (new_id, old_id))
+        self.conn.execute('UPDATE outbox SET note_id = ? WHERE note_id = ?', (new_id, old_id))
+        self.conn.execute('UPDATE id_map SET id = ? WHERE id = ?', (new_id, old_id))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO id_map (temp_id, id) VALUES (?, ?)', (old_id, new_id)
+        )
+
+    def apply_remote(self, notes, deleted):
+        """Применить изменения с сервера; вернуть (измененные id, удаленные id)"""
+        changed, removed = [], []
+        with self.lock, self.conn:
+            pending = {row[0]: row[1] for row in self.conn.execute('SELECT note_id, op FROM outbox')}
+            for note in notes:
+                # Неотправленная локальная правка новее - она перезапишет серверную
+                if note['id'] in pending:
+                    continue
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO notes '
+                    '(id, title, content, created_at, updated_at, base_content) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    tuple(note[field] for field in NOTE_FIELDS) + (note['content'],)
+                )
+                changed.append(note['id'])
+            for note_id in deleted:
+                op = pending.get(note_id)
+                if op in ('update', 'create'):
+                    # Заметку удалили на другом устройстве, а здесь правили:
+                    # правку не теряем - заметка будет создана заново
+                    self.conn.execute(
+                        "UPDATE outbox SET op = 'create' WHERE note_id = ?", (note_id,)
+                    )
+                    continue
+                if self.conn.execute('DELETE FROM notes WHERE id = ?', (note_id,)).rowcount:
+                    removed.append(note_id)
+        return changed, removed
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            value = self._meta(key)
+        return default if value is None else value
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value)
+            )
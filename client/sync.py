@@ -0,0 +1,260 @@
+"""
+Фоновая синхронизация локальной копии заметок с сервером
+
+SyncEngine в отдельном потоке:
+1. отправляет очередь локальных изменений пакетами (POST /api/notes/batch);
+   правка, попавшая в конфликт с версией на сервере, остается копией
+   заметки, а сама заметка загружается с сервера заново;
+2. забирает изменения с сервера с момента прошлой синхронизации
+   (GET /api/sync) и применяет их к локальной базе.
+
+Если метки прошлой синхронизации нет, а локальные заметки есть, или
+клиент не синхронизировался дольше RECONCILE_AFTER, вместо загрузки
+изменений копия сверяется с сервером по дереву хешей
+(POST /api/sync/reconcile, common/hashtree.py): передаются хеши только
+несовпавших узлов и только отличающиеся заметки.
+
+Цикл запускается сразу после локального изменения (notify) и
+периодически. Без сети клиент продолжает работать с локальной базой,
+а синхронизация повторяется с растущей паузой.
+
+Транспорт - common.api_client.ApiClient (или объект с такими же методами
+push_batch, sync_changes и reconcile, бросающими ApiError).
+"""
+import bisect
+import threading
+import time
+from datetime import datetime, timezone
+
+from common import hashtree
+from common.api_client import ApiError
+
+BATCH_SIZE = 100
+SYNC_INTERVAL = 30      # секунд между периодическими синхронизациями
+NOTIFY_DELAY = 1.0      # пауза после изменения: несколько правок уйдут одним пакетом
+MAX_BACKOFF = 300
+RECONCILE_AFTER = 7 * 24 * 3600  # секунд без синхронизации, после которых копия сверяется
+RECONCILE_NODES = 256            # узлов дерева в одном запросе сверки
+RECONCILE_FETCH = 500            # заметок в одном запросе загрузки
+
+
+class SyncError(Exception):
+    """Сервер недоступен или отклонил запрос синхронизации"""
+
+
+class SyncEngine(threading.Thread):
+    """Поток синхронизации локальной базы с сервером"""
+    def __init__(self, store, api, interval=SYNC_INTERVAL, on_change=None):
+        super().__init__(name='notes-sync', daemon=True)
+        self.store = store
+        self.api = api
+        self.interval = interval
+        # on_change(измененные id, удаленные id, {временный id: серверный id})
+        # вызывается из потока синхронизации
+        self.on_change = on_change
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.sync_lock = threading.Lock()
+        self.online = None
+        self.last_sync = None
+        self.last_error = None
+        self.failures = 0
+
+    def notify(self):
+        """Есть локальные изменения - синхронизировать в ближайшее время"""
+        self.wakeup.set()
+
+    def stop(self, flush=True, timeout=10):
+        """Остановить поток; flush - попытаться отправить очередь"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+        if flush and self.store.pending_count():
+            try:
+                self.push()
+            except SyncError:
+                pass
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.sync_once()
+            delay = self.interval
+            if self.failures:
+                delay = min(MAX_BACKOFF, self.interval * 2 ** (self.failures - 1))
+            if self.wakeup.wait(delay):
+                self.wakeup.clear()
+                if not self.stopping.is_set():
+                    # Даем дописать серию правок
+                    self.stopping.wait(NOTIFY_DELAY)
+
+    def sync_once(self):
+        """Отправить очередь и забрать изменения; True при успехе"""
+        try:
+            self.push()
+            self.pull()
+        except SyncError as e:
+            self.online = False
+            self.last_error = str(e)
+            self.failures += 1
+            return False
+        self.online = True
+        self.last_error = None
+        self.failures = 0
+        self.last_sync = time.time()
+        return True
+
+    def push(self):
+        """Отправить всю очередь локальных изменений пакетами"""
+        with self.sync_lock:
+            while True:
+                sent = self.store.pending(BATCH_SIZE)
+                if not sent:
+                    return
+                try:
+                    result = self.api.push_batch([operation for _, _, operation, _ in sent])
+                except ApiError as e:
+                    raise SyncError(str(e)) from e
+                remapped, conflicts = self.store.acknowledge(sent, result['results'], result['ids'])
+                if remapped or conflicts:
+                    # Копии с конфликтующими правками - новые локальные заметки
+                    self._changed(list(conflicts.values()), [], remapped)
+
+    def pull(self):
+        """Забрать изменения с сервера с момента прошлой синхронизации"""
+        self.refetch()
+        if self.needs_reconcile():
+            self.reconcile()
+            return
+        with self.sync_lock:
+            since = self.store.get_meta('since')
+            cursor = None
+            server_time = None
+            while True:
+                try:
+                    result = self.api.sync_changes(since, cursor)
+                except ApiError as e:
+                    raise SyncError(str(e)) from e
+                # Граница следующей синхронизации - по первой странице
+                server_time = server_time or result['server_time']
+                changed, removed = self.store.apply_remote(result['notes'], result['deleted'])
+                if changed or removed:
+                    self._changed(changed, removed, {})
+                cursor = result['next_cursor']
+                if not cursor:
+                    break
+            self.store.set_meta('since', server_time)
+
+    def refetch(self):
+        """Загрузить серверные версии заметок, правки которых были в конфликте
+
+        Их изменения уже пропущены метками since, поэтому заметки
+        запрашиваются по id; отсутствующие на сервере удаляются.
+        """
+        with self.sync_lock:
+            note_ids = self.store.refetch_ids()
+            for start in range(0, len(note_ids), RECONCILE_FETCH):
+                chunk = note_ids[start:start + RECONCILE_FETCH]
+                result = self._reconcile_call(fetch=chunk)
+                found = {note['id'] for note in result['notes']}
+                changed, removed = self.store.apply_remote(
+                    result['notes'], [note_id for note_id in chunk if note_id not in found]
+                )
+                self.store.clear_refetch(chunk)
+                if changed or removed:
+                    self._changed(changed, removed, {})
+
+    def needs_reconcile(self):
+        """Метка since потеряна или слишком старая, а локальные заметки есть"""
+        if not self.store.count():
+            return False
+        since = self.store.get_meta('since')
+        if not since:
+            return True
+        try:
+            last = datetime.strptime(since, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            return True
+        return time.time() - last.timestamp() > RECONCILE_AFTER
+
+    def reconcile(self):
+        """Сверить локальную копию с сервером по дереву хешей
+
+        Спуск начинается с корня: сервер возвращает для каждого
+        несовпавшего узла хеши детей или, если заметок под узлом мало, их
+        отпечатки. Отличающиеся заметки загружаются, отсутствующие на
+        сервере - удаляются. Возвращает {'requests', 'fetched', 'deleted'}.
+        """
+        with self.sync_lock:
+            entries = self.store.tree_entries()
+            buckets = [entry[0] for entry in entries]
+            local = {note_id: hashtree.format_hash(digest) for _, digest, note_id in entries}
+
+            def under(prefix):
+                # entries отсортированы по корзине: узел - непрерывный отрезок
+                return entries[bisect.bisect_left(buckets, prefix):bisect.bisect_left(buckets, prefix + 'g')]
+
+            stats = {'requests': 0, 'fetched': 0, 'deleted': 0}
+            server_time = None
+            fetch, deleted = [], []
+            frontier = {'': hashtree.node_hash(digest for _, digest, _ in entries)}
+            while frontier:
+                prefixes = list(frontier)
+                next_frontier = {}
+                for start in range(0, len(prefixes), RECONCILE_NODES):
+                    result = self._reconcile_call(
+                        nodes={prefix: frontier[prefix] for prefix in prefixes[start:start + RECONCILE_NODES]}
+                    )
+                    stats['requests'] += 1
+                    server_time = server_time or result['server_time']
+                    for prefix, node in result['nodes'].items():
+                        mine = under(prefix)
+                        if 'children' in node:
+                            children = hashtree.children_hashes(mine, prefix)
+                            for child, child_hash in node['children'].items():
+                                if children.get(child, hashtree.EMPTY) != child_hash:
+                                    next_frontier[child] = children.get(child, hashtree.EMPTY)
+                            # Узлов нет на сервере - все их заметки удалены
+                            for child in children.keys() - node['children'].keys():
+                                deleted += [note_id for *_, note_id in under(child)]
+                        else:
+                            notes = node['notes']
+                            fetch += [note_id for note_id, digest in notes.items() if local.get(note_id) != digest]
+                            deleted += [note_id for *_, note_id in mine if note_id not in notes]
+                frontier = next_frontier
+
+            # Неотправленные правки новее серверных версий
+            pending = self.store.pending_ids()
+            fetch = [note_id for note_id in fetch if note_id not in pending]
+            for start in range(0, len(fetch), RECONCILE_FETCH):
+                result = self._reconcile_call(fetch=fetch[start:start + RECONCILE_FETCH])
+                stats['requests'] += 1
+                changed, _ = self.store.apply_remote(result['notes'], [])
+                stats['fetched'] += len(changed)
+                if changed:
+                    self._changed(changed, [], {})
+            _, removed = self.store.apply_remote([], deleted)
+            stats['deleted'] = len(removed)
+            if removed:
+                self._changed([], removed, {})
+            if server_time:
+                self.store.set_meta('since', server_time)
+            return stats
+
+    def _reconcile_call(self, nodes=None, fetch=None):
+        try:
+            return self.api.reconcile(nodes=nodes, fetch=fetch)
+        except ApiError as e:
+            raise SyncError(str(e)) from e
+
+    def status(self):
+        return {
+            'online': self.online,
+            'pending': self.store.pending_count(),
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+        }
+
+    def _changed(self, changed, removed, remapped):
+        if self.on_change:
+            self.on_change(changed, removed, remapped)
@@ -0,0 +1,143 @@
+"""
+Фоновое выполнение запросов к API для GUI клиента
+
+Вызовы ApiClient выполняются в пуле потоков (QThreadPool), результат
+возвращается в поток интерфейса сигналом. Окно не блокируется на время
+запроса.
+
+    worker = ApiWorker()
+    worker.run(api.get_note, note_id, key='open_note', on_done=self.show_note)
+
+on_done(успех, результат): результат - возвращенное значение или, если
+вызов бросил исключение (ApiError и т.п.), текст ошибки.
+
+- key - задачи с одинаковым ключом вытесняют друг друга: новая отменяет
+  предыдущую (ее результат отбрасывается), а повтор еще не начатой задачи
+  с теми же аргументами не ставится в очередь второй раз;
+- cancellable=False - для изменяющих запросов (создание, удаление), их
+  результат нельзя терять;
+- сигнал activity(число задач, подпись) - для индикатора в строке состояния.
+"""
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+MAX_THREADS = 4
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object, bool, object)
+
+
+class ApiTask(QRunnable):
+    """Один вызов API в пуле потоков"""
+    def __init__(self, func, args, key, label, on_done, on_cancel, cancellable):
+        super().__init__()
+        # Объект задачи удаляет Python, а не пул
+        self.setAutoDelete(False)
+        self.func = func
+        self.args = args
+        self.key = key
+        self.label = label
+        self.on_done = on_done
+        self.on_cancel = on_cancel
+        self.cancellable = cancellable
+        self.signals = TaskSignals()
+        self.started = threading.Event()
+        self.cancelled = False
+
+    def run(self):
+        self.started.set()
+        success, result = False, None
+        if not self.cancelled:
+            try:
+                success, result = True, self.func(*self.args)
+            except Exception as e:
+                success, result = False, str(e)
+        # Сигнал отправляется и после отмены: по нему задача освобождается
+        self.signals.finished.emit(self, success, result)
+
+
+class ApiWorker(QObject):
+    """Очередь запросов к API с отменой и объединением повторов"""
+    activity = pyqtSignal(int, str)
+
+    def __init__(self, parent=None, max_threads=MAX_THREADS):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.tasks = set()
+        self.by_key = {}
+        # Отмененные, но еще выполняющиеся задачи: ссылка нужна до их завершения
+        self.orphans = set()
+
+    def run(self, func, *args, key=None, label="", on_done=None, on_cancel=None,
+            cancellable=True):
+        """Поставить вызов func(*args) в очередь; on_done(успех, результат)"""
+        previous = self.by_key.get(key) if key is not None else None
+        if previous is not None:
+            if not previous.started.is_set() and previous.args == args:
+                return previous
+            self._cancel(previous)
+
+        task = ApiTask(func, args, key, label, on_done, on_cancel, cancellable)
+        task.signals.finished.connect(self._finished)
+        self.tasks.add(task)
+        if key is not None:
+            self.by_key[key] = task
+        self.pool.start(task)
+        self._report()
+        return task
+
+    def cancel(self, key):
+        """Отменить задачу с ключом key"""
+        task = self.by_key.get(key)
+        if task is not None:
+            self._cancel(task)
+            self._report()
+
+    def cancel_all(self):
+        """Отменить все отменяемые задачи"""
+        for task in list(self.tasks):
+            if task.cancellable:
+                self._cancel(task)
+        self._report()
+
+    def shutdown(self, timeout_ms=2000):
+        """Снять очередь и дождаться выполняющихся запросов (при закрытии окна)"""
+        self.cancel_all()
+        self.pool.waitForDone(timeout_ms)
+
+    @property
+    def busy(self):
+        return len(self.tasks)
+
+    def _cancel(self, task):
+        if not task.cancellable:
+            return
+        task.cancelled = True
+        # Еще не начатую задачу убираем из очереди; у начатой отбросим результат
+        if not self.pool.tryTake(task):
+            self.orphans.add(task)
+        self._forget(task)
+        if task.on_cancel:
+            task.on_cancel()
+
+    def _forget(self, task):
+        self.tasks.discard(task)
+        if task.key is not None and self.by_key.get(task.key) is task:
+            del self.by_key[task.key]
+
+    @pyqtSlot(object, bool, object)
+    def _finished(self, task, success, result):
+        if task.cancelled:
+            self.orphans.discard(task)
+            return
+        self._forget(task)
+        self._report()
+        if task.on_done:
+            task.on_done(success, result)
+
+    def _report(self):
+        labels = [task.label for task in self.tasks if task.label]
+        self.activity.emit(len(self.tasks), labels[-1] if labels else "")
@@ -0,0 +1,3 @@
+"""
+Общий код сервера и клиентов сервиса заметок
+"""
@@ -0,0 +1,461 @@
+"""
+Клиентская библиотека API сервиса заметок
+
+Два клиента с одинаковыми методами:
+- ApiClient - синхронный, на requests.Session с пулом соединений;
+- AsyncApiClient - asyncio, на собственных HTTP/1.1 keep-alive
+  соединениях (только стандартная библиотека), для пакетных
+  инструментов с сотнями одновременных запросов.
+
+    client = ApiClient('http://localhost:5000/api')
+    client.login('alice', 'secret')
+    note = client.create_note("Заголовок", "Текст")
+
+    async with AsyncApiClient(base_url, max_connections=200) as client:
+        await client.login('alice', 'secret')
+        notes = await asyncio.gather(*(client.get_note(i) for i in ids))
+
+Методы возвращают тело ответа, ошибки сервера - исключение ApiError,
+недоступность сервера - ServerUnavailable. У всех запросов есть таймаут.
+Ответы 429/503 (перегрузка) повторяются с паузой из Retry-After или
+экспоненциальной с джиттером; сетевые ошибки и 502/504 - только для
+идемпотентных запросов и для запросов, которые не успели уйти на сервер.
+"""
+import asyncio
+import json as jsonlib
+import random
+import time
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from common import cbor
+
+# Таймауты, с: установка соединения и ожидание ответа
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+# Соединений в пуле на один сервер
+POOL_SIZE = 10
+MAX_ASYNC_CONNECTIONS = 100
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+MAX_RETRY_DELAY = 30
+# Сервер не начинал обработку - повторять можно любой запрос
+OVERLOAD_STATUSES = (429, 503)
+# Запрос мог быть выполнен - повторяем только идемпотентные
+GATEWAY_STATUSES = (502, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+ACCEPT_CBOR = f"{cbor.MIMETYPE}, application/json;q=0.9"
+
+
+class ApiError(Exception):
+    """Сервер ответил ошибкой"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ServerUnavailable(ApiError):
+    """Сервер недоступен: нет соединения или истек таймаут"""
+    def __init__(self, message):
+        super().__init__(None, message)
+
+
+def retry_delay(attempt, retry_after=None):
+    """Пауза перед повтором: Retry-After или экспоненциальная с полным джиттером"""
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(MAX_RETRY_DELAY, BACKOFF_BASE * 2 ** attempt))
+    delay = min(MAX_RETRY_DELAY, max(0.0, delay))
+    return delay + random.uniform(0, 0.1 * delay)
+
+
+def should_retry(method, status):
+    return status in OVERLOAD_STATUSES or (status in GATEWAY_STATUSES and method in IDEMPOTENT_METHODS)
+
+
+def decode_body(content_type, data):
+    """Тело ответа из JSON или CBOR (по Content-Type)"""
+    if not data:
+        return {}
+    try:
+        if (content_type or '').startswith(cbor.MIMETYPE):
+            return cbor.loads(data)
+        return jsonlib.loads(data)
+    except ValueError:
+        # Например, HTML страница ошибки прокси
+        return {'error': data[:200].decode('utf-8', 'replace')}
+
+
+def decode_response(response):
+    """Тело ответа requests из JSON или CBOR"""
+    return decode_body(response.headers.get('Content-Type'), response.content)
+
+
+def encode_body(payload, use_cbor):
+    """Тело запроса и его Content-Type"""
+    if use_cbor:
+        return cbor.dumps(payload), cbor.MIMETYPE
+    return jsonlib.dumps(payload).encode('utf-8'), 'application/json'
+
+
+def error_message(status, body):
+    if isinstance(body, dict) and body.get('error'):
+        return str(body['error'])
+    return f"HTTP {status}"
+
+
+class _Endpoints:
+    """Методы API поверх _send; общие для синхронного и asyncio клиента
+
+    _send(method, path, expected, params, json, then) возвращает then(тело)
+    в синхронном клиенте и корутину с тем же результатом в asyncio.
+    """
+    user_id = None
+    username = None
+
+    def _logged_in(self, body):
+        self.user_id = body['user_id']
+        self.username = body.get('username', self.username)
+        return body
+
+    def register(self, username, password):
+        self.username = username
+        return self._send('POST', '/register', 201,
+                          json={'username': username, 'password': password}, then=self._logged_in)
+
+    def login(self, username, password):
+        self.username = username
+        return self._send('POST', '/login', 200,
+                          json={'username': username, 'password': password}, then=self._logged_in)
+
+    def list_notes(self, limit=None, cursor=None, fields=None):
+        """Страница списка заметок: {'notes', 'next_cursor'}"""
+        params = {'user_id': self.user_id}
+        if limit is not None:
+            params['limit'] = limit
+        if cursor:
+            params['cursor'] = cursor
+        if fields:
+            params['fields'] = fields
+        return self._send('GET', '/notes', 200, params=params)
+
+    def get_note(self, note_id):
+        return self._send('GET', f'/notes/{note_id}', 200, params={'user_id': self.user_id})
+
+    def render_html(self, note_id):
+        return self._send('GET', f'/notes/{note_id}/html', 200, params={'user_id': self.user_id})
+
+    def render_html_batch(self, note_ids):
+        """HTML нескольких заметок: {'results'} со статусом по каждому id"""
+        return self._send('POST', '/notes/html', 200,
+                          json={'user_id': self.user_id, 'ids': list(note_ids)})
+
+    def create_note(self, title, content):
+        return self._send('POST', '/notes', 201,
+                          json={'user_id': self.user_id, 'title': title, 'content': content})
+
+    def update_note(self, note_id, title=None, content=None):
+        payload = {'user_id': self.user_id}
+        if title is not None:
+            payload['title'] = title
+        if content is not None:
+            payload['content'] = content
+        return self._send('PUT', f'/notes/{note_id}', 200, json=payload)
+
+    def patch_note(self, note_id, base_hash, patch, title=None):
+        payload = {'user_id': self.user_id, 'base_hash': base_hash, 'patch': patch}
+        if title is not None:
+            payload['title'] = title
+        return self._send('PATCH', f'/notes/{note_id}', 200, json=payload)
+
+    def delete_note(self, note_id):
+        return self._send('DELETE', f'/notes/{note_id}', 200, params={'user_id': self.user_id})
+
+    def list_revisions(self, note_id):
+        """История заметки: {'revisions'}, новые первыми"""
+        return self._send('GET', f'/notes/{note_id}/revisions', 200, params={'user_id': self.user_id})
+
+    def get_revision(self, note_id, revision):
+        return self._send('GET', f'/notes/{note_id}/revisions/{revision}', 200,
+                          params={'user_id': self.user_id})
+
+    def push_batch(self, operations):
+        """Пакет изменений: {'results', 'ids'}"""
+        return self._send('POST', '/notes/batch', 200,
+                          json={'user_id': self.user_id, 'operations': operations})
+
+    def sync_changes(self, since=None, cursor=None, limit=None):
+        """Изменения с момента since: {'notes', 'deleted', 'next_cursor', 'server_time'}"""
+        params = {'user_id': self.user_id}
+        if since:
+            params['since'] = since
+        if cursor:
+            params['cursor'] = cursor
+        if limit is not None:
+            params['limit'] = limit
+        return self._send('GET', '/sync', 200, params=params)
+
+    def reconcile(self, nodes=None, fetch=None):
+        """Сверка по дереву хешей: {'nodes', 'notes', 'server_time'}"""
+        payload = {'user_id': self.user_id}
+        if nodes:
+            payload['nodes'] = nodes
+        if fetch:
+            payload['fetch'] = list(fetch)
+        return self._send('POST', '/sync/reconcile', 200, json=payload)
+
+    def submit_job(self, kind, params=None, priority=None):
+        """Поставить фоновое задание в очередь: его состояние с 'id'"""
+        payload = {'user_id': self.user_id, 'kind': kind, 'params': params or {}}
+        if priority is not None:
+            payload['priority'] = priority
+        return self._send('POST', '/jobs', 202, json=payload)
+
+    def get_job(self, job_id):
+        """Состояние задания: 'status', 'progress', 'result' (ссылка на файл)"""
+        return self._send('GET', f'/jobs/{job_id}', 200, params={'user_id': self.user_id})
+
+    def cancel_job(self, job_id):
+        return self._send('DELETE', f'/jobs/{job_id}', 200, params={'user_id': self.user_id})
+
+
+def _not_sent(error):
+    """Запрос не дошел до сервера (соединение не установлено)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class ApiClient(_Endpoints):
+    """Синхронный клиент API"""
+    def __init__(self, base_url, use_cbor=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=MAX_RETRIES, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.use_cbor = use_cbor
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        # Повторы делаем сами (с учетом Retry-After), у адаптера они выключены
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if use_cbor:
+            # Компактный двоичный формат вместо JSON; сервер поддерживает оба
+            self.session.headers['Accept'] = ACCEPT_CBOR
+
+    def call(self, method, path, params=None, json=None):
+        """Запрос с повторами: (код ответа, тело ответа)"""
+        response = self.request(method, path, params=params, json=json)
+        return response.status_code, decode_response(response)
+
+    def request(self, method, path, params=None, json=None, headers=None):
+        """Запрос с повторами; ответ requests без разбора тела"""
+        kwargs = {'params': params, 'timeout': self.timeout, 'headers': dict(headers or {})}
+        if json is not None:
+            kwargs['data'], kwargs['headers']['Content-Type'] = encode_body(json, self.use_cbor)
+        url = self.base_url + path
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                retryable = method in IDEMPOTENT_METHODS or _not_sent(e)
+                if not retryable or attempt == self.retries:
+                    raise ServerUnavailable(str(e)) from e
+                time.sleep(retry_delay(attempt))
+                continue
+            if not should_retry(method, response.status_code) or attempt == self.retries:
+                return response
+            time.sleep(retry_delay(attempt, response.headers.get('Retry-After')))
+
+    def _send(self, method, path, expected, params=None, json=None, then=None):
+        status, body = self.call(method, path, params=params, json=json)
+        if status != expected:
+            raise ApiError(status, error_message(status, body))
+        return then(body) if then else body
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- asyncio ---
+
+class AsyncHTTPConnection:
+    """HTTP/1.1 keep-alive соединение поверх asyncio"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    @property
+    def closed(self):
+        return self.writer is None or self.writer.is_closing()
+
+    async def request(self, method, target, body=b'', headers=None):
+        """Отправить запрос: (код ответа, заголовки, тело)"""
+        if self.closed:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Connection: keep-alive",
+            f"Content-Length: {len(body)}",
+        ]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Соединение закрыто сервером")
+        version, status = status_line.split()[:2]
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        connection = response_headers.get('connection', '').lower()
+        # HTTP/1.0 закрывает соединение, если явно не попросили keep-alive
+        keep_alive = connection != 'close' and (version != b'HTTP/1.0' or connection == 'keep-alive')
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked()
+        elif 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif method == 'HEAD' or status in (b'204', b'304'):
+            data = b''
+        else:
+            data = await self.reader.read()
+            keep_alive = False
+        if not keep_alive:
+            await self.close()
+        return int(status), response_headers, data
+
+    async def _read_chunked(self):
+        parts = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Завершающие заголовки не используются
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(parts)
+            parts.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+
+class AsyncApiClient(_Endpoints):
+    """asyncio клиент API с пулом keep-alive соединений"""
+    def __init__(self, base_url, use_cbor=True, timeout=READ_TIMEOUT, retries=MAX_RETRIES,
+                 max_connections=MAX_ASYNC_CONNECTIONS):
+        parts = urlsplit(base_url)
+        if parts.scheme != 'http':
+            raise ValueError("AsyncApiClient поддерживает только http://")
+        self.base_url = base_url.rstrip('/')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.use_cbor = use_cbor
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self.idle = []
+        self.slots = None
+
+    async def call(self, method, path, params=None, json=None):
+        """Запрос с повторами: (код ответа, тело ответа)"""
+        status, headers, data = await self.request(method, path, params=params, json=json)
+        return status, decode_body(headers.get('content-type'), data)
+
+    async def request(self, method, path, params=None, json=None, headers=None):
+        """Запрос с повторами: (код ответа, заголовки, тело без разбора)"""
+        target = self.prefix + path
+        if params:
+            target += '?' + urlencode({k: v for k, v in params.items() if v is not None})
+        headers = dict(headers or {})
+        body = b''
+        if json is not None:
+            body, headers['Content-Type'] = encode_body(json, self.use_cbor)
+        if self.use_cbor:
+            headers.setdefault('Accept', ACCEPT_CBOR)
+
+        for attempt in range(self.retries + 1):
+            try:
+                status, response_headers, data = await self._once(method, target, body, headers)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                # Для неидемпотентных запросов неизвестно, выполнил ли их сервер
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, ConnectionRefusedError)
+                if not retryable or attempt == self.retries:
+                    raise ServerUnavailable(str(e) or type(e).__name__) from e
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            if not should_retry(method, status) or attempt == self.retries:
+                return status, response_headers, data
+            await asyncio.sleep(retry_delay(attempt, response_headers.get('retry-after')))
+
+    async def _once(self, method, target, body, headers):
+        if self.slots is None:
+            # Семафор создается в цикле событий, в котором работает клиент
+            self.slots = asyncio.Semaphore(self.max_connections)
+        async with self.slots:
+            while self.idle:
+                conn = self.idle.pop()
+                try:
+                    return await self._exchange(conn, method, target, body, headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # Сервер закрыл простаивавшее соединение - повторяем на новом
+                    continue
+            conn = AsyncHTTPConnection(self.host, self.port)
+            return await self._exchange(conn, method, target, body, headers)
+
+    async def _exchange(self, conn, method, target, body, headers):
+        try:
+            result = await asyncio.wait_for(conn.request(method, target, body, headers), self.timeout)
+        except BaseException:
+            await conn.close()
+            raise
+        if not conn.closed:
+            self.idle.append(conn)
+        return result
+
+    async def _send(self, method, path, expected, params=None, json=None, then=None):
+        status, body = await self.call(method, path, params=params, json=json)
+        if status != expected:
+            raise ApiError(status, error_message(status, body))
+        return then(body) if then else body
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for conn in idle:
+            await conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
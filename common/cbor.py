@@ -0,0 +1,249 @@
+"""
+Компактный двоичный формат CBOR (RFC 8949) без внешних зависимостей
+
+Поддерживаются типы, которые встречаются в API заметок: None, bool,
+int (до 64 бит), float, str, bytes, list/tuple и dict. Декодер также
+понимает строки, массивы и словари неопределенной длины, float16/32 и
+теги (тег отбрасывается, возвращается значение). Вложенность массивов,
+словарей и тегов при декодировании ограничена MAX_DEPTH: данные приходят
+от клиентов, а декодер рекурсивный.
+
+    data = cbor.dumps({'notes': [...]})
+    obj = cbor.loads(data)
+"""
+import struct
+
+MIMETYPE = 'application/cbor'
+MAX_DEPTH = 100
+
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_FLOAT16 = struct.Struct('>e')
+_FLOAT32 = struct.Struct('>f')
+_FLOAT64 = struct.Struct('>d')
+
+_BREAK = object()
+
+
+class CBORError(ValueError):
+    """Некорректные данные CBOR или неподдерживаемый тип"""
+
+
+# --- Кодирование ---
+
+def _head(major, length):
+    """Начальный байт и аргумент элемента данных"""
+    major <<= 5
+    if length < 24:
+        return bytes((major | length,))
+    if length < 0x100:
+        return bytes((major | 24, length))
+    if length < 0x10000:
+        return bytes((major | 25,)) + _UINT16.pack(length)
+    if length < 0x100000000:
+        return bytes((major | 26,)) + _UINT32.pack(length)
+    if length < 0x10000000000000000:
+        return bytes((major | 27,)) + _UINT64.pack(length)
+    raise CBORError("Integer does not fit in 64 bits")
+
+
+def _encode(obj, out):
+    # Порядок проверок - по частоте типов в ответах API
+    kind = type(obj)
+    if kind is str:
+        data = obj.encode('utf-8')
+        out += _head(3, len(data))
+        out += data
+    elif kind is dict:
+        out += _head(5, len(obj))
+        for key, value in obj.items():
+            _encode(key, out)
+            _encode(value, out)
+    elif kind is int:
+        if obj >= 0:
+            out += _head(0, obj)
+        else:
+            out += _head(1, -1 - obj)
+    elif kind is list or kind is tuple:
+        out += _head(4, len(obj))
+        for item in obj:
+            _encode(item, out)
+    elif obj is None:
+        out.append(0xf6)
+    elif kind is bool:
+        out.append(0xf5 if obj else 0xf4)
+    elif kind is float:
+        out.append(0xfb)
+        out += _FLOAT64.pack(obj)
+    elif kind is bytes or kind is bytearray:
+        out += _head(2, len(obj))
+        out += obj
+    elif isinstance(obj, bool):
+        out.append(0xf5 if obj else 0xf4)
+    elif isinstance(obj, int):
+        _encode(int(obj), out)
+    elif isinstance(obj, str):
+        _encode(str(obj), out)
+    elif isinstance(obj, dict):
+        _encode(dict(obj), out)
+    elif isinstance(obj, (list, tuple)):
+        _encode(list(obj), out)
+    else:
+        raise CBORError(f"Cannot encode {kind.__name__} to CBOR")
+
+
+def dumps(obj):
+    """Закодировать объект в CBOR"""
+    out = bytearray()
+    _encode(obj, out)
+    return bytes(out)
+
+
+# --- Декодирование ---
+
+class _Decoder:
+    __slots__ = ('data', 'pos', 'depth')
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.depth = 0
+
+    def _take(self, count):
+        start = self.pos
+        end = start + count
+        if end > len(self.data):
+            raise CBORError("Unexpected end of CBOR data")
+        self.pos = end
+        return self.data[start:end]
+
+    def _argument(self, info):
+        if info < 24:
+            return info
+        if info == 24:
+            return self._take(1)[0]
+        if info == 25:
+            return _UINT16.unpack(self._take(2))[0]
+        if info == 26:
+            return _UINT32.unpack(self._take(4))[0]
+        if info == 27:
+            return _UINT64.unpack(self._take(8))[0]
+        if info == 31:
+            return None
+        raise CBORError(f"Invalid additional information {info}")
+
+    def decode(self, allow_break=False):
+        if self.pos >= len(self.data):
+            raise CBORError("Unexpected end of CBOR data")
+        initial = self.data[self.pos]
+        self.pos += 1
+        major = initial >> 5
+        info = initial & 0x1f
+
+        if major == 7:
+            return self._simple(info, allow_break)
+
+        length = self._argument(info)
+        if major == 0:
+            if length is None:
+                raise CBORError("Indefinite length integer")
+            return length
+        if major == 1:
+            if length is None:
+                raise CBORError("Indefinite length integer")
+            return -1 - length
+        if major == 2:
+            return self._string(length, major, bytes)
+        if major == 3:
+            return self._string(length, major, str)
+        # Массив, словарь или тег: при ошибке декодирование прерывается
+        # целиком, поэтому глубина восстанавливается только при успехе
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise CBORError(f"CBOR nesting deeper than {MAX_DEPTH}")
+        if major == 4:
+            if length is None:
+                result = []
+                while True:
+                    item = self.decode(allow_break=True)
+                    if item is _BREAK:
+                        break
+                    result.append(item)
+            else:
+                result = [self.decode() for _ in range(length)]
+        elif major == 5:
+            result = {}
+            try:
+                if length is None:
+                    while True:
+                        key = self.decode(allow_break=True)
+                        if key is _BREAK:
+                            break
+                        result[key] = self.decode()
+                else:
+                    for _ in range(length):
+                        key = self.decode()
+                        result[key] = self.decode()
+            except TypeError:
+                # Ключ - массив или словарь
+                raise CBORError("Unhashable CBOR map key")
+        else:
+            # major == 6: тег - возвращаем значение без интерпретации
+            if length is None:
+                raise CBORError("Indefinite length tag")
+            result = self.decode()
+        self.depth -= 1
+        return result
+
+    def _string(self, length, major, kind):
+        if length is None:
+            chunks = []
+            while True:
+                chunk = self.decode(allow_break=True)
+                if chunk is _BREAK:
+                    break
+                if not isinstance(chunk, kind):
+                    raise CBORError("Invalid chunk in indefinite length string")
+                chunks.append(chunk)
+            return (b'' if kind is bytes else '').join(chunks)
+        data = self._take(length)
+        if kind is bytes:
+            return bytes(data)
+        try:
+            return str(data, 'utf-8')
+        except UnicodeDecodeError:
+            raise CBORError("Invalid UTF-8 in text string")
+
+    def _simple(self, info, allow_break):
+        if info == 20:
+            return False
+        if info == 21:
+            return True
+        if info in (22, 23):
+            return None
+        if info == 25:
+            return _FLOAT16.unpack(self._take(2))[0]
+        if info == 26:
+            return _FLOAT32.unpack(self._take(4))[0]
+        if info == 27:
+            return _FLOAT64.unpack(self._take(8))[0]
+        if info == 31 and allow_break:
+            return _BREAK
+        if info < 24:
+            return info
+        if info == 24:
+            return self._take(1)[0]
+        raise CBORError(f"Unsupported simple value {info}")
+
+
+def loads(data):
+    """Декодировать CBOR в объект Python"""
+    if isinstance(data, (bytearray, memoryview)):
+        data = bytes(data)
+    decoder = _Decoder(data)
+    result = decoder.decode()
+    if decoder.pos != len(data):
+        raise CBORError("Extra data after CBOR item")
+    return result
@@ -0,0 +1,61 @@
+"""
+Дерево хешей заметок для сверки клиента с сервером
+
+У каждой заметки два хеша:
+- корзина (bucket) - первые BUCKET_CHARS hex-символов SHA-256 ее id;
+  не меняется при правках и задает место заметки в дереве;
+- отпечаток (digest) - 64 бита SHA-256 id, заголовка и содержимого.
+
+Узел дерева - префикс корзины (корень - пустая строка, у узла 16 детей
+по следующему hex-символу), его хеш - XOR отпечатков заметок под ним.
+XOR не зависит от порядка и формы дерева, поэтому клиент и сервер
+считают хеш любого узла по своим заметкам независимо. Совпадение хешей
+означает совпадение заметок под узлом: при сверке спускаются только в
+несовпавшие узлы, а узлы до LEAF_SIZE заметок передаются списком
+отпечатков.
+"""
+import hashlib
+
+BUCKET_CHARS = 8
+FANOUT_CHARS = '0123456789abcdef'
+LEAF_SIZE = 32
+EMPTY = '0' * 16
+
+
+def note_bucket(note_id):
+    """Корзина заметки по ее id"""
+    return hashlib.sha256(note_id.encode('utf-8')).hexdigest()[:BUCKET_CHARS]
+
+
+def note_digest(note_id, title, content):
+    """Отпечаток заметки: 64-битное целое со знаком (помещается в INTEGER SQLite)"""
+    data = '\0'.join((note_id, title, content)).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], 'big', signed=True)
+
+
+def format_hash(value):
+    """Хеш (XOR отпечатков) в виде 16 hex-символов"""
+    return format(value & 0xFFFFFFFFFFFFFFFF, '016x')
+
+
+def is_prefix(value):
+    return (isinstance(value, str) and len(value) <= BUCKET_CHARS
+            and all(c in FANOUT_CHARS for c in value))
+
+
+def node_hash(digests):
+    """Хеш узла по отпечаткам заметок под ним"""
+    value = 0
+    for digest in digests:
+        value ^= digest
+    return format_hash(value)
+
+
+def children_hashes(entries, prefix):
+    """Хеши непустых детей узла prefix; entries - (корзина, отпечаток, ...) под ним"""
+    position = len(prefix)
+    children = {}
+    for bucket, digest, *_ in entries:
+        child = bucket[:position + 1]
+        children[child] = children.get(child, 0) ^ digest
+    return {child: format_hash(value) for child, value in children.items()}
@@ -0,0 +1,97 @@
+"""
+Компактный diff текста заметки для передачи изменений
+
+Патч - список замен [начало, конец, новый текст] в позициях символов
+исходного текста, по возрастанию позиций. Общие начало и конец текста
+отбрасываются сразу, середина сравнивается по строкам.
+
+    patch = make_patch(old, new)
+    assert apply_patch(old, patch) == new
+
+Проверка версии - по content_hash: патч применяется только к тому же
+тексту, от которого он построен.
+"""
+import difflib
+import hashlib
+
+
+class PatchError(ValueError):
+    """Патч не подходит к тексту"""
+
+
+def content_hash(text):
+    """Хеш текста заметки (SHA-256, hex)"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _common_prefix(a, b):
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, b, prefix):
+    limit = min(len(a), len(b)) - prefix
+    i = 0
+    while i < limit and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+
+def make_patch(old, new):
+    """Список замен, превращающих old в new"""
+    if old == new:
+        return []
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, prefix)
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    old_lines = old_middle.splitlines(keepends=True)
+    new_lines = new_middle.splitlines(keepends=True)
+    if len(old_lines) <= 1 or len(new_lines) <= 1:
+        return [[prefix, prefix + len(old_middle), new_middle]]
+
+    # Позиции начала строк середины в исходном и новом тексте
+    old_starts = [prefix]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    new_starts = [0]
+    for line in new_lines:
+        new_starts.append(new_starts[-1] + len(line))
+
+    patch = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        patch.append([old_starts[i1], old_starts[i2], new_middle[new_starts[j1]:new_starts[j2]]])
+    return patch
+
+
+def apply_patch(old, patch):
+    """Применить патч; PatchError, если замены не подходят к тексту"""
+    if not isinstance(patch, list):
+        raise PatchError("Patch must be a list")
+    parts = []
+    position = 0
+    for splice in patch:
+        if not (isinstance(splice, list) and len(splice) == 3):
+            raise PatchError("Splice must be [start, end, text]")
+        start, end, text = splice
+        if not (isinstance(start, int) and isinstance(end, int) and isinstance(text, str)):
+            raise PatchError("Splice must be [start, end, text]")
+        if not position <= start <= end <= len(old):
+            raise PatchError("Splices overlap or are out of range")
+        parts.append(old[position:start])
+        parts.append(text)
+        position = end
+    parts.append(old[position:])
+    return ''.join(parts)
+
+
+def patch_size(patch):
+    """Примерный объем патча в символах (для выбора между патчем и полным текстом)"""
+    return sum(len(text) + 16 for _, _, text in patch)
@@ -18,9 +18,6 @@ def start_server():
         '/workspace/server/app.py'
     ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     
-    # Ждем, пока сервер запустится
-    time.sleep(3)
-    
     # Проверяем, запустился ли сервер
     if server_process.poll() is not None:
         stdout, stderr = server_process.communicate()
@@ -30,18 +27,23 @@ def start_server():
     print(f"Сервер запущен с PID: {server_process.pid}")
     return server_process
 
-def wait_for_server_ready():
-    """Ожидание готовности сервера к работе"""
+def wait_for_server_ready(server_process, timeout=30):
+    """Ожидание готовности сервера к работе (опрос /readyz)"""
     print("Ожидание готовности сервера...")
-    for i in range(10):  # Попробуем 10 раз
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if server_process.poll() is not None:
+            stdout, stderr = server_process.communicate()
+            print(f"Сервер завершился при запуске: {stderr.decode()}")
+            return False
         try:
-            response = requests.get('http://localhost:5000/api/notes?user_id=1', timeout=5)
-            # Сервер готов, если он отвечает, даже если с ошибкой
-            print("Сервер готов к работе")
-            return True
-        except requests.exceptions.ConnectionError:
-            print(f"Сервер еще не готов, ждем... ({i+1}/10)")
-            time.sleep(1)
+            response = requests.get('http://localhost:5000/readyz', timeout=1)
+            if response.status_code == 200:
+                print(f"Сервер готов к работе ({time.monotonic() - started:.2f} с)")
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
     
     print("Сервер не ответил в течение отведенного времени")
     return False
@@ -86,7 +88,7 @@ def main():
         sys.exit(1)
     
     # Ждем готовности сервера
-    if not wait_for_server_ready():
+    if not wait_for_server_ready(server_process):
         stop_server(server_process)
         sys.exit(1)
     
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Нагрузочное тестирование сервиса синхронизированных заметок
+
+Запускает множество виртуальных пользователей (потоки или asyncio),
+которые выполняют смесь операций: вход, автосохранение, опрос списка
+заметок и рендеринг HTML. По итогам выводит пропускную способность и
+перцентили задержек p50/p95/p99 по каждой операции, сохраняет результат
+в JSON и сравнивает его с предыдущим базовым прогоном.
+
+Примеры:
+    python load_test.py --users 100 --duration 30
+    python load_test.py --users 1000 --mix login-storm --workers asyncio
+    python load_test.py --users 100 --save-baseline baseline.json
+    python load_test.py --users 100 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from common.api_client import (ApiClient, AsyncApiClient, ApiError, ServerUnavailable,
+                               error_message)
+
+BASE_URL = 'http://localhost:5000/api'
+
+# Готовые профили нагрузки: вес каждой операции в смеси
+MIXES = {
+    'default': {'login': 1, 'autosave': 4, 'list': 4, 'html': 1},
+    'login-storm': {'login': 10, 'list': 1},
+    'autosave': {'autosave': 10, 'list': 1},
+    'polling': {'list': 10, 'autosave': 1},
+    'render': {'html': 10, 'list': 1},
+}
+
+OPERATIONS = ('login', 'autosave', 'list', 'html')
+# Операции над стартовыми заметками пользователя
+NOTE_OPERATIONS = ('autosave', 'html')
+
+NOTE_TEMPLATE = (
+    "# Заметка нагрузочного теста {n}\n\n"
+    "Это **тестовая** заметка для проверки производительности.\n\n"
+    "- Элемент списка 1\n- Элемент списка 2\n\n"
+    "```python\nfor i in range({n}):\n    print(i)\n```\n"
+)
+
+
+def parse_mix(value):
+    """Разобрать смесь операций: имя профиля или 'login=1,list=5,...'"""
+    if value in MIXES:
+        return dict(MIXES[value])
+
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Неизвестная операция: {name}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Неверный вес операции: {part}")
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("Смесь операций пуста")
+    return mix
+
+
+def percentile(sorted_values, p):
+    """Перцентиль с линейной интерполяцией по отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Recorder:
+    """Потокобезопасный сборщик задержек по операциям"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, op, latency, ok):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def summary(self, elapsed):
+        """Сводка: пропускная способность и перцентили в миллисекундах"""
+        operations = {}
+        all_latencies = []
+        total_errors = 0
+        for op, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            all_latencies.extend(values)
+            errors = self.errors.get(op, 0)
+            total_errors += errors
+            operations[op] = _stats(values, errors, elapsed)
+
+        all_latencies.sort()
+        return {
+            'operations': operations,
+            'total': _stats(all_latencies, total_errors, elapsed),
+        }
+
+
+def _stats(values, errors, elapsed):
+    return {
+        'count': len(values),
+        'errors': errors,
+        'throughput': round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_ms': round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+class VirtualUser:
+    """Состояние одного виртуального пользователя"""
+    def __init__(self, index, username, password, seed):
+        self.index = index
+        self.username = username
+        self.password = password
+        self.user_id = None
+        self.note_ids = []
+        self.rng = random.Random(seed)
+        self.counter = 0
+
+    def next_content(self):
+        self.counter += 1
+        return NOTE_TEMPLATE.format(n=self.counter) + f"\nПравка {self.counter}: {uuid.uuid4()}\n"
+
+
+# --- Потоковые воркеры ---
+
+def make_client(base_url, pool_size):
+    """Клиент для нагрузки: JSON (как в базовых прогонах) и без повторов,
+    чтобы отказы сервера попадали в статистику"""
+    return ApiClient(base_url, use_cbor=False, retries=0, pool_size=pool_size)
+
+
+def check(status, body, expected=(200,)):
+    if status not in expected:
+        raise ApiError(status, error_message(status, body))
+    return body
+
+
+def setup_user(client, user, notes_per_user):
+    """Регистрация (или вход) пользователя и создание стартовых заметок"""
+    credentials = {'username': user.username, 'password': user.password}
+    status, body = client.call('POST', '/register', json=credentials)
+    if status != 201:
+        body = check(*client.call('POST', '/login', json=credentials))
+    user.user_id = body['user_id']
+
+    for _ in range(notes_per_user):
+        note = check(*client.call('POST', '/notes', json={
+            'user_id': user.user_id,
+            'title': f"Нагрузка {user.index}",
+            'content': user.next_content()
+        }), expected=(201,))
+        user.note_ids.append(note['id'])
+
+
+def operation_request(user, op):
+    """Запрос операции: (метод, путь, параметры, тело)"""
+    if op == 'login':
+        return 'POST', '/login', None, {'username': user.username, 'password': user.password}
+    if op == 'list':
+        return 'GET', '/notes', {'user_id': user.user_id}, None
+    if op == 'autosave':
+        note_id = user.rng.choice(user.note_ids)
+        return 'PUT', f'/notes/{note_id}', None, {
+            'user_id': user.user_id,
+            'title': f"Нагрузка {user.index}",
+            'content': user.next_content()
+        }
+    if op == 'html':
+        note_id = user.rng.choice(user.note_ids)
+        return 'GET', f'/notes/{note_id}/html', {'user_id': user.user_id}, None
+    raise ValueError(op)
+
+
+def run_operation(client, user, op):
+    """Выполнить одну операцию синхронно; вернуть True при успехе"""
+    method, path, params, body = operation_request(user, op)
+    # Тело читается полностью, чтобы учитывать время передачи ответа
+    response = client.request(method, path, params=params, json=body)
+    return response.status_code < 400
+
+
+def thread_worker(client, user, ops, weights, deadline, think_time, recorder):
+    while time.perf_counter() < deadline:
+        op = user.rng.choices(ops, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = run_operation(client, user, op)
+        except ServerUnavailable:
+            ok = False
+        recorder.record(op, time.perf_counter() - started, ok)
+        if think_time:
+            time.sleep(user.rng.uniform(0, think_time))
+
+
+def prepare_users(args, users):
+    # Подготовка выполняется потоками: она не измеряется, отказы при перегрузке повторяются
+    client = ApiClient(args.base_url, use_cbor=False, pool_size=min(len(users), 64))
+    print(f"Подготовка {len(users)} пользователей...")
+    with ThreadPoolExecutor(max_workers=min(len(users), 64)) as pool:
+        list(pool.map(lambda u: setup_user(client, u, args.notes), users))
+
+
+def run_threads(args, users, recorder):
+    prepare_users(args, users)
+    client = make_client(args.base_url, len(users))
+    ops = list(args.mix)
+    weights = [args.mix[op] for op in ops]
+
+    print(f"Нагрузка: {len(users)} потоков, {args.duration} с...")
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=thread_worker,
+            args=(client, user, ops, weights, deadline, args.think_time, recorder),
+            daemon=True
+        )
+        for user in users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+# --- asyncio воркеры ---
+
+async def async_worker(client, user, ops, weights, deadline, think_time, recorder):
+    while time.perf_counter() < deadline:
+        op = user.rng.choices(ops, weights)[0]
+        method, path, params, body = operation_request(user, op)
+        started = time.perf_counter()
+        try:
+            status, _, _ = await client.request(method, path, params=params, json=body)
+            ok = status < 400
+        except ServerUnavailable:
+            ok = False
+        recorder.record(op, time.perf_counter() - started, ok)
+        if think_time:
+            await asyncio.sleep(user.rng.uniform(0, think_time))
+
+
+def run_asyncio(args, users, recorder):
+    prepare_users(args, users)
+    ops = list(args.mix)
+    weights = [args.mix[op] for op in ops]
+
+    async def main():
+        deadline = time.perf_counter() + args.duration
+        # Соединение на каждого пользователя, как у потоковых воркеров
+        async with AsyncApiClient(args.base_url, use_cbor=False, retries=0,
+                                  max_connections=len(users)) as client:
+            await asyncio.gather(*(
+                async_worker(client, user, ops, weights, deadline, args.think_time, recorder)
+                for user in users
+            ))
+
+    print(f"Нагрузка: {len(users)} корутин, {args.duration} с...")
+    started = time.perf_counter()
+    asyncio.run(main())
+    return time.perf_counter() - started
+
+
+# --- Отчеты и базовые прогоны ---
+
+def print_report(result):
+    header = f"{'Операция':<10} {'Кол-во':>8} {'Ошибки':>7} {'Оп/с':>9} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}"
+    print("\n" + header)
+    print('-' * len(header))
+    rows = list(result['operations'].items()) + [('ИТОГО', result['total'])]
+    for op, s in rows:
+        print(f"{op:<10} {s['count']:>8} {s['errors']:>7} {s['throughput']:>9} "
+              f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}")
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Сравнить результат с базовым прогоном; вернуть список регрессий"""
+    regressions = []
+    for op, current in result['operations'].items():
+        previous = baseline.get('operations', {}).get(op)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if previous[key] > 0 and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{op}: {key} {previous[key]} -> {current[key]}")
+        if previous['throughput'] > 0 and current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"{op}: throughput {previous['throughput']} -> {current['throughput']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование сервиса заметок")
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--users', type=int, default=100, help="число одновременных пользователей")
+    parser.add_argument('--duration', type=float, default=30, help="длительность нагрузки, с")
+    parser.add_argument('--notes', type=int, default=5, help="стартовых заметок на пользователя")
+    parser.add_argument('--mix', type=parse_mix, default='default',
+                        help=f"профиль ({', '.join(MIXES)}) или 'login=1,autosave=4,...'")
+    parser.add_argument('--workers', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="максимальная пауза между операциями, с")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--run-id', default=None, help="префикс имен пользователей")
+    parser.add_argument('--save-baseline', metavar='PATH', help="сохранить результат в JSON")
+    parser.add_argument('--compare', metavar='PATH', help="сравнить с базовым JSON")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="допустимое ухудшение относительно базы (0.2 = 20%%)")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+    if args.notes < 0:
+        parser.error("--notes не может быть отрицательным")
+    # autosave и html выбирают одну из стартовых заметок пользователя
+    needs_notes = [op for op in NOTE_OPERATIONS if args.mix.get(op, 0) > 0]
+    if needs_notes and args.notes < 1:
+        parser.error(f"для операций {', '.join(needs_notes)} нужен --notes не меньше 1")
+
+    run_id = args.run_id or uuid.uuid4().hex[:8]
+    users = [
+        VirtualUser(i, f"load_{run_id}_{i}", 'load_password', args.seed * 100003 + i)
+        for i in range(args.users)
+    ]
+    recorder = Recorder()
+
+    try:
+        if args.workers == 'asyncio':
+            elapsed = run_asyncio(args, users, recorder)
+        else:
+            elapsed = run_threads(args, users, recorder)
+    except ApiError as e:
+        print(f"Ошибка подключения к серверу: {e}")
+        return 1
+
+    result = recorder.summary(elapsed)
+    result['meta'] = {
+        'timestamp': datetime.now().isoformat(),
+        'base_url': args.base_url,
+        'users': args.users,
+        'duration': round(elapsed, 2),
+        'workers': args.workers,
+        'mix': args.mix,
+        'notes_per_user': args.notes,
+        'think_time': args.think_time,
+        'seed': args.seed,
+    }
+    print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат сохранен: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ Обнаружены регрессии (допуск {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n✓ Регрессий относительно {args.compare} не обнаружено")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,25 @@ import subprocess
 import sys
 import time
 import os
+import urllib.request
+import urllib.error
+
+READY_URL = 'http://localhost:5000/readyz'
+
+def wait_until_ready(server_process, timeout=30):
+    """Ожидание готовности сервера: опрос /readyz, пока процесс жив"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server_process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(READY_URL, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.1)
+    return False
 
 def run_server():
     """Запуск сервера в фоновом режиме"""
@@ -19,17 +38,20 @@ def run_server():
         print(f"Сервер запущен с PID: {server_process.pid}")
         print("Сервер доступен по адресу: http://localhost:5000")
         
-        # Ждем несколько секунд, чтобы сервер успел запуститься
-        time.sleep(2)
-        
-        # Проверяем, запустился ли сервер
-        if server_process.poll() is None:
-            print("Сервер успешно запущен и работает")
+        # Ждем, пока сервер сообщит о готовности
+        started = time.monotonic()
+        if wait_until_ready(server_process):
+            print(f"Сервер успешно запущен и работает ({time.monotonic() - started:.2f} с)")
             return server_process
-        else:
+        elif server_process.poll() is not None:
             stdout, stderr = server_process.communicate()
             print(f"Ошибка при запуске сервера: {stderr.decode()}")
             return None
+        else:
+            print("Сервер не сообщил о готовности в течение отведенного времени")
+            server_process.terminate()
+            server_process.wait()
+            return None
             
     except Exception as e:
         print(f"Ошибка при запуске сервера: {e}")
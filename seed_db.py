@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических данных для нагрузочного тестирования
+
+Заполняет базу SQLite пользователями и заметками напрямую, минуя API:
+крупными транзакциями через executemany, с отложенным построением
+вторичных индексов. Распределения настраиваются (размер заметок,
+доля блоков кода, кириллица/латиница, число заметок на пользователя
+по закону Ципфа), а результат полностью воспроизводим по seed.
+
+Примеры:
+    python seed_db.py --users 10000 --notes 1000000
+    python seed_db.py --users 100 --notes 5000 --cyrillic 1.0 --code-density 0.5 --seed 7
+"""
+import argparse
+import bisect
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+
+from werkzeug.security import generate_password_hash
+import bodies
+from app import init_db
+from config import DATABASE
+from ids import make_uid
+
+
+CYRILLIC_WORDS = (
+    "заметка синхронизация сервер клиент данные файл проект задача список "
+    "встреча идея черновик пример документ версия изменение пользователь "
+    "быстро медленно важно сегодня завтра вчера нужно можно проверить "
+    "обновить удалить создать добавить исправить описание результат план "
+    "система модуль функция запрос ответ ошибка тест база индекс страница"
+).split()
+
+LATIN_WORDS = (
+    "note sync server client data file project task list meeting idea draft "
+    "example document version change user fast slow important today tomorrow "
+    "yesterday need check update delete create add fix description result plan "
+    "system module function request response error test database index page"
+).split()
+
+CODE_SNIPPETS = {
+    'python': [
+        "def {name}(items):\n    return [x * 2 for x in items if x]",
+        "for i in range({n}):\n    print(i, i ** 2)",
+        "class {Name}:\n    def __init__(self):\n        self.value = {n}",
+    ],
+    'javascript': [
+        "function {name}(items) {{\n  return items.map(x => x * {n});\n}}",
+        "const {name} = async () => {{\n  await fetch('/api/notes');\n}};",
+    ],
+    'sql': [
+        "SELECT id, title FROM notes\nWHERE user_id = {n}\nORDER BY updated_at DESC;",
+    ],
+    'bash': [
+        "for f in *.md; do\n  echo \"$f\"\ndone",
+        "curl -s http://localhost:5000/api/notes?user_id={n}",
+    ],
+}
+
+
+class TextGenerator:
+    """Генератор Markdown-текста с заданными пропорциями"""
+    def __init__(self, rng, cyrillic, code_density):
+        self.rng = rng
+        self.cyrillic = cyrillic
+        self.code_density = code_density
+        self.languages = sorted(CODE_SNIPPETS)
+
+    def words(self, count):
+        pool = CYRILLIC_WORDS if self.rng.random() < self.cyrillic else LATIN_WORDS
+        return ' '.join(self.rng.choices(pool, k=count))
+
+    def title(self):
+        return self.words(self.rng.randint(1, 6)).capitalize()
+
+    def code_block(self):
+        lang = self.rng.choice(self.languages)
+        template = self.rng.choice(CODE_SNIPPETS[lang])
+        name = self.rng.choice(LATIN_WORDS)
+        code = template.format(name=name, Name=name.capitalize(), n=self.rng.randint(1, 1000))
+        return f"```{lang}\n{code}\n```"
+
+    def block(self):
+        if self.rng.random() < self.code_density:
+            return self.code_block()
+        kind = self.rng.random()
+        if kind < 0.15:
+            return '#' * self.rng.randint(1, 3) + ' ' + self.title()
+        if kind < 0.35:
+            return '\n'.join(f"- {self.words(self.rng.randint(2, 8))}"
+                             for _ in range(self.rng.randint(2, 6)))
+        return self.words(self.rng.randint(8, 60)).capitalize() + '.'
+
+    def content(self, size):
+        """Текст заметки длиной примерно size символов"""
+        blocks = []
+        length = 0
+        while length < size:
+            block = self.block()
+            blocks.append(block)
+            length += len(block) + 2
+        return '\n\n'.join(blocks)
+
+
+def zipf_cum_weights(count, exponent):
+    """Накопленные веса распределения Ципфа для count рангов"""
+    total = 0.0
+    cum = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cum.append(total)
+    return cum
+
+
+def random_timestamp(rng, start, span_seconds):
+    return (start + timedelta(seconds=rng.randrange(span_seconds))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def drop_secondary_indexes(conn):
+    """Удалить вторичные индексы; вернуть их SQL для последующего построения"""
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    text = TextGenerator(rng, args.cyrillic, args.code_density)
+
+    init_db(args.db)
+    conn = sqlite3.connect(args.db, isolation_level=None)
+
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    deferred = [] if args.keep_indexes else drop_secondary_indexes(conn)
+    first_user_id = (conn.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0) + 1
+    user_ids = list(range(first_user_id, first_user_id + args.users))
+
+    now = datetime.strptime(args.end_date, '%Y-%m-%d')
+    history_start = now - timedelta(days=args.history_days)
+    history_span = args.history_days * 86400
+
+    # Хеш один на всех: pbkdf2 для миллионов пользователей занял бы часы
+    password_hash = generate_password_hash(args.password)
+
+    started = time.perf_counter()
+    print(f"Пользователи: {args.users} (ID {user_ids[0]}..{user_ids[-1]})")
+    for offset in range(0, len(user_ids), args.batch):
+        chunk = user_ids[offset:offset + args.batch]
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO users (id, username, password_hash, created_at) VALUES (?, ?, ?, ?)',
+            ((uid, f"{args.prefix}{uid:08d}", password_hash,
+              random_timestamp(rng, history_start, history_span)) for uid in chunk)
+        )
+        conn.execute('COMMIT')
+
+    # Число заметок на пользователя по закону Ципфа; ранги перемешаны,
+    # чтобы «тяжелые» пользователи не шли подряд
+    ranked_users = user_ids[:]
+    rng.shuffle(ranked_users)
+    cum_weights = zipf_cum_weights(len(ranked_users), args.zipf)
+    total_weight = cum_weights[-1]
+
+    median_size = args.note_size
+    sigma = args.size_sigma
+    inserted = 0
+    notes_started = time.perf_counter()
+    print(f"Заметки: {args.notes} (Ципф s={args.zipf}, медиана {median_size} символов)")
+    while inserted < args.notes:
+        count = min(args.batch, args.notes - inserted)
+        rows = []
+        for _ in range(count):
+            owner = ranked_users[bisect.bisect_left(cum_weights, rng.random() * total_weight)]
+            size = max(1, int(rng.lognormvariate(math.log(median_size), sigma)))
+            created = history_start + timedelta(seconds=rng.randrange(history_span))
+            updated = created + timedelta(seconds=rng.randrange(max(1, int((now - created).total_seconds()))))
+            # Большие тексты хранятся вне строки заметки, как при вставке через API
+            inline, body_size, body = bodies.split_content(text.content(size))
+            # UUIDv7 от даты создания, случайные биты - от seed
+            rows.append((
+                make_uid(int(created.replace(tzinfo=timezone.utc).timestamp() * 1000), rng.getrandbits(12), rng.getrandbits(62)),
+                owner,
+                text.title(),
+                inline,
+                body_size,
+                created.strftime('%Y-%m-%d %H:%M:%S'),
+                updated.strftime('%Y-%m-%d %H:%M:%S'),
+                body,
+            ))
+        # Вставка в порядке uid (по времени создания) снижает число
+        # расщеплений страниц индекса uid
+        rows.sort()
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO notes (uid, user_id, title, content, body_size, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [row[:-1] for row in rows if row[-1] is None]
+        )
+        # Тело в note_bodies ссылается на notes.id - такие заметки по одной
+        for row in rows:
+            if row[-1] is not None:
+                cursor = conn.execute(
+                    'INSERT INTO notes (uid, user_id, title, content, body_size, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    row[:-1]
+                )
+                bodies.save_body(conn, cursor.lastrowid, row[-1])
+        conn.execute('COMMIT')
+        inserted += count
+        elapsed = time.perf_counter() - notes_started
+        print(f"  {inserted}/{args.notes} ({inserted / elapsed:.0f} заметок/с)")
+
+    if deferred:
+        print(f"Построение индексов: {len(deferred)}")
+        index_started = time.perf_counter()
+        conn.execute('BEGIN')
+        for sql in deferred:
+            conn.execute(sql)
+        conn.execute('COMMIT')
+        print(f"  готово за {time.perf_counter() - index_started:.1f} с")
+
+    conn.execute('ANALYZE')
+    conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✓ База заполнена за {elapsed:.1f} с: {args.db} "
+          f"({os.path.getsize(args.db) / 1024 / 1024:.1f} МБ)")
+    print(f"  Пароль всех пользователей: {args.password}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнение базы синтетическими данными")
+    parser.add_argument('--db', default=DATABASE, help="путь к базе SQLite")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--notes', type=int, default=100000, help="всего заметок")
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help="показатель распределения Ципфа заметок по пользователям")
+    parser.add_argument('--note-size', type=int, default=800, help="медианный размер заметки, символов")
+    parser.add_argument('--size-sigma', type=float, default=1.0,
+                        help="разброс размера (sigma логнормального распределения)")
+    parser.add_argument('--code-density', type=float, default=0.1,
+                        help="доля блоков кода среди блоков заметки (0..1)")
+    parser.add_argument('--cyrillic', type=float, default=0.7,
+                        help="доля кириллического текста (0..1)")
+    parser.add_argument('--history-days', type=int, default=365,
+                        help="за сколько дней распределены даты заметок")
+    parser.add_argument('--end-date', default='2025-01-01',
+                        help="конец периода дат (YYYY-MM-DD); фиксирован ради воспроизводимости")
+    parser.add_argument('--batch', type=int, default=50000, help="строк в одной транзакции")
+    parser.add_argument('--prefix', default='seed_user_', help="префикс имен пользователей")
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=42, help="seed генератора случайных чисел")
+    parser.add_argument('--keep-indexes', action='store_true',
+                        help="не откладывать построение индексов")
+    args = parser.parse_args()
+
+    if args.users < 1:
+        parser.error("--users должно быть больше 0")
+    for name in ('code_density', 'cyrillic'):
+        if not 0 <= getattr(args, name) <= 1:
+            parser.error(f"--{name.replace('_', '-')} должно быть в диапазоне 0..1")
+
+    try:
+        seed(args)
+    except sqlite3.IntegrityError as e:
+        print(f"✗ Конфликт данных: {e}. Используйте другой --prefix или очистите базу (clean_db.py)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,63 +1,508 @@
 """
 Серверная часть сервиса синхронизированных заметок
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, abort, current_app, g, request, jsonify, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
+import atexit
+import functools
+import math
 import sqlite3
 import os
-import markdown
+import sys
+import tempfile
 from datetime import datetime
-import uuid
 
-app = Flask(__name__)
-DATABASE = '/workspace/server/notes.db'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import cbor
+from common import hashtree
+from common.textdiff import PatchError, apply_patch, content_hash
 
-def init_db():
+from render_pool import RenderPool, RenderError
+from coalesce import SingleFlight, UserVersions
+import bodies
+import config
+import ids
+import job_kinds
+import migrate_ids
+import note_hashes
+import replication
+import revisions
+import schema
+from jobs import JobError, JobQueue, QueueFull
+from maintenance import MaintenanceScheduler
+from backup import BackupManager
+from ratelimit import AdmissionControl, retry_after_header
+from replication import ChangeLog, ChangeLogGap, Replica
+from storage import Storage
+from query import NoteListQuery, QueryError, NOTE_COLUMNS, SUMMARY_COLUMNS, select_columns
+
+BACKUP_INTERVAL = 6 * 3600  # секунд между автоматическими снимками
+
+# Контроль допуска настраивается в config.py (NOTES_ADMISSION, NOTES_*_RATE ...)
+# Служебные адреса не ограничиваются
+ADMISSION_EXEMPT = {'/healthz', '/readyz'}
+# Запросы реплик к основному серверу ждут изменений подолгу
+REPLICATION_PATHS = {'/api/replication/changes', '/api/replication/snapshot'}
+ADMISSION_EXEMPT |= REPLICATION_PATHS
+# Долгие запросы реплик не считаются нагрузкой для обслуживания базы: иначе
+# основной сервер с репликой никогда не простаивает
+MAINTENANCE_EXEMPT = REPLICATION_PATHS
+
+# Процессы рендеринга Markdown: число, секунд и байт памяти на задание,
+# секунд ожидания свободного процесса
+RENDER_POOL = {
+    'workers': min(os.cpu_count() or 1, 4),
+    'timeout': 5.0, 'memory_limit': 512 * 1024 * 1024, 'queue_timeout': 2.0,
+}
+MAX_HTML_BATCH = 100
+
+# Фоновые задания: потоков-исполнителей, одновременно выполняемых и
+# незавершенных заданий на пользователя, секунд хранения результата
+JOB_QUEUE = {
+    'workers': 2, 'max_running_per_user': 1, 'max_queued_per_user': 10,
+    'result_ttl': 24 * 3600,
+}
+
+# Реплика отвечает только на чтение заметок и служебные запросы
+REPLICA_ENDPOINTS = {
+    'api.healthz', 'api.readyz', 'api.get_notes', 'api.get_note', 'api.get_note_html',
+    'api.get_note_revisions', 'api.get_note_revision',
+    'api.maintenance_status', 'api.storage_status', 'api.admission_status', 'api.render_status',
+    'api.coalescing_status', 'api.backup_status', 'api.replication_status', 'api.jobs_status',
+}
+
+api = Blueprint('api', __name__)
+
+def create_app(database=None, warm_up=True, start_background=True):
+    """Создать приложение: схема базы, маршруты и фоновые службы"""
+    app = Flask(__name__)
+    # База в файле или в памяти (config.STORAGE); DATABASE - адрес для sqlite3.connect
+    # Реплика восстанавливается с основного сервера, журнал ей не нужен
+    journal_path = config.JOURNAL if config.ROLE != 'replica' else None
+    storage = Storage(config.STORAGE, database or config.DATABASE,
+                      config.SNAPSHOT_INTERVAL, journal_path)
+    storage.open(init_db)
+    app.config['DATABASE'] = storage.database
+    app.extensions['storage'] = storage
+
+    # Репликация: журнал изменений основного сервера или применение его на реплике
+    if config.ROLE == 'primary':
+        app.extensions['replication'] = ChangeLog(storage.connect, config.CHANGE_LOG_RETENTION)
+        app.extensions['replication'].open()
+    elif config.ROLE == 'replica':
+        app.extensions['replication'] = Replica(storage.connect, config.PRIMARY_URL)
+        app.extensions['replication'].open()
+    else:
+        conn = storage.connect()
+        replication.uninstall(conn)
+        conn.close()
+        app.extensions['replication'] = None
+
+    # Планировщик обслуживания и резервное копирование базы
+    app.extensions['maintenance'] = MaintenanceScheduler(app.config['DATABASE'])
+    app.extensions['backups'] = BackupManager(app.config['DATABASE'], config.BACKUP_DIR)
+    app.extensions['admission'] = AdmissionControl(enabled=config.ADMISSION, **config.ADMISSION_LIMITS)
+    app.extensions['renderer'] = RenderPool(**RENDER_POOL)
+    # Объединение одновременных одинаковых чтений и версии данных пользователей
+    app.extensions['coalescing'] = SingleFlight()
+    app.extensions['versions'] = UserVersions()
+    # Фоновые задания; их изменения попадают в журналы, как у запросов
+    def after_job():
+        storage.after_write()
+        node = app.extensions['replication']
+        if node and node.role == 'primary':
+            node.after_write()
+    app.extensions['jobs'] = JobQueue(storage.connect, job_kinds.JOB_KINDS, **JOB_QUEUE,
+                                      services={'renderer': app.extensions['renderer']},
+                                      after_write=after_job)
+    # Готовность ждет прогрева рендеринга, только если он запрошен
+    app.extensions['warm_up'] = warm_up and start_background
+
+    app.register_blueprint(api)
+
+    if start_background:
+        app.extensions['maintenance'].start()
+        app.extensions['backups'].start_periodic(BACKUP_INTERVAL)
+        # Снимки базы в памяти; последний - при остановке процесса
+        storage.start()
+        atexit.register(storage.stop)
+        if app.extensions['replication']:
+            app.extensions['replication'].start()
+        # Реплика только читает: задания выполняет основной сервер
+        if config.ROLE != 'replica':
+            app.extensions['jobs'].open()
+            app.extensions['jobs'].start()
+        # Процессы рендеринга прогреваются сами при запуске
+        app.extensions['renderer'].start()
+    return app
+
+def init_db(database=None):
     """Инициализация базы данных"""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(database or config.DATABASE, uri=True)
     cursor = conn.cursor()
     
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # auto_vacuum действует только для новой базы; существующую переводит
+    # `python maintenance.py enable-incremental`
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cursor.execute('PRAGMA journal_mode = WAL').fetchall()
     
-    # Таблица заметок
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+    # Базы с текстовыми id заметок переводятся на rowid + uid (migrate_ids.py)
+    if migrate_ids.needs_migration(conn):
+        migrate_ids.migrate(conn)
+    
+    schema.create_schema(cursor)
     
     conn.commit()
     conn.close()
 
+def wants_cbor():
+    """Клиент предпочитает CBOR (по заголовку Accept)"""
+    best = request.accept_mimetypes.best_match(['application/json', cbor.MIMETYPE])
+    return best == cbor.MIMETYPE
+
+def api_response(payload):
+    """Ответ в JSON или, если клиент просит, в CBOR"""
+    if wants_cbor():
+        response = current_app.response_class(cbor.dumps(payload), mimetype=cbor.MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+def coalesced(view):
+    """Одновременные одинаковые чтения пользователя выполняются один раз
+
+    Ключ включает версию данных пользователя, параметры и формат ответа;
+    ожидающие запросы получают копию байтов ответа ведущего (coalesce.py).
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return view(**kwargs)
+        key = (user_id, request.endpoint, current_app.extensions['versions'].get(user_id),
+               tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))),
+               wants_cbor())
+        
+        def execute():
+            response = current_app.make_response(view(**kwargs))
+            return response.status_code, list(response.headers), response.get_data()
+        
+        status, headers, body = current_app.extensions['coalescing'].do(key, execute, request.endpoint)
+        return current_app.response_class(body, status=status, headers=headers)
+    return wrapper
+
+def get_request_data(silent=False):
+    """Тело запроса из JSON или CBOR (по Content-Type)"""
+    if request.mimetype == cbor.MIMETYPE:
+        try:
+            return cbor.loads(request.get_data())
+        except cbor.CBORError:
+            if silent:
+                return None
+            abort(400)
+    return request.get_json(silent=silent)
+
+def find_note(conn, note_id, user_id, columns='notes.id'):
+    """Строка заметки пользователя по публичному id; None, если ее нет"""
+    uid = ids.to_uid(note_id)
+    if uid is None:
+        return None
+    return conn.execute(
+        f'SELECT {columns} FROM notes WHERE uid = ? AND user_id = ?', (uid, user_id)
+    ).fetchone()
+
+# Столбцы заметки до изменения, нужные для записи ревизии (revisions.py)
+REVISION_BASE_COLUMNS = f'notes.id, title, {bodies.CONTENT_SQL} AS content, updated_at'
+
+def patch_note(conn, note_id, user_id, base_hash, patch, title=None):
+    """Применить патч к содержимому заметки; вернуть (статус, хеш содержимого)"""
+    note = find_note(conn, note_id, user_id, REVISION_BASE_COLUMNS)
+    if note is None:
+        return 'not_found', None
+    current_hash = content_hash(note['content'])
+    if base_hash != current_hash:
+        return 'conflict', current_hash
+    try:
+        content = apply_patch(note['content'], patch)
+    except PatchError:
+        return 'invalid', current_hash
+    conn.execute(
+        'UPDATE notes SET title = COALESCE(?, title), updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (title, note['id'])
+    )
+    bodies.write_content(conn, note['id'], content)
+    revisions.record(conn, note['id'], note, title if title is not None else note['title'], content)
+    return 'patched', content_hash(content)
+
+MAX_TAG_LENGTH = 64
+
+# Синхронизация офлайн-клиентов
+MAX_BATCH_OPERATIONS = 500
+SYNC_PAGE_SIZE = 500
+SYNC_CLOCK_MARGIN = 2
+
+def normalize_tags(tags):
+    """Привести теги к нижнему регистру без пробелов по краям; None - если неверны"""
+    if isinstance(tags, str):
+        tags = [tags]
+    if not isinstance(tags, list):
+        return None
+    
+    normalized = []
+    for tag in tags:
+        if not isinstance(tag, str):
+            return None
+        tag = tag.strip().lower()
+        if not tag or len(tag) > MAX_TAG_LENGTH:
+            return None
+        if tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
+def get_note_tags(conn, note_id):
+    """Теги заметки (по notes.id) в алфавитном порядке"""
+    rows = conn.execute(
+        'SELECT tag FROM note_tags WHERE note_id = ? ORDER BY tag', (note_id,)
+    ).fetchall()
+    return [row['tag'] for row in rows]
+
+def sync_server_time(conn):
+    """Граница следующей синхронизации (since)
+
+    С запасом на транзакции, которые получили метку времени раньше, а
+    зафиксированы после начала чтения.
+    """
+    return conn.execute(
+        "SELECT datetime('now', ?)", (f'-{SYNC_CLOCK_MARGIN} seconds',)
+    ).fetchone()[0]
+
 def get_db_connection():
     """Получить соединение с базой данных"""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(current_app.config['DATABASE'], uri=True)
     conn.row_factory = sqlite3.Row
     return conn
 
-@app.route('/api/register', methods=['POST'])
+@api.before_app_request
+def track_request_start():
+    if request.path in MAINTENANCE_EXEMPT:
+        return
+    g.tracked = True
+    current_app.extensions['maintenance'].request_started()
+
+@api.before_app_request
+def identify_user():
+    """Пользователь запроса (g.user_id) - для лимитов и версий данных
+
+    Нужен и при выключенном ограничении нагрузки: по нему bump_user_version
+    отделяет чтения после записи от начатых до нее.
+    """
+    user_id = request.args.get('user_id')
+    if user_id is None and (request.is_json or request.mimetype == cbor.MIMETYPE):
+        data = get_request_data(silent=True)
+        if isinstance(data, dict):
+            user_id = data.get('user_id')
+    g.user_id = user_id
+
+@api.before_app_request
+def admit_request():
+    """Ограничение частоты и параллелизма; при перегрузке - 429/503"""
+    if request.path in ADMISSION_EXEMPT or not current_app.extensions['admission'].enabled:
+        return None
+    
+    rejection = current_app.extensions['admission'].admit(request.remote_addr, g.user_id)
+    if rejection:
+        status, retry_after = rejection
+        error = 'Too many requests' if status == 429 else 'Server overloaded'
+        response = api_response({'error': error})
+        response.headers['Retry-After'] = retry_after_header(retry_after)
+        return response, status
+    g.admitted = True
+    return None
+
+@api.before_app_request
+def replica_read():
+    """На реплике: только чтение; с min_seq - ждать применения изменения"""
+    replica = current_app.extensions['replication']
+    if not replica or replica.role != 'replica':
+        return None
+    if request.endpoint not in REPLICA_ENDPOINTS:
+        return api_response({'error': 'Read-only replica', 'primary': replica.primary_url}), 403
+    
+    min_seq = request.args.get('min_seq')
+    if min_seq is None:
+        return None
+    try:
+        min_seq = int(min_seq)
+    except ValueError:
+        return api_response({'error': 'min_seq must be an integer'}), 400
+    if not replica.wait_for(min_seq):
+        response = api_response({
+            'error': 'Replica is behind',
+            'min_seq': min_seq,
+            'applied_seq': replica.current_seq()
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return None
+
+@api.after_app_request
+def bump_user_version(response):
+    """После изменяющего запроса новые чтения не присоединяются к начатым до него"""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and g.get('user_id'):
+        current_app.extensions['versions'].bump(g.user_id)
+    return response
+
+@api.after_app_request
+def flush_journal(response):
+    """Изменения базы в памяти попадают в журнал до ответа клиенту"""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        current_app.extensions['storage'].after_write()
+    return response
+
+@api.after_app_request
+def replication_seq(response):
+    """Номер изменения: после записи на основном сервере, примененный - на реплике"""
+    node = current_app.extensions['replication']
+    if not node:
+        return response
+    if node.role == 'primary':
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.headers[replication.SEQ_HEADER] = str(node.after_write())
+    elif node.current_seq() is not None:
+        response.headers[replication.SEQ_HEADER] = str(node.current_seq())
+    return response
+
+@api.teardown_app_request
+def track_request_end(exc):
+    if g.pop('admitted', False):
+        current_app.extensions['admission'].release()
+    if g.pop('tracked', False):
+        current_app.extensions['maintenance'].request_finished()
+
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    """Проверка живости: процесс запущен и отвечает"""
+    return api_response({'status': 'ok'}), 200
+
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    """Проверка готовности: база доступна, рендеринг прогрет"""
+    checks = {'database': False, 'renderer': current_app.extensions['renderer'].is_warm()}
+    try:
+        conn = get_db_connection()
+        conn.execute('SELECT 1 FROM notes LIMIT 1').fetchall()
+        conn.close()
+        checks['database'] = True
+    except sqlite3.Error:
+        pass
+    
+    # Реплика готова, когда загрузила копию базы основного сервера
+    node = current_app.extensions['replication']
+    if node and node.role == 'replica':
+        checks['replication'] = node.current_seq() is not None
+    
+    ready = (checks['database'] and checks.get('replication', True)
+             and (checks['renderer'] or not current_app.extensions['warm_up']))
+    return api_response({
+        'status': 'ready' if ready else 'starting',
+        'checks': checks
+    }), 200 if ready else 503
+
+@api.route('/api/admin/maintenance', methods=['GET'])
+def maintenance_status():
+    """Состояние базы: фрагментация, WAL и статистика обслуживания"""
+    return api_response(current_app.extensions['maintenance'].status()), 200
+
+@api.route('/api/admin/storage', methods=['GET'])
+def storage_status():
+    """Режим хранения базы, снимки и журнал изменений"""
+    return api_response(current_app.extensions['storage'].status()), 200
+
+@api.route('/api/admin/replication', methods=['GET'])
+def replication_status():
+    """Роль сервера в репликации; для реплики - отставание"""
+    node = current_app.extensions['replication']
+    return api_response(node.status() if node else {'role': 'standalone'}), 200
+
+@api.route('/api/replication/changes', methods=['GET'])
+def replication_changes():
+    """Изменения журнала после номера after (для реплик)"""
+    node = current_app.extensions['replication']
+    if not node or node.role != 'primary':
+        return api_response({'error': 'Not a primary'}), 404
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', replication.MAX_CHANGES))
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return api_response({'error': 'Invalid after, limit or wait'}), 400
+    if not math.isfinite(wait):
+        return api_response({'error': 'Invalid after, limit or wait'}), 400
+    try:
+        return api_response(node.changes(after, limit, wait)), 200
+    except ChangeLogGap as e:
+        return api_response({'error': str(e)}), 410
+
+@api.route('/api/replication/snapshot', methods=['GET'])
+def replication_snapshot():
+    """Копия базы для новой реплики; номер изменения - в заголовке"""
+    node = current_app.extensions['replication']
+    if not node or node.role != 'primary':
+        return api_response({'error': 'Not a primary'}), 404
+    fd, path = tempfile.mkstemp(prefix='notes-snapshot-', suffix='.db')
+    os.close(fd)
+    try:
+        seq = node.snapshot(path)
+        response = send_file(path, mimetype='application/vnd.sqlite3')
+    except BaseException:
+        os.remove(path)
+        raise
+    response.call_on_close(lambda: os.remove(path))
+    response.headers[replication.SEQ_HEADER] = str(seq)
+    return response
+
+@api.route('/api/admin/jobs', methods=['GET'])
+def jobs_status():
+    """Очередь фоновых заданий: число заданий по состояниям"""
+    return api_response(current_app.extensions['jobs'].status()), 200
+
+@api.route('/api/admin/admission', methods=['GET'])
+def admission_status():
+    """Счетчики допущенных, задержанных и отклоненных запросов"""
+    return api_response(current_app.extensions['admission'].status()), 200
+
+@api.route('/api/admin/render', methods=['GET'])
+def render_status():
+    """Процессы рендеринга: задания, таймауты, перезапуски"""
+    return api_response(current_app.extensions['renderer'].status()), 200
+
+@api.route('/api/admin/coalescing', methods=['GET'])
+def coalescing_status():
+    """Выполненные и объединенные одинаковые чтения"""
+    return api_response(current_app.extensions['coalescing'].status()), 200
+
+@api.route('/api/admin/backup', methods=['GET'])
+def backup_status():
+    """Снимки базы и метрики резервного копирования"""
+    return api_response(current_app.extensions['backups'].status()), 200
+
+@api.route('/api/admin/backup', methods=['POST'])
+def start_backup():
+    """Запустить снятие снимка базы в фоне"""
+    if not current_app.extensions['backups'].start_backup():
+        return api_response({'error': 'Backup already in progress'}), 409
+    return api_response({'message': 'Backup started'}), 202
+
+@api.route('/api/register', methods=['POST'])
 def register():
     """Регистрация нового пользователя"""
-    data = request.get_json()
+    data = get_request_data()
     username = data.get('username')
     password = data.get('password')
     
     if not username or not password:
-        return jsonify({'error': 'Username and password are required'}), 400
+        return api_response({'error': 'Username and password are required'}), 400
     
     try:
         conn = get_db_connection()
@@ -71,23 +516,23 @@ def register():
         user_id = cursor.lastrowid
         conn.close()
         
-        return jsonify({
+        return api_response({
             'message': 'User registered successfully',
             'user_id': user_id
         }), 201
         
     except sqlite3.IntegrityError:
-        return jsonify({'error': 'Username already exists'}), 409
+        return api_response({'error': 'Username already exists'}), 409
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     """Аутентификация пользователя"""
-    data = request.get_json()
+    data = get_request_data()
     username = data.get('username')
     password = data.get('password')
     
     if not username or not password:
-        return jsonify({'error': 'Username and password are required'}), 400
+        return api_response({'error': 'Username and password are required'}), 400
     
     conn = get_db_connection()
     user = conn.execute(
@@ -96,184 +541,738 @@ def login():
     conn.close()
     
     if user and check_password_hash(user['password_hash'], password):
-        return jsonify({
+        return api_response({
             'message': 'Login successful',
             'user_id': user['id'],
             'username': user['username']
         }), 200
     else:
-        return jsonify({'error': 'Invalid credentials'}), 401
+        return api_response({'error': 'Invalid credentials'}), 401
 
-@app.route('/api/notes', methods=['GET'])
+@api.route('/api/notes', methods=['GET'])
+@coalesced
 def get_notes():
-    """Получить все заметки пользователя"""
+    """Получить заметки пользователя с фильтрами и сортировкой"""
     user_id = request.args.get('user_id')
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
+    
+    tags = request.args.getlist('tag')
+    tag_mode = request.args.get('tag_mode', 'all')
+    if tags:
+        tags = normalize_tags(tags)
+        if tags is None or tag_mode not in ('all', 'any'):
+            return api_response({'error': 'Invalid tag filter'}), 400
+    
+    fields = request.args.get('fields', 'full')
+    if fields not in ('full', 'summary'):
+        return api_response({'error': 'Fields must be full or summary'}), 400
+    columns = SUMMARY_COLUMNS if fields == 'summary' else NOTE_COLUMNS
+    
+    try:
+        query = NoteListQuery.from_args(user_id, request.args, tags=tags, tag_mode=tag_mode)
+    except QueryError as e:
+        return api_response({'error': str(e)}), 400
+    sql, params = query.build(select_columns(columns))
     
     conn = get_db_connection()
-    notes = conn.execute(
-        'SELECT * FROM notes WHERE user_id = ? ORDER BY updated_at DESC',
-        (user_id,)
-    ).fetchall()
+    notes = conn.execute(sql, params).fetchall()
     conn.close()
+    notes, next_cursor = query.paginate(notes)
     
-    notes_list = []
-    for note in notes:
-        notes_list.append({
-            'id': note['id'],
-            'title': note['title'],
-            'content': note['content'],
-            'created_at': note['created_at'],
-            'updated_at': note['updated_at']
-        })
+    notes_list = [{column: note[column] for column in columns} for note in notes]
     
-    return jsonify({'notes': notes_list}), 200
+    result = {'notes': notes_list}
+    if query.limit:
+        result['next_cursor'] = next_cursor
+    return api_response(result), 200
 
-@app.route('/api/notes/<note_id>', methods=['GET'])
+@api.route('/api/notes/<note_id>', methods=['GET'])
+@coalesced
 def get_note(note_id):
     """Получить конкретную заметку"""
     user_id = request.args.get('user_id')
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
     
     conn = get_db_connection()
-    note = conn.execute(
-        'SELECT * FROM notes WHERE id = ? AND user_id = ?',
-        (note_id, user_id)
-    ).fetchone()
+    note = find_note(conn, note_id, user_id,
+                     f'notes.id AS note_key, {select_columns(NOTE_COLUMNS)}')
+    tags = get_note_tags(conn, note['note_key']) if note else []
     conn.close()
     
     if note:
-        return jsonify({
+        return api_response({
             'id': note['id'],
             'title': note['title'],
             'content': note['content'],
+            'tags': tags,
             'created_at': note['created_at'],
             'updated_at': note['updated_at']
         }), 200
     else:
-        return jsonify({'error': 'Note not found'}), 404
+        return api_response({'error': 'Note not found'}), 404
 
-@app.route('/api/notes', methods=['POST'])
+@api.route('/api/notes', methods=['POST'])
 def create_note():
     """Создать новую заметку"""
-    data = request.get_json()
+    data = get_request_data()
     user_id = data.get('user_id')
     title = data.get('title', 'Без названия')
     content = data.get('content', '')
+    tags = normalize_tags(data.get('tags', []))
     
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
+    if tags is None:
+        return api_response({'error': 'Invalid tags'}), 400
     
-    note_id = str(uuid.uuid4())
+    uid = ids.new_uid()
     
+    inline, body_size, body = bodies.split_content(content)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO notes (id, user_id, title, content)
-        VALUES (?, ?, ?, ?)
-    ''', (note_id, user_id, title, content))
+        INSERT INTO notes (uid, user_id, title, content, body_size)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (uid, user_id, title, inline, body_size))
+    key = cursor.lastrowid
+    if body is not None:
+        bodies.save_body(conn, key, body)
+    cursor.executemany(
+        'INSERT INTO note_tags (note_id, user_id, tag) VALUES (?, ?, ?)',
+        [(key, user_id, tag) for tag in tags]
+    )
     conn.commit()
     conn.close()
     
-    return jsonify({
-        'id': note_id,
+    return api_response({
+        'id': ids.uid_text(uid),
         'title': title,
         'content': content,
+        'tags': sorted(tags),
         'created_at': datetime.now().isoformat(),
         'updated_at': datetime.now().isoformat()
     }), 201
 
-@app.route('/api/notes/<note_id>', methods=['PUT'])
+@api.route('/api/notes/<note_id>', methods=['PUT'])
 def update_note(note_id):
     """Обновить существующую заметку"""
-    data = request.get_json()
+    data = get_request_data()
     user_id = data.get('user_id')
     title = data.get('title')
     content = data.get('content')
     
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Проверяем, что заметка принадлежит пользователю
-    existing_note = cursor.execute(
-        'SELECT * FROM notes WHERE id = ? AND user_id = ?',
-        (note_id, user_id)
-    ).fetchone()
+    existing_note = find_note(conn, note_id, user_id, REVISION_BASE_COLUMNS)
     
     if not existing_note:
         conn.close()
-        return jsonify({'error': 'Note not found or access denied'}), 404
+        return api_response({'error': 'Note not found or access denied'}), 404
     
     # Обновляем заметку
     cursor.execute('''
         UPDATE notes
         SET title = COALESCE(?, title), 
-            content = COALESCE(?, content),
             updated_at = CURRENT_TIMESTAMP
-        WHERE id = ? AND user_id = ?
-    ''', (title, content, note_id, user_id))
+        WHERE id = ?
+    ''', (title, existing_note['id']))
+    if content is not None:
+        bodies.write_content(conn, existing_note['id'], content)
+    revisions.record(conn, existing_note['id'], existing_note,
+                     title if title is not None else existing_note['title'],
+                     content if content is not None else existing_note['content'])
     
     conn.commit()
     conn.close()
     
-    return jsonify({
+    return api_response({
         'id': note_id,
         'title': title or existing_note['title'],
         'content': content or existing_note['content'],
         'updated_at': datetime.now().isoformat()
     }), 200
 
-@app.route('/api/notes/<note_id>', methods=['DELETE'])
+@api.route('/api/notes/<note_id>', methods=['PATCH'])
+def patch_note_content(note_id):
+    """Изменить заметку патчем относительно версии с хешем base_hash"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    base_hash = data.get('base_hash')
+    patch = data.get('patch')
+    title = data.get('title')
+    
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    if not isinstance(base_hash, str) or not isinstance(patch, list):
+        return api_response({'error': 'base_hash and patch are required'}), 400
+    
+    conn = get_db_connection()
+    with conn:
+        status, current_hash = patch_note(conn, note_id, user_id, base_hash, patch, title)
+    conn.close()
+    
+    if status == 'not_found':
+        return api_response({'error': 'Note not found or access denied'}), 404
+    if status == 'conflict':
+        # Клиент должен получить текущую версию и построить патч заново
+        return api_response({'error': 'Base version mismatch', 'hash': current_hash}), 409
+    if status == 'invalid':
+        return api_response({'error': 'Patch does not apply'}), 400
+    return api_response({'id': note_id, 'hash': current_hash}), 200
+
+@api.route('/api/notes/<note_id>', methods=['DELETE'])
 def delete_note(note_id):
     """Удалить заметку"""
     user_id = request.args.get('user_id')
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
     
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        'DELETE FROM notes WHERE id = ? AND user_id = ?',
-        (note_id, user_id)
+        'DELETE FROM notes WHERE uid = ? AND user_id = ?',
+        (ids.to_uid(note_id), user_id)
     )
     affected_rows = cursor.rowcount
     conn.commit()
     conn.close()
     
     if affected_rows > 0:
-        return jsonify({'message': 'Note deleted successfully'}), 200
+        return api_response({'message': 'Note deleted successfully'}), 200
     else:
-        return jsonify({'error': 'Note not found or access denied'}), 404
+        return api_response({'error': 'Note not found or access denied'}), 404
 
-@app.route('/api/notes/<note_id>/html', methods=['GET'])
-def get_note_html(note_id):
-    """Получить заметку в формате HTML (рендеринг Markdown)"""
+@api.route('/api/notes/<note_id>/revisions', methods=['GET'])
+def get_note_revisions(note_id):
+    """История изменений заметки, новые ревизии первыми"""
     user_id = request.args.get('user_id')
     if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+        return api_response({'error': 'User ID is required'}), 400
     
     conn = get_db_connection()
-    note = conn.execute(
-        'SELECT * FROM notes WHERE id = ? AND user_id = ?',
-        (note_id, user_id)
+    note = find_note(conn, note_id, user_id)
+    if not note:
+        conn.close()
+        return api_response({'error': 'Note not found or access denied'}), 404
+    rows = revisions.list_revisions(conn, note['id'])
+    conn.close()
+    
+    return api_response({
+        'id': note_id,
+        'revisions': [dict(row) for row in rows]
+    }), 200
+
+@api.route('/api/notes/<note_id>/revisions/<int:revision>', methods=['GET'])
+def get_note_revision(note_id, revision):
+    """Заметка в одной из ревизий"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    note = find_note(conn, note_id, user_id)
+    result = revisions.reconstruct(conn, note['id'], revision) if note else None
+    conn.close()
+    
+    if not note:
+        return api_response({'error': 'Note not found or access denied'}), 404
+    if result is None:
+        return api_response({'error': 'Revision not found'}), 404
+    return api_response({'id': note_id, **result, 'hash': content_hash(result['content'])}), 200
+
+@api.route('/api/notes/batch', methods=['POST'])
+def batch_notes():
+    """Применить пакет изменений заметок (очередь офлайн-клиента)"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    operations = data.get('operations')
+    
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    if not isinstance(operations, list) or len(operations) > MAX_BATCH_OPERATIONS:
+        return api_response(
+            {'error': f'Operations must be a list of at most {MAX_BATCH_OPERATIONS} items'}
+        ), 400
+    
+    # Временный id клиента -> id, выданный сервером
+    id_map = {}
+    results = []
+    conn = get_db_connection()
+    # Весь пакет - одна транзакция
+    with conn:
+        for operation in operations:
+            if not isinstance(operation, dict):
+                results.append({'status': 'invalid'})
+                continue
+            op = operation.get('op')
+            client_id = operation.get('id')
+            note_id = id_map.get(client_id, client_id)
+            title = operation.get('title')
+            content = operation.get('content')
+            
+            if op == 'create':
+                if not isinstance(title, str) or not isinstance(content, str):
+                    results.append({'id': client_id, 'status': 'invalid'})
+                    continue
+                uid = ids.new_uid()
+                new_id = ids.uid_text(uid)
+                inline, body_size, body = bodies.split_content(content)
+                key = conn.execute(
+                    'INSERT INTO notes (uid, user_id, title, content, body_size) VALUES (?, ?, ?, ?, ?)',
+                    (uid, user_id, title, inline, body_size)
+                ).lastrowid
+                if body is not None:
+                    bodies.save_body(conn, key, body)
+                if client_id is not None:
+                    id_map[client_id] = new_id
+                results.append({'id': new_id, 'status': 'created'})
+            elif op == 'update':
+                note = find_note(conn, note_id, user_id, REVISION_BASE_COLUMNS)
+                if note is not None:
+                    conn.execute('''
+                        UPDATE notes
+                        SET title = COALESCE(?, title),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (title, note['id']))
+                    if isinstance(content, str):
+                        bodies.write_content(conn, note['id'], content)
+                    else:
+                        content = note['content']
+                    revisions.record(conn, note['id'], note,
+                                     title if title is not None else note['title'], content)
+                results.append({'id': note_id, 'status': 'updated' if note else 'not_found'})
+            elif op == 'patch':
+                status, _ = patch_note(conn, note_id, user_id, operation.get('base_hash'),
+                                       operation.get('patch'), title)
+                results.append({'id': note_id, 'status': status})
+            elif op == 'delete':
+                deleted = conn.execute(
+                    'DELETE FROM notes WHERE uid = ? AND user_id = ?', (ids.to_uid(note_id), user_id)
+                ).rowcount
+                results.append({'id': note_id, 'status': 'deleted' if deleted else 'not_found'})
+            else:
+                results.append({'id': client_id, 'status': 'invalid'})
+    conn.close()
+    
+    return api_response({'results': results, 'ids': id_map}), 200
+
+@api.route('/api/sync', methods=['GET'])
+def sync_notes():
+    """Изменения заметок пользователя с момента since"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    since = request.args.get('since')
+    limit = request.args.get('limit') or str(SYNC_PAGE_SIZE)
+    args = {'updated_from': since, 'sort': 'updated', 'order': 'asc', 'limit': limit,
+            'cursor': request.args.get('cursor')}
+    try:
+        query = NoteListQuery.from_args(user_id, {k: v for k, v in args.items() if v})
+    except QueryError as e:
+        return api_response({'error': str(e)}), 400
+    sql, params = query.build(select_columns(NOTE_COLUMNS))
+    
+    conn = get_db_connection()
+    server_time = sync_server_time(conn)
+    notes = conn.execute(sql, params).fetchall()
+    deleted = []
+    if since and not request.args.get('cursor'):
+        deleted = [row['id'] for row in conn.execute(
+            f'SELECT {ids.text_sql("uid")} AS id FROM note_tombstones WHERE user_id = ? AND deleted_at >= ?',
+            (user_id, query.ranges['updated_at'][0])
+        )]
+    conn.close()
+    notes, next_cursor = query.paginate(notes)
+    
+    return api_response({
+        'notes': [{column: note[column] for column in NOTE_COLUMNS} for note in notes],
+        'deleted': deleted,
+        'next_cursor': next_cursor,
+        'server_time': server_time
+    }), 200
+
+@api.route('/api/sync/reconcile', methods=['POST'])
+def reconcile_notes():
+    """Сверка заметок клиента по дереву хешей: несовпавшие узлы и заметки"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    nodes = data.get('nodes') or {}
+    fetch = data.get('fetch') or []
+    
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    if (not isinstance(nodes, dict) or len(nodes) > note_hashes.MAX_NODES
+            or not all(hashtree.is_prefix(prefix) and isinstance(value, str)
+                       for prefix, value in nodes.items())):
+        return api_response(
+            {'error': f'Nodes must map at most {note_hashes.MAX_NODES} hex prefixes to hashes'}
+        ), 400
+    if (not isinstance(fetch, list) or len(fetch) > SYNC_PAGE_SIZE
+            or not all(isinstance(note_id, str) for note_id in fetch)):
+        return api_response({'error': f'Fetch must be a list of at most {SYNC_PAGE_SIZE} ids'}), 400
+    
+    conn = get_db_connection()
+    server_time = sync_server_time(conn)
+    differing = {}
+    if nodes:
+        note_hashes.refresh(conn, user_id)
+        differing = note_hashes.compare(conn, user_id, nodes)
+    notes = []
+    uids = [uid for uid in map(ids.to_uid, fetch) if uid is not None]
+    if uids:
+        placeholders = ', '.join('?' * len(uids))
+        notes = conn.execute(
+            f'SELECT {select_columns(NOTE_COLUMNS)} FROM notes WHERE user_id = ? AND uid IN ({placeholders})',
+            (user_id, *uids)
+        ).fetchall()
+    conn.close()
+    
+    return api_response({
+        'nodes': differing,
+        'notes': [{column: note[column] for column in NOTE_COLUMNS} for note in notes],
+        'server_time': server_time
+    }), 200
+
+JOB_COLUMNS = (f'jobs.id AS job_key, {ids.text_sql("jobs.uid")} AS id, kind, priority, status, '
+               'progress, message, error, created_at, started_at, finished_at')
+
+def find_job(conn, job_id, user_id):
+    """Задание пользователя с размером результата; None, если его нет"""
+    uid = ids.to_uid(job_id)
+    if uid is None:
+        return None
+    return conn.execute(
+        f'SELECT {JOB_COLUMNS}, length(r.data) AS result_size, r.content_type, r.filename '
+        'FROM jobs LEFT JOIN job_results r ON r.job_id = jobs.id WHERE uid = ? AND user_id = ?',
+        (uid, user_id)
     ).fetchone()
+
+def job_payload(job):
+    """Состояние задания для ответа API"""
+    payload = {column: job[column] for column in (
+        'id', 'kind', 'priority', 'status', 'progress', 'message', 'error',
+        'created_at', 'started_at', 'finished_at'
+    )}
+    payload['result'] = None
+    if job['result_size'] is not None:
+        payload['result'] = {
+            'url': f"/api/jobs/{job['id']}/result",
+            'size': job['result_size'],
+            'content_type': job['content_type'],
+            'filename': job['filename'],
+        }
+    return payload
+
+@api.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Поставить долгую операцию в очередь фоновых заданий"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    try:
+        job_id = current_app.extensions['jobs'].submit(
+            conn, user_id, data.get('kind'), data.get('params'), data.get('priority', 5)
+        )
+        job = find_job(conn, job_id, user_id)
+    except QueueFull as e:
+        return api_response({'error': str(e)}), 429
+    except JobError as e:
+        return api_response({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    response = api_response(job_payload(job))
+    response.headers['Location'] = f'/api/jobs/{job_id}'
+    return response, 202
+
+@api.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Последние задания пользователя"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    jobs = conn.execute(
+        f'SELECT {JOB_COLUMNS}, length(r.data) AS result_size, r.content_type, r.filename '
+        'FROM jobs LEFT JOIN job_results r ON r.job_id = jobs.id '
+        'WHERE user_id = ? ORDER BY jobs.id DESC LIMIT 50', (user_id,)
+    ).fetchall()
+    conn.close()
+    
+    return api_response({'jobs': [job_payload(job) for job in jobs]}), 200
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Состояние и прогресс задания"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    job = find_job(conn, job_id, user_id)
+    conn.close()
+    
+    if not job:
+        return api_response({'error': 'Job not found'}), 404
+    response = api_response(job_payload(job))
+    if job['status'] in ('queued', 'running'):
+        response.headers['Retry-After'] = '1'
+    return response, 200
+
+@api.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Отменить задание (выполняемое останавливается при следующем прогрессе)"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    job = find_job(conn, job_id, user_id)
+    if job:
+        current_app.extensions['jobs'].cancel(conn, job['job_key'])
+        job = find_job(conn, job_id, user_id)
+    conn.close()
+    
+    if not job:
+        return api_response({'error': 'Job not found'}), 404
+    return api_response(job_payload(job)), 200
+
+@api.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Результат завершенного задания (файл)"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    job = find_job(conn, job_id, user_id)
+    if not job or job['result_size'] is None:
+        conn.close()
+        if job:
+            return api_response({'error': 'Job has no result', 'status': job['status']}), 409
+        return api_response({'error': 'Job not found'}), 404
+    
+    # Результат читается из job_results кусками по мере отправки
+    blob = conn.blobopen('job_results', 'data', job['job_key'], readonly=True)
+    response = current_app.response_class(
+        bodies.iter_blob(blob, 0, job['result_size']), mimetype=job['content_type'],
+        direct_passthrough=True
+    )
+    response.call_on_close(blob.close)
+    response.call_on_close(conn.close)
+    response.content_length = job['result_size']
+    response.headers['Content-Disposition'] = f"attachment; filename=\"{job['filename']}\""
+    return response
+
+@api.route('/api/notes/<note_id>/tags', methods=['POST'])
+def add_note_tags(note_id):
+    """Добавить теги к заметке"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    tags = normalize_tags(data.get('tags'))
+    
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    if not tags:
+        return api_response({'error': 'Tags are required'}), 400
+    
+    conn = get_db_connection()
+    note = find_note(conn, note_id, user_id)
+    if not note:
+        conn.close()
+        return api_response({'error': 'Note not found or access denied'}), 404
+    
+    conn.executemany(
+        'INSERT OR IGNORE INTO note_tags (note_id, user_id, tag) VALUES (?, ?, ?)',
+        [(note['id'], user_id, tag) for tag in tags]
+    )
+    conn.commit()
+    tags = get_note_tags(conn, note['id'])
     conn.close()
     
+    return api_response({'id': note_id, 'tags': tags}), 200
+
+@api.route('/api/notes/<note_id>/tags/<tag>', methods=['DELETE'])
+def remove_note_tag(note_id, tag):
+    """Снять тег с заметки"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    note = find_note(conn, note_id, user_id)
+    affected_rows = 0
     if note:
-        html_content = markdown.markdown(note['content'], extensions=['extra', 'codehilite'])
-        return jsonify({
-            'id': note['id'],
-            'title': note['title'],
-            'html_content': html_content
-        }), 200
+        affected_rows = conn.execute(
+            'DELETE FROM note_tags WHERE note_id = ? AND tag = ?',
+            (note['id'], tag.strip().lower())
+        ).rowcount
+        conn.commit()
+        tags = get_note_tags(conn, note['id'])
+    conn.close()
+    
+    if affected_rows > 0:
+        return api_response({'id': note_id, 'tags': tags}), 200
+    else:
+        return api_response({'error': 'Tag not found or access denied'}), 404
+
+@api.route('/api/tags', methods=['GET'])
+@coalesced
+def get_tags():
+    """Облако тегов: число заметок по каждому тегу"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    rows = conn.execute(
+        'SELECT tag, count FROM tag_counts WHERE user_id = ? ORDER BY count DESC, tag',
+        (user_id,)
+    ).fetchall()
+    conn.close()
+    
+    return api_response({'tags': [{'tag': row['tag'], 'count': row['count']} for row in rows]}), 200
+
+@api.route('/api/notes/<note_id>/html', methods=['GET'])
+@coalesced
+def get_note_html(note_id):
+    """Получить заметку в формате HTML (рендеринг Markdown)"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    note = find_note(conn, note_id, user_id,
+                     f'{ids.ID_SQL} AS id, title, {bodies.CONTENT_SQL} AS content')
+    conn.close()
+    
+    if not note:
+        return api_response({'error': 'Note not found'}), 404
+    try:
+        html_content = current_app.extensions['renderer'].render(note['content'])
+    except RenderError as e:
+        return render_error_response(e)
+    return api_response({
+        'id': note['id'],
+        'title': note['title'],
+        'html_content': html_content
+    }), 200
+
+@api.route('/api/notes/<note_id>/raw', methods=['GET'])
+def get_note_raw(note_id):
+    """Содержимое заметки как text/markdown (с поддержкой Range)"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    
+    conn = get_db_connection()
+    note = find_note(conn, note_id, user_id, 'notes.id, content, body_size')
+    if not note:
+        conn.close()
+        return api_response({'error': 'Note not found'}), 404
+    
+    if note['body_size'] is None:
+        conn.close()
+        data = note['content'].encode('utf-8')
+        length = len(data)
+    else:
+        data = None
+        length = note['body_size']
+    
+    # Неудовлетворимый диапазон - 416; несколько диапазонов не поддерживаются,
+    # на них отвечаем всем содержимым
+    byte_range = request.range.range_for_length(length) if request.range else None
+    if request.range and byte_range is None and len(request.range.ranges) == 1:
+        if data is None:
+            conn.close()
+        response = current_app.response_class(status=416)
+        response.headers['Content-Range'] = f'bytes */{length}'
+        return response
+    start, stop = byte_range or (0, length)
+    
+    if data is not None:
+        response = current_app.response_class(data[start:stop], mimetype='text/markdown')
     else:
-        return jsonify({'error': 'Note not found'}), 404
+        # Тело читается из note_bodies кусками по мере отправки
+        blob = conn.blobopen('note_bodies', 'body', note['id'], readonly=True)
+        response = current_app.response_class(
+            bodies.iter_blob(blob, start, stop), mimetype='text/markdown', direct_passthrough=True
+        )
+        response.call_on_close(blob.close)
+        response.call_on_close(conn.close)
+        response.content_length = stop - start
+    response.headers['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    return response
+
+def render_error_response(error):
+    """Ответ на неудачный рендеринг: 503 при занятых процессах, иначе 422"""
+    response = api_response({'error': str(error), 'reason': error.reason})
+    if error.reason == 'busy':
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return response, 422
+
+@api.route('/api/notes/html', methods=['POST'])
+def batch_note_html():
+    """HTML нескольких заметок; рендеринг распределяется по процессам"""
+    data = get_request_data()
+    user_id = data.get('user_id')
+    requested = data.get('ids')
+    
+    if not user_id:
+        return api_response({'error': 'User ID is required'}), 400
+    if (not isinstance(requested, list) or len(requested) > MAX_HTML_BATCH
+            or not all(isinstance(note_id, str) for note_id in requested)):
+        return api_response(
+            {'error': f'Ids must be a list of at most {MAX_HTML_BATCH} strings'}
+        ), 400
+    
+    uids = {note_id: ids.to_uid(note_id) for note_id in requested}
+    conn = get_db_connection()
+    placeholders = ', '.join('?' * len(uids))
+    rows = {row['uid']: row for row in conn.execute(
+        f'SELECT uid, title, {bodies.CONTENT_SQL} AS content FROM notes '
+        f'WHERE user_id = ? AND uid IN ({placeholders})',
+        (user_id, *uids.values())
+    )} if uids else {}
+    conn.close()
+    
+    notes = {note_id: rows[uid] for note_id, uid in uids.items() if uid in rows}
+    found = list(notes)
+    rendered = dict(zip(found, current_app.extensions['renderer'].render_many(
+        [notes[note_id]['content'] for note_id in found]
+    )))
+    results = []
+    for note_id in requested:
+        html_content = rendered.get(note_id)
+        if html_content is None:
+            results.append({'id': note_id, 'status': 'not_found'})
+        elif isinstance(html_content, RenderError):
+            results.append({'id': note_id, 'status': html_content.reason})
+        else:
+            results.append({'id': note_id, 'status': 'ok', 'title': notes[note_id]['title'],
+                            'html_content': html_content})
+    
+    return api_response({'results': results}), 200
 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # С debug=True сервер работает в дочернем процессе перезагрузчика;
+    # фоновые службы и прогрев нужны только там
+    app = create_app(start_background=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+    app.run(debug=True, host='0.0.0.0', port=config.PORT)
\ No newline at end of file
@@ -0,0 +1,345 @@
+"""
+Онлайн-резервное копирование базы данных SQLite
+
+Снимок снимается через sqlite3.Connection.backup небольшими порциями
+страниц с паузами между ними, поэтому работающий сервер не блокируется.
+Готовый снимок проверяется (PRAGMA integrity_check), сжимается gzip,
+сопровождается манифестом с контрольной суммой SHA-256 и ротируется.
+
+Запуск из командной строки:
+    python backup.py backup
+    python backup.py list
+    python backup.py verify notes-20240101-120000.db.gz
+    python backup.py restore notes-20240101-120000.db.gz
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = '.db.gz'
+MANIFEST_SUFFIX = '.json'
+
+
+class BackupError(Exception):
+    """Ошибка создания, проверки или восстановления снимка"""
+
+
+class _TooManyRestarts(Exception):
+    """Порционное копирование слишком часто начинается заново"""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def integrity_check(path):
+    """Результат PRAGMA integrity_check для файла базы"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+
+
+class BackupManager:
+    """Создание, ротация, проверка и восстановление снимков базы"""
+    def __init__(self, database, backup_dir, keep=7, pages=256, sleep=0.005,
+                 max_restarts=3):
+        self.database = database
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.max_restarts = max_restarts
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {
+            'backups': 0,
+            'failures': 0,
+            'running': False,
+            'last_backup': None,
+            'last_error': None,
+        }
+
+    # --- Создание снимка ---
+
+    def create_backup(self):
+        """Снять снимок, проверить, сжать и ротировать; вернуть манифест"""
+        if not self.lock.acquire(blocking=False):
+            raise BackupError("Резервное копирование уже выполняется")
+        self.stats['running'] = True
+        try:
+            manifest = self._create_backup()
+            self.stats['backups'] += 1
+            self.stats['last_backup'] = manifest
+            self.stats['last_error'] = None
+            return manifest
+        except (sqlite3.Error, OSError, BackupError) as e:
+            self.stats['failures'] += 1
+            self.stats['last_error'] = str(e)
+            raise
+        finally:
+            self.stats['running'] = False
+            self.lock.release()
+
+    def _create_backup(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = 'notes-' + datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        raw_path = os.path.join(self.backup_dir, name + '.db.tmp')
+        snapshot_path = os.path.join(self.backup_dir, name + SNAPSHOT_SUFFIX)
+
+        metrics = {'steps': 0, 'restarts': 0, 'max_step_ms': 0.0, 'sleep_seconds': 0.0}
+        state = {'last': None, 'remaining': None, 'pages': self.pages}
+
+        def progress(status, remaining, total):
+            # Время шага - это время удержания блокировки чтения источника
+            now = time.perf_counter()
+            step_ms = (now - state['last']) * 1000
+            metrics['steps'] += 1
+            metrics['max_step_ms'] = max(metrics['max_step_ms'], round(step_ms, 2))
+            metrics['total_pages'] = total
+            if state['remaining'] is not None and remaining > state['remaining']:
+                # Источник изменили другим соединением: SQLite начал копию заново
+                metrics['restarts'] += 1
+                if metrics['restarts'] >= self.max_restarts and state['pages'] != -1:
+                    raise _TooManyRestarts()
+            state['remaining'] = remaining
+            if remaining and self.sleep:
+                time.sleep(self.sleep)
+                metrics['sleep_seconds'] += self.sleep
+            state['last'] = time.perf_counter()
+
+        started = time.perf_counter()
+        source = sqlite3.connect(self.database, uri=True)
+        try:
+            while True:
+                target = sqlite3.connect(raw_path)
+                state['last'] = time.perf_counter()
+                state['remaining'] = None
+                try:
+                    source.backup(target, pages=state['pages'], progress=progress)
+                    break
+                except _TooManyRestarts:
+                    # При постоянной записи порционная копия не сходится;
+                    # копируем за один шаг (в режиме WAL писатели не ждут)
+                    state['pages'] = -1
+                finally:
+                    target.close()
+        finally:
+            source.close()
+        copy_seconds = time.perf_counter() - started
+
+        try:
+            result = integrity_check(raw_path)
+            if result != 'ok':
+                raise BackupError(f"Снимок поврежден: {result}")
+            raw_size = os.path.getsize(raw_path)
+            with open(raw_path, 'rb') as src, gzip.open(snapshot_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        finally:
+            os.remove(raw_path)
+
+        manifest = {
+            'file': os.path.basename(snapshot_path),
+            'created_at': datetime.now().isoformat(),
+            'database': self.database,
+            'size': raw_size,
+            'compressed_size': os.path.getsize(snapshot_path),
+            'sha256': file_sha256(snapshot_path),
+            'copy_seconds': round(copy_seconds, 3),
+            'duration_seconds': round(time.perf_counter() - started, 3),
+            'pages_per_step': state['pages'],
+            **metrics,
+        }
+        with open(self._manifest_path(snapshot_path), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        self.rotate()
+        logger.info("Снимок базы создан: %s (%.2f с)", manifest['file'], manifest['duration_seconds'])
+        return manifest
+
+    # --- Ротация и список снимков ---
+
+    @staticmethod
+    def _manifest_path(snapshot_path):
+        return snapshot_path[:-len(SNAPSHOT_SUFFIX)] + MANIFEST_SUFFIX
+
+    def list_backups(self):
+        """Манифесты снимков, от новых к старым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        manifests = []
+        for name in sorted(os.listdir(self.backup_dir), reverse=True):
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            path = os.path.join(self.backup_dir, name)
+            try:
+                with open(self._manifest_path(path), encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError):
+                manifests.append({'file': name, 'compressed_size': os.path.getsize(path)})
+        return manifests
+
+    def rotate(self):
+        """Оставить только self.keep последних снимков"""
+        for manifest in self.list_backups()[self.keep:]:
+            path = os.path.join(self.backup_dir, manifest['file'])
+            for stale in (path, self._manifest_path(path)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+    def resolve(self, name):
+        """Полный путь к снимку по имени файла или пути"""
+        path = name if os.path.sep in name else os.path.join(self.backup_dir, name)
+        if not os.path.exists(path):
+            raise BackupError(f"Снимок не найден: {name}")
+        return path
+
+    # --- Проверка и восстановление ---
+
+    def _unpack(self, snapshot_path, directory):
+        """Распаковать снимок во временный файл и проверить его"""
+        manifest_path = self._manifest_path(snapshot_path)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                expected = json.load(f).get('sha256')
+            if expected and file_sha256(snapshot_path) != expected:
+                raise BackupError("Контрольная сумма снимка не совпадает с манифестом")
+
+        raw_path = os.path.join(directory, 'restore.db')
+        try:
+            with gzip.open(snapshot_path, 'rb') as src, open(raw_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"Не удалось распаковать снимок: {e}")
+
+        result = integrity_check(raw_path)
+        if result != 'ok':
+            raise BackupError(f"Снимок поврежден: {result}")
+        return raw_path
+
+    def verify(self, name):
+        """Проверить контрольную сумму и целостность снимка"""
+        snapshot_path = self.resolve(name)
+        with tempfile.TemporaryDirectory() as tmp:
+            self._unpack(snapshot_path, tmp)
+        return True
+
+    def restore(self, name, target=None):
+        """Восстановить базу из снимка через backup API (без подмены файла)"""
+        snapshot_path = self.resolve(name)
+        target = target or self.database
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_path = self._unpack(snapshot_path, tmp)
+            source = sqlite3.connect(raw_path)
+            destination = sqlite3.connect(target, uri=True, timeout=30)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+                source.close()
+        return target
+
+    # --- Фоновый запуск ---
+
+    def start_backup(self):
+        """Запустить снятие снимка в фоновом потоке; False - уже выполняется"""
+        if self.stats['running'] or (self.thread and self.thread.is_alive()):
+            return False
+
+        def run():
+            try:
+                self.create_backup()
+            except (sqlite3.Error, OSError, BackupError) as e:
+                logger.warning("Ошибка резервного копирования: %s", e)
+
+        self.thread = threading.Thread(target=run, name='db-backup', daemon=True)
+        self.thread.start()
+        return True
+
+    def start_periodic(self, interval):
+        """Снимать снимки каждые interval секунд в фоновом потоке"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.create_backup()
+                except (sqlite3.Error, OSError, BackupError) as e:
+                    logger.warning("Ошибка резервного копирования: %s", e)
+
+        thread = threading.Thread(target=loop, name='db-backup-periodic', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            'backup_dir': self.backup_dir,
+            'keep': self.keep,
+            'pages_per_step': self.pages,
+            'sleep_between_steps': self.sleep,
+            **self.stats,
+            'snapshots': self.list_backups(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервное копирование базы заметок")
+    parser.add_argument('command', choices=('backup', 'list', 'verify', 'restore'))
+    parser.add_argument('snapshot', nargs='?', help="имя файла снимка (для verify/restore)")
+    parser.add_argument('--db', default=config.DATABASE, help="путь к базе SQLite")
+    parser.add_argument('--dir', default=config.BACKUP_DIR, help="каталог снимков")
+    parser.add_argument('--keep', type=int, default=7, help="сколько снимков хранить")
+    parser.add_argument('--pages', type=int, default=256, help="страниц за один шаг копирования")
+    parser.add_argument('--sleep', type=float, default=0.005, help="пауза между шагами, с")
+    args = parser.parse_args()
+
+    manager = BackupManager(args.db, args.dir, keep=args.keep, pages=args.pages, sleep=args.sleep)
+    try:
+        if args.command == 'backup':
+            manifest = manager.create_backup()
+            print(f"✓ Снимок создан: {manifest['file']}")
+            print(f"  Размер: {manifest['size']} байт, сжатый: {manifest['compressed_size']} байт")
+            print(f"  Длительность: {manifest['duration_seconds']} с, шагов: {manifest['steps']}, "
+                  f"макс. шаг: {manifest['max_step_ms']} мс, перезапусков: {manifest['restarts']}")
+        elif args.command == 'list':
+            backups = manager.list_backups()
+            if not backups:
+                print("Снимков нет")
+            for manifest in backups:
+                print(f"{manifest['file']}  {manifest.get('created_at', '?')}  "
+                      f"{manifest.get('compressed_size', '?')} байт")
+        else:
+            if not args.snapshot:
+                parser.error("укажите имя снимка")
+            if args.command == 'verify':
+                manager.verify(args.snapshot)
+                print(f"✓ Снимок {args.snapshot} цел")
+            else:
+                target = manager.restore(args.snapshot)
+                print(f"✓ База {target} восстановлена из {args.snapshot}")
+    except (BackupError, sqlite3.Error, OSError) as e:
+        print(f"✗ Ошибка: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Хранение больших заметок вне строки таблицы notes
+
+Содержимое до LARGE_BODY_BYTES байт хранится в notes.content. Большее
+содержимое записывается в отдельную таблицу note_bodies (BLOB в UTF-8,
+ключ - notes.id), а в notes остаются пустая строка и размер в body_size.
+Так строки notes и страницы ее B-дерева остаются маленькими: списки,
+фильтры и сортировки не читают мегабайтные тела заметок.
+
+Чтения, которым нужно содержимое целиком, берут его выражением
+CONTENT_SQL; GET /api/notes/<id>/raw читает тело кусками через blob I/O
+SQLite (Connection.blobopen), не собирая его в памяти.
+
+Существующие большие заметки переносит `python maintenance.py move-bodies`.
+"""
+
+LARGE_BODY_BYTES = 64 * 1024
+RAW_CHUNK_BYTES = 64 * 1024
+
+# Содержимое заметки независимо от места хранения (для SELECT из notes)
+CONTENT_SQL = (
+    'CASE WHEN notes.body_size IS NULL THEN notes.content '
+    'ELSE (SELECT CAST(body AS TEXT) FROM note_bodies WHERE note_id = notes.id) END'
+)
+
+
+def split_content(content):
+    """(значение notes.content, body_size, тело для note_bodies или None)"""
+    data = content.encode('utf-8')
+    if len(data) > LARGE_BODY_BYTES:
+        return '', len(data), data
+    return content, None, None
+
+
+def save_body(conn, note_id, body):
+    """Записать тело заметки (по notes.id) вне строки или удалить прежнее (body=None)"""
+    if body is None:
+        conn.execute('DELETE FROM note_bodies WHERE note_id = ?', (note_id,))
+    else:
+        conn.execute('''
+            INSERT INTO note_bodies (note_id, body) VALUES (?, ?)
+            ON CONFLICT (note_id) DO UPDATE SET body = excluded.body
+        ''', (note_id, body))
+
+
+def write_content(conn, note_id, content):
+    """Заменить содержимое существующей заметки (по notes.id)"""
+    inline, size, body = split_content(content)
+    conn.execute('UPDATE notes SET content = ?, body_size = ? WHERE id = ?',
+                 (inline, size, note_id))
+    save_body(conn, note_id, body)
+
+
+def iter_blob(blob, start, stop, chunk=RAW_CHUNK_BYTES):
+    """Байты [start, stop) тела заметки кусками по chunk"""
+    blob.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        data = blob.read(min(chunk, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def move_large_bodies(conn):
+    """Перенести содержимое больших заметок из notes в note_bodies; вернуть число"""
+    rows = conn.execute(
+        'SELECT id FROM notes WHERE body_size IS NULL AND length(CAST(content AS BLOB)) > ?',
+        (LARGE_BODY_BYTES,)
+    ).fetchall()
+    for (note_id,) in rows:
+        with conn:
+            content = conn.execute('SELECT content FROM notes WHERE id = ?', (note_id,)).fetchone()[0]
+            write_content(conn, note_id, content)
+    return len(rows)
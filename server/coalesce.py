@@ -0,0 +1,91 @@
+"""
+Объединение одновременных одинаковых запросов на чтение (singleflight)
+
+Когда пользователь открывает одни и те же заметки на нескольких
+устройствах или клиент повторяет запрос, сервер получает несколько
+одинаковых чтений одновременно. Первый из них (ведущий) выполняется, а
+остальные ждут его и получают те же байты ответа.
+
+Ключ - (пользователь, адрес, версия данных пользователя, параметры,
+формат ответа). Версия увеличивается после каждого изменяющего запроса
+пользователя, поэтому чтение, начатое после записи, не присоединится к
+чтению, начатому до нее. Объединяются только одновременные запросы:
+готовые ответы не кэшируются.
+"""
+import threading
+
+
+class _Call:
+    """Выполняемый ведущим запросом расчет"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class UserVersions:
+    """Счетчики версий данных пользователей (в памяти процесса)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = {}
+
+    def get(self, user_id):
+        with self.lock:
+            return self.versions.get(str(user_id), 0)
+
+    def bump(self, user_id):
+        with self.lock:
+            key = str(user_id)
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+
+class SingleFlight:
+    """Одно выполнение func на ключ среди одновременных вызовов"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {}
+
+    def do(self, key, func, label=None):
+        """Результат func(); одновременные вызовы с тем же ключом ждут первого"""
+        with self.lock:
+            counters = self.stats.setdefault(label, {'executions': 0, 'coalesced': 0})
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                counters['executions'] += 1
+            else:
+                counters['coalesced'] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def status(self):
+        with self.lock:
+            endpoints = {label: dict(counters) for label, counters in self.stats.items()}
+            in_flight = len(self.calls)
+        executions = sum(c['executions'] for c in endpoints.values())
+        coalesced = sum(c['coalesced'] for c in endpoints.values())
+        return {
+            'in_flight': in_flight,
+            'executions': executions,
+            'coalesced': coalesced,
+            # Доля запросов, получивших чужой ответ
+            'coalesced_ratio': round(coalesced / (executions + coalesced), 4)
+                               if executions + coalesced else 0.0,
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,71 @@
+"""
+Настройки сервера из переменных окружения
+
+    NOTES_DATABASE           путь к базе SQLite (в режимах в памяти - файл снимков)
+    NOTES_BACKUP_DIR         каталог резервных копий
+    NOTES_STORAGE            file | memory | memory-snapshot (см. storage.py)
+    NOTES_SNAPSHOT_INTERVAL  секунд между снимками базы в памяти на диск
+    NOTES_JOURNAL            путь к журналу изменений базы в памяти (пусто - без журнала)
+    NOTES_PORT               порт HTTP-сервера
+    NOTES_ROLE               standalone | primary | replica (см. replication.py)
+    NOTES_PRIMARY_URL        адрес основного сервера для реплики
+    NOTES_CHANGE_LOG_RETENTION  секунд хранения журнала репликации на основном сервере
+    NOTES_ADMISSION          on | off - контроль допуска запросов (см. ratelimit.py)
+    NOTES_USER_RATE, NOTES_USER_BURST  запросов в секунду и запас на пользователя (0 - без лимита)
+    NOTES_IP_RATE, NOTES_IP_BURST      то же на IP-адрес
+    NOTES_MAX_ACTIVE, NOTES_MAX_QUEUE, NOTES_QUEUE_TIMEOUT
+                             одновременных запросов, длина и таймаут очереди ожидания
+
+Значения читаются при импорте; утилиты командной строки берут отсюда
+пути по умолчанию.
+"""
+import os
+
+STORAGE_MODES = ('file', 'memory', 'memory-snapshot')
+ROLES = ('standalone', 'primary', 'replica')
+
+
+def _float(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} должно быть числом: {value!r}")
+
+
+def _flag(name, default):
+    value = (os.environ.get(name) or '').lower()
+    if not value:
+        return default
+    if value not in ('on', 'off', '1', '0', 'true', 'false'):
+        raise ValueError(f"{name} должно быть on или off: {value!r}")
+    return value in ('on', '1', 'true')
+
+
+DATABASE = os.environ.get('NOTES_DATABASE') or '/workspace/server/notes.db'
+BACKUP_DIR = os.environ.get('NOTES_BACKUP_DIR') or '/workspace/server/backups'
+STORAGE = os.environ.get('NOTES_STORAGE') or 'file'
+SNAPSHOT_INTERVAL = _float('NOTES_SNAPSHOT_INTERVAL', 60.0)
+JOURNAL = os.environ.get('NOTES_JOURNAL') or None
+PORT = int(_float('NOTES_PORT', 5000))
+ROLE = os.environ.get('NOTES_ROLE') or 'standalone'
+PRIMARY_URL = (os.environ.get('NOTES_PRIMARY_URL') or 'http://localhost:5000').rstrip('/')
+CHANGE_LOG_RETENTION = _float('NOTES_CHANGE_LOG_RETENTION', 24 * 3600.0)
+ADMISSION = _flag('NOTES_ADMISSION', True)
+# Аргументы ratelimit.AdmissionControl
+ADMISSION_LIMITS = {
+    'user_rate': _float('NOTES_USER_RATE', 20.0),
+    'user_burst': _float('NOTES_USER_BURST', 40.0),
+    'ip_rate': _float('NOTES_IP_RATE', 200.0),
+    'ip_burst': _float('NOTES_IP_BURST', 400.0),
+    'max_active': int(_float('NOTES_MAX_ACTIVE', 32)),
+    'max_queue': int(_float('NOTES_MAX_QUEUE', 64)),
+    'queue_timeout': _float('NOTES_QUEUE_TIMEOUT', 2.0),
+}
+
+if STORAGE not in STORAGE_MODES:
+    raise ValueError(f"NOTES_STORAGE должно быть одним из {', '.join(STORAGE_MODES)}: {STORAGE!r}")
+if ROLE not in ROLES:
+    raise ValueError(f"NOTES_ROLE должно быть одним из {', '.join(ROLES)}: {ROLE!r}")
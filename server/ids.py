@@ -0,0 +1,83 @@
+"""
+Идентификаторы заметок
+
+Внутренний ключ заметки - целочисленный rowid (notes.id): строки таблицы
+и ссылающиеся на них таблицы упорядочены по времени вставки, новые строки
+дописываются в конец B-дерева.
+
+Публичный id - UUID, хранится компактно: 16 байт в notes.uid. Новые
+заметки получают UUIDv7 (RFC 9562): старшие 48 бит - время в миллисекундах,
+поэтому индекс по uid тоже растет с конца, а не расщепляет страницы по
+всему дереву, как случайные UUIDv4. В API id остается строкой UUID;
+выданные раньше UUIDv4 хранятся теми же 16 байтами и остаются
+действительными. Строковые id старых баз, не являющиеся UUID,
+отображаются в UUIDv5 от исходной строки (migrate_ids.py): заметка
+по-прежнему находится по старому id.
+"""
+import secrets
+import threading
+import time
+import uuid
+
+# Пространство имен UUIDv5 для не-UUID id старых баз
+LEGACY_NAMESPACE = uuid.UUID('6f0e5b1c-3f5a-4c1e-9a7d-2b8e4d9c0a11')
+
+_lock = threading.Lock()
+_last = [0, 0]  # миллисекунды и счетчик последнего UUIDv7
+
+
+def make_uid(ms, counter, rand):
+    """UUIDv7 из времени (мс), 12-битного счетчика и 62 случайных бит"""
+    value = ((ms & 0xFFFFFFFFFFFF) << 80) | (0x7 << 76) | ((counter & 0xFFF) << 64) \
+        | (0b10 << 62) | (rand & 0x3FFFFFFFFFFFFFFF)
+    return value.to_bytes(16, 'big')
+
+
+def new_uid():
+    """Новый UUIDv7 (16 байт); монотонно растет в пределах процесса
+
+    В пределах одной миллисекунды увеличивается счетчик (метод 1 RFC 9562);
+    при его переполнении или переводе часов назад время берется от
+    предыдущего id.
+    """
+    ms = time.time_ns() // 1_000_000
+    with _lock:
+        if ms > _last[0]:
+            # Счетчик начинается со случайного значения в нижней половине
+            counter = secrets.randbits(11)
+        else:
+            ms, counter = _last[0], _last[1] + 1
+            if counter > 0xFFF:
+                ms, counter = ms + 1, secrets.randbits(11)
+        _last[0], _last[1] = ms, counter
+    return make_uid(ms, counter, secrets.randbits(62))
+
+
+def uid_text(uid):
+    """Строка UUID для API"""
+    return str(uuid.UUID(bytes=uid))
+
+
+def to_uid(note_id):
+    """16 байт uid по id из запроса; None, если id не строка
+
+    Строка UUID переводится в байты как есть, любая другая строка - в
+    UUIDv5 от нее (так хранятся не-UUID id старых баз).
+    """
+    if not isinstance(note_id, str):
+        return None
+    try:
+        return uuid.UUID(note_id).bytes
+    except ValueError:
+        return uuid.uuid5(LEGACY_NAMESPACE, note_id).bytes
+
+
+def text_sql(column):
+    """Выражение SQL: строка UUID из 16-байтного столбца"""
+    h = f'hex({column})'
+    return (f"lower(substr({h}, 1, 8) || '-' || substr({h}, 9, 4) || '-' || "
+            f"substr({h}, 13, 4) || '-' || substr({h}, 17, 4) || '-' || substr({h}, 21))")
+
+
+# Публичный id заметки в SELECT из notes
+ID_SQL = text_sql('notes.uid')
@@ -0,0 +1,196 @@
+"""
+Виды фоновых заданий (jobs.py)
+
+Каждый вид - пара функций: проверка параметров при постановке в очередь
+(возвращает нормализованные параметры или бросает JobError) и выполнение
+(получает JobContext, возвращает (байты, тип содержимого, имя файла)).
+
+- export - архив zip: заметки в Markdown и notes.json с метаданными;
+- render - архив zip с HTML заметок (через пул рендеринга);
+- import - создание заметок из списка, порциями по IMPORT_CHUNK в
+  отдельных транзакциях: при отмене созданные заметки остаются;
+- reindex - пересчет производных данных пользователя: tag_counts и
+  отпечатков заметок для сверки (note_hashes).
+"""
+import io
+import json
+import re
+import zipfile
+from datetime import datetime, timezone
+
+import bodies
+import ids
+import note_hashes
+from jobs import JobError
+from render_pool import RenderError
+
+MAX_JOB_IDS = 10000
+MAX_IMPORT_NOTES = 10000
+IMPORT_CHUNK = 500
+RENDER_CHUNK = 32
+
+
+def _json_result(payload, name):
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json', name
+
+
+def _file_name(title, note_id, suffix):
+    """Имя файла заметки в архиве: заголовок без спецсимволов и конец id"""
+    stem = re.sub(r'[^\w\- ]+', '', title).strip()[:50] or 'note'
+    return f'{stem}-{note_id[-8:]}{suffix}'
+
+
+def _stamp():
+    return datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+
+
+def _note_ids(params):
+    note_ids = params.get('ids')
+    if note_ids is None:
+        return None
+    if (not isinstance(note_ids, list) or len(note_ids) > MAX_JOB_IDS
+            or not all(isinstance(note_id, str) for note_id in note_ids)):
+        raise JobError(f"Ids must be a list of at most {MAX_JOB_IDS} strings")
+    return note_ids
+
+
+def _select_notes(job, columns):
+    """Заметки задания: все заметки пользователя или params['ids']"""
+    sql = f'SELECT notes.id AS note_key, {ids.ID_SQL} AS id, {columns} FROM notes WHERE user_id = ?'
+    params = [job.user_id]
+    note_ids = job.params.get('ids')
+    if note_ids is not None:
+        uids = [uid for uid in map(ids.to_uid, note_ids) if uid is not None]
+        if not uids:
+            return []
+        sql += f' AND uid IN ({", ".join("?" * len(uids))})'
+        params += uids
+    return job.conn.execute(sql + ' ORDER BY notes.id', params).fetchall()
+
+
+def _content(job, note_key):
+    return job.conn.execute(
+        f'SELECT {bodies.CONTENT_SQL} FROM notes WHERE id = ?', (note_key,)
+    ).fetchone()[0]
+
+
+# --- export ---
+
+def check_export(params):
+    note_ids = _note_ids(params)
+    return {} if note_ids is None else {'ids': note_ids}
+
+
+def run_export(job):
+    notes = _select_notes(job, 'title, created_at, updated_at')
+    buffer = io.BytesIO()
+    manifest = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for done, note in enumerate(notes, 1):
+            name = _file_name(note['title'], note['id'], '.md')
+            # Содержимое читается по одной заметке: в памяти только архив
+            archive.writestr(f'notes/{name}', _content(job, note['note_key']))
+            tags = [row[0] for row in job.conn.execute(
+                'SELECT tag FROM note_tags WHERE note_id = ? ORDER BY tag', (note['note_key'],)
+            )]
+            manifest.append({'id': note['id'], 'title': note['title'], 'tags': tags,
+                             'created_at': note['created_at'], 'updated_at': note['updated_at'],
+                             'file': f'notes/{name}'})
+            job.progress(done, len(notes))
+        archive.writestr('notes.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return buffer.getvalue(), 'application/zip', f'notes-export-{_stamp()}.zip'
+
+
+# --- render ---
+
+def check_render(params):
+    return check_export(params)
+
+
+def run_render(job):
+    renderer = job.services['renderer']
+    notes = _select_notes(job, 'title')
+    buffer = io.BytesIO()
+    manifest = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for start in range(0, len(notes), RENDER_CHUNK):
+            chunk = notes[start:start + RENDER_CHUNK]
+            results = renderer.render_many([_content(job, note['note_key']) for note in chunk])
+            for note, html_content in zip(chunk, results):
+                entry = {'id': note['id'], 'title': note['title']}
+                if isinstance(html_content, RenderError):
+                    entry['status'] = html_content.reason
+                else:
+                    entry['status'] = 'ok'
+                    entry['file'] = f"html/{_file_name(note['title'], note['id'], '.html')}"
+                    archive.writestr(entry['file'], html_content)
+                manifest.append(entry)
+            job.progress(start + len(chunk), len(notes))
+        archive.writestr('notes.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return buffer.getvalue(), 'application/zip', f'notes-html-{_stamp()}.zip'
+
+
+# --- import ---
+
+def check_import(params):
+    notes = params.get('notes')
+    if not isinstance(notes, list) or not notes or len(notes) > MAX_IMPORT_NOTES:
+        raise JobError(f"Notes must be a list of 1 to {MAX_IMPORT_NOTES} items")
+    normalized = []
+    for note in notes:
+        if not isinstance(note, dict):
+            raise JobError("Each note must be an object with title and content")
+        title = note.get('title', 'Без названия')
+        content = note.get('content', '')
+        if not isinstance(title, str) or not isinstance(content, str):
+            raise JobError("Note title and content must be strings")
+        normalized.append({'title': title, 'content': content})
+    return {'notes': normalized}
+
+
+def run_import(job):
+    notes = job.params['notes']
+    created = []
+    for start in range(0, len(notes), IMPORT_CHUNK):
+        with job.conn:
+            for note in notes[start:start + IMPORT_CHUNK]:
+                uid = ids.new_uid()
+                inline, body_size, body = bodies.split_content(note['content'])
+                key = job.conn.execute(
+                    'INSERT INTO notes (uid, user_id, title, content, body_size) VALUES (?, ?, ?, ?, ?)',
+                    (uid, job.user_id, note['title'], inline, body_size)
+                ).lastrowid
+                if body is not None:
+                    bodies.save_body(job.conn, key, body)
+                created.append(ids.uid_text(uid))
+        job.progress(len(created), len(notes), f'{len(created)} notes created')
+    return _json_result({'ids': created}, f'notes-import-{_stamp()}.json')
+
+
+# --- reindex ---
+
+def check_reindex(params):
+    return {}
+
+
+def run_reindex(job):
+    with job.conn:
+        job.conn.execute('DELETE FROM tag_counts WHERE user_id = ?', (job.user_id,))
+        tags = job.conn.execute('''
+            INSERT INTO tag_counts (user_id, tag, count)
+            SELECT user_id, tag, COUNT(*) FROM note_tags WHERE user_id = ? GROUP BY user_id, tag
+        ''', (job.user_id,)).rowcount
+        job.conn.execute('DELETE FROM note_hashes WHERE user_id = ?', (job.user_id,))
+    job.progress(1, 2, 'tag counts rebuilt')
+    notes = note_hashes.refresh(job.conn, job.user_id)
+    job.progress(2, 2, 'note hashes rebuilt')
+    return _json_result({'tags': tags, 'notes': notes}, f'notes-reindex-{_stamp()}.json')
+
+
+# Имя -> (проверка параметров, выполнение)
+JOB_KINDS = {
+    'export': (check_export, run_export),
+    'render': (check_render, run_render),
+    'import': (check_import, run_import),
+    'reindex': (check_reindex, run_reindex),
+}
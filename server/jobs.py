@@ -0,0 +1,282 @@
+"""
+Очередь фоновых заданий в SQLite
+
+Долгие операции (экспорт, массовый рендеринг, импорт, переиндексация -
+см. job_kinds.py) не выполняются в запросе: POST /api/jobs записывает
+задание в таблицу jobs и сразу отвечает, а потоки-исполнители забирают
+задания по приоритету. Клиент опрашивает GET /api/jobs/<id> и скачивает
+результат из job_results.
+
+- Задание забирается одним UPDATE ... RETURNING: два исполнителя не
+  получат одно задание.
+- У пользователя одновременно выполняется не больше max_running_per_user
+  заданий и стоит в очереди не больше max_queued_per_user.
+- Задания, выполнявшиеся при остановке сервера, при запуске снова
+  ставятся в очередь (не больше MAX_ATTEMPTS попыток).
+- Завершенные задания и их результаты удаляются через result_ttl секунд.
+
+Таблицы jobs не журналируются и не реплицируются: это очередь сервера,
+а не данные пользователя.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import ids
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+FINISHED = ('done', 'failed', 'cancelled')
+MAX_ATTEMPTS = 3
+MIN_PRIORITY, MAX_PRIORITY = 0, 9
+DEFAULT_PRIORITY = 5
+IDLE_WAIT = 5.0            # секунд ожидания исполнителя без заданий
+PROGRESS_INTERVAL = 0.5    # не чаще - запись прогресса в базу
+CLEANUP_INTERVAL = 300.0   # секунд между удалениями старых заданий
+
+
+class JobError(Exception):
+    """Задание отклонено или завершилось ошибкой, понятной пользователю"""
+
+
+class QueueFull(JobError):
+    """Пользователь поставил в очередь слишком много заданий"""
+
+
+class JobCancelled(Exception):
+    """Задание отменено во время выполнения"""
+
+
+class JobContext:
+    """Выполняемое задание: соединение с базой, прогресс и отмена"""
+    def __init__(self, queue, conn, job_key, user_id, params):
+        self.queue = queue
+        self.conn = conn
+        self.job_key = job_key
+        self.user_id = user_id
+        self.params = params
+        self.services = queue.services
+        self.last_progress = 0.0
+
+    def progress(self, done, total, message=None):
+        """Записать долю выполненного (не чаще PROGRESS_INTERVAL); проверить отмену"""
+        now = time.monotonic()
+        if now - self.last_progress < PROGRESS_INTERVAL and done < total:
+            return
+        self.last_progress = now
+        with self.conn:
+            cancel = self.conn.execute(
+                'UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ? '
+                'RETURNING cancel_requested',
+                (round(done / total, 4) if total else 1.0, message, self.job_key)
+            ).fetchall()
+        if cancel and cancel[0][0]:
+            raise JobCancelled()
+
+
+class JobQueue:
+    """Таблица заданий и потоки-исполнители"""
+    def __init__(self, connect, kinds, workers=2, max_running_per_user=1,
+                 max_queued_per_user=10, result_ttl=24 * 3600, services=None, after_write=None):
+        self.connect = connect
+        # kinds: имя -> (проверка параметров, выполнение)
+        self.kinds = kinds
+        self.workers = workers
+        self.max_running_per_user = max_running_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.result_ttl = result_ttl
+        # Общие службы сервера для заданий (например, пул рендеринга)
+        self.services = services or {}
+        # Вызывается после завершения задания: его изменения - в журнал
+        self.after_write = after_write or (lambda: None)
+        self.wakeup = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.last_cleanup = 0.0
+        self.stats = {'submitted': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'requeued': 0}
+
+    def open(self):
+        """Вернуть в очередь задания, прерванные остановкой сервера"""
+        conn = self.connect()
+        try:
+            with conn:
+                self.stats['requeued'] = conn.execute(
+                    "UPDATE jobs SET status = 'queued', progress = 0 "
+                    "WHERE status = 'running' AND attempts < ?", (MAX_ATTEMPTS,)
+                ).rowcount
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', "
+                    "finished_at = CURRENT_TIMESTAMP WHERE status = 'running'"
+                )
+        finally:
+            conn.close()
+        if self.stats['requeued']:
+            logger.info("Возвращено в очередь прерванных заданий: %s", self.stats['requeued'])
+
+    # --- Запросы API ---
+
+    def submit(self, conn, user_id, kind, params, priority=DEFAULT_PRIORITY):
+        """Поставить задание в очередь; вернуть его публичный id"""
+        if kind not in self.kinds:
+            raise JobError(f"Unknown job kind: {kind}")
+        if (not isinstance(priority, int) or isinstance(priority, bool)
+                or not MIN_PRIORITY <= priority <= MAX_PRIORITY):
+            raise JobError(f"Priority must be an integer from {MIN_PRIORITY} to {MAX_PRIORITY}")
+        check, _ = self.kinds[kind]
+        params = check(params or {})
+        with conn:
+            # Подсчет и вставка под блокировкой записи: одновременные запросы
+            # пользователя не превысят лимит
+            conn.execute('BEGIN IMMEDIATE')
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+                (user_id,)
+            ).fetchone()[0]
+            if queued >= self.max_queued_per_user:
+                raise QueueFull(f"At most {self.max_queued_per_user} unfinished jobs per user")
+            uid = ids.new_uid()
+            conn.execute(
+                'INSERT INTO jobs (uid, user_id, kind, params, priority) VALUES (?, ?, ?, ?, ?)',
+                (uid, user_id, kind, json.dumps(params, ensure_ascii=False), priority)
+            )
+        self.stats['submitted'] += 1
+        with self.wakeup:
+            self.wakeup.notify()
+        return ids.uid_text(uid)
+
+    def cancel(self, conn, job_key):
+        """Отменить задание: из очереди - сразу, выполняемое - при следующем прогрессе"""
+        with conn:
+            cancelled = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND status = 'queued'", (job_key,)
+            ).rowcount
+            if not cancelled:
+                conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_key,)
+                )
+        if cancelled:
+            self.stats['cancelled'] += 1
+
+    # --- Исполнители ---
+
+    def _claim(self, conn, worker):
+        """Забрать задание с наибольшим приоритетом, не превышая лимит пользователя"""
+        with conn:
+            rows = conn.execute('''
+                UPDATE jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1,
+                    worker = ?
+                WHERE id = (
+                    SELECT id FROM jobs j
+                    WHERE status = 'queued' AND (
+                        SELECT COUNT(*) FROM jobs r WHERE r.user_id = j.user_id AND r.status = 'running'
+                    ) < ?
+                    ORDER BY priority DESC, id
+                    LIMIT 1
+                )
+                RETURNING id, user_id, kind, params
+            ''', (worker, self.max_running_per_user)).fetchall()
+        return rows[0] if rows else None
+
+    def _run(self, conn, job):
+        job_key, user_id, kind, params = job
+        _, run = self.kinds[kind]
+        context = JobContext(self, conn, job_key, user_id, json.loads(params))
+        try:
+            result = run(context)
+        except JobCancelled:
+            conn.rollback()
+            self._finish(conn, job_key, 'cancelled')
+        except JobError as e:
+            conn.rollback()
+            self._finish(conn, job_key, 'failed', error=str(e))
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Задание %s (%s) завершилось ошибкой", job_key, kind)
+            self._finish(conn, job_key, 'failed', error=f'{type(e).__name__}: {e}')
+        else:
+            self._finish(conn, job_key, 'done', result=result)
+        self.after_write()
+        # Освободилось место в лимите пользователя
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def _finish(self, conn, job_key, status, result=None, error=None):
+        """Записать итог; result - (байты, тип содержимого, имя файла)"""
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP, '
+                'progress = CASE WHEN ? = \'done\' THEN 1 ELSE progress END WHERE id = ?',
+                (status, error, status, job_key)
+            )
+            if result is not None:
+                data, content_type, filename = result
+                conn.execute(
+                    'INSERT OR REPLACE INTO job_results (job_id, data, content_type, filename) '
+                    'VALUES (?, ?, ?, ?)', (job_key, data, content_type, filename)
+                )
+        self.stats[status] += 1
+
+    def cleanup(self, conn):
+        """Удалить завершенные задания старше result_ttl; вернуть их число"""
+        with conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') "
+                "AND finished_at < datetime('now', ?)", (f'-{int(self.result_ttl)} seconds',)
+            ).fetchall()]
+            for job_key in expired:
+                conn.execute('DELETE FROM job_results WHERE job_id = ?', (job_key,))
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_key,))
+        return len(expired)
+
+    def _worker(self, worker):
+        conn = self.connect(timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    if time.monotonic() - self.last_cleanup > CLEANUP_INTERVAL:
+                        self.last_cleanup = time.monotonic()
+                        self.cleanup(conn)
+                    job = self._claim(conn, worker)
+                except sqlite3.Error as e:
+                    logger.warning("Ошибка очереди заданий: %s", e)
+                    job = None
+                if job is not None:
+                    self._run(conn, tuple(job))
+                    continue
+                with self.wakeup:
+                    self.wakeup.wait(IDLE_WAIT)
+        finally:
+            conn.close()
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(f'{os.getpid()}-{number}',),
+                                      name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def status(self):
+        conn = self.connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        finally:
+            conn.close()
+        return {
+            'workers': len(self.threads),
+            'max_running_per_user': self.max_running_per_user,
+            'max_queued_per_user': self.max_queued_per_user,
+            'jobs': {status: counts.get(status, 0) for status in STATUSES},
+            **self.stats,
+        }
@@ -0,0 +1,228 @@
+"""
+Журнал изменений базы в памяти для восстановления после сбоя
+
+Триггеры на таблицах JOURNALED_TABLES записывают образ каждой измененной
+строки (upsert - строка целиком, delete - первичный ключ) в таблицу
+mutation_journal той же базы. flush() переносит зафиксированные записи в
+файл - по строке JSON на запись, с fsync - и удаляет их из таблицы.
+Сервер вызывает flush() после каждого изменяющего запроса, поэтому
+подтвержденная клиенту запись уже есть на диске.
+
+Номера записей (seq) растут вместе с транзакциями: SQLite выполняет
+записи по одной. Снимок базы содержит номер последней выданной записи
+(sqlite_sequence), и при восстановлении из журнала применяются только
+записи с большими номерами; после снимка они же остаются в файле
+(compact).
+
+tag_counts не журналируется: при применении записей ее поддерживают
+триггеры note_tags, как и при обычной записи.
+"""
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'mutation_journal'
+JOURNALED_TABLES = ('users', 'notes', 'note_tags', 'note_bodies', 'note_tombstones', 'note_revisions')
+EVENTS = ('insert', 'update', 'delete')
+
+
+def _columns(conn, table):
+    """[(столбец, это BLOB)], столбцы первичного ключа"""
+    info = conn.execute(f'PRAGMA table_info({table})').fetchall()
+    columns = [(row[1], (row[2] or '').upper() == 'BLOB') for row in info]
+    key = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+    return columns, key
+
+
+def _json_object(prefix, columns):
+    # BLOB - в hex: JSON не хранит байты
+    return 'json_object({})'.format(', '.join(
+        f"'{name}', " + (f'hex({prefix}.{name})' if blob else f'{prefix}.{name}')
+        for name, blob in columns
+    ))
+
+
+def create_triggers(conn, log_table, tables, prefix):
+    """Триггеры {prefix}_{таблица}_{событие}: образы измененных строк tables в log_table"""
+    for table in tables:
+        columns, key = _columns(conn, table)
+        images = {
+            'insert': ('upsert', _json_object('NEW', columns)),
+            'update': ('upsert', _json_object('NEW', columns)),
+            'delete': ('delete', _json_object('OLD', [c for c in columns if c[0] in key])),
+        }
+        for event, (op, image) in images.items():
+            # Пересоздаются: схема таблицы могла измениться
+            conn.execute(f'DROP TRIGGER IF EXISTS {prefix}_{table}_{event}')
+            conn.execute(f'''
+                CREATE TRIGGER {prefix}_{table}_{event} AFTER {event.upper()} ON {table}
+                BEGIN
+                    INSERT INTO {log_table} (tbl, op, row) VALUES ('{table}', '{op}', {image});
+                END
+            ''')
+
+
+def drop_triggers(conn, tables, prefix):
+    for table in tables:
+        for event in EVENTS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {prefix}_{table}_{event}')
+
+
+def install(conn):
+    """Таблица журнала и триггеры по текущей схеме таблиц"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row TEXT NOT NULL
+        )
+    ''')
+    create_triggers(conn, TABLE, JOURNALED_TABLES, 'journal')
+    conn.commit()
+
+
+def uninstall(conn):
+    """Удалить триггеры и таблицу журнала (журнал выключен)"""
+    drop_triggers(conn, JOURNALED_TABLES, 'journal')
+    conn.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    conn.commit()
+
+
+def last_seq(conn, table=TABLE):
+    """Номер последней выданной записи журнала (0, если записей не было)"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchall()
+    return row[0][0] if row else 0
+
+
+def read_entries(path):
+    """Записи файла журнала по порядку; оборванная последняя строка пропускается"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Сбой во время записи строки: дальше записей нет
+                logger.warning("Журнал %s оборван, хвост пропущен", path)
+                return
+
+
+def apply_entry(conn, entry, schemas):
+    """Применить запись журнала: строку целиком или удаление по ключу"""
+    table = entry['tbl']
+    if table not in schemas:
+        schemas[table] = _columns(conn, table)
+    columns, key = schemas[table]
+    blobs = {name for name, blob in columns if blob}
+    row = {name: bytes.fromhex(value) if name in blobs and value is not None else value
+           for name, value in entry['row'].items()}
+    if entry['op'] == 'delete':
+        conn.execute(f'DELETE FROM {table} WHERE ' + ' AND '.join(f'{k} = ?' for k in key),
+                     [row[k] for k in key])
+        return
+    names = list(row)
+    updates = ', '.join(f'{name} = excluded.{name}' for name in names if name not in key)
+    conn.execute(
+        f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))}) '
+        f'ON CONFLICT DO UPDATE SET {updates}',
+        [row[name] for name in names]
+    )
+
+
+class MutationJournal:
+    """Файл журнала изменений и перенос в него записей из базы"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.stats = {
+            'flushes': 0,
+            'entries_written': 0,
+            'entries_replayed': 0,
+            'last_seq': 0,
+            'compactions': 0,
+        }
+
+    def open(self, conn, connect):
+        """Восстановить изменения после снимка, затем писать новые
+
+        conn - соединение с базой, загруженной из снимка (или пустой);
+        connect() открывает соединение для переноса записей.
+        """
+        install(conn)
+        snapshot_seq = last_seq(conn)
+        # Записи, не перенесенные до снимка, в данных снимка уже учтены
+        conn.execute(f'DELETE FROM {TABLE}')
+        schemas = {}
+        seq = snapshot_seq
+        for entry in read_entries(self.path):
+            if entry['seq'] <= seq:
+                continue
+            apply_entry(conn, entry, schemas)
+            seq = entry['seq']
+            self.stats['entries_replayed'] += 1
+        # Триггеры записали примененные изменения еще раз - они уже в файле
+        conn.execute(f'DELETE FROM {TABLE}')
+        if conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (seq, TABLE)).rowcount == 0:
+            conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (TABLE, seq))
+        conn.commit()
+        self.stats['last_seq'] = seq
+        # Файл обрезается до последней целой записи
+        self.compact(snapshot_seq)
+        self.conn = connect(check_same_thread=False)
+        if self.stats['entries_replayed']:
+            logger.info("Из журнала применено записей: %s", self.stats['entries_replayed'])
+
+    def flush(self):
+        """Перенести зафиксированные записи в файл; вернуть их число"""
+        if self.conn is None:
+            return 0
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT seq, tbl, op, row FROM {TABLE} ORDER BY seq'
+            ).fetchall()
+            if not rows:
+                return 0
+            with open(self.path, 'ab') as f:
+                for seq, table, op, row in rows:
+                    record = {'seq': seq, 'tbl': table, 'op': op, 'row': json.loads(row)}
+                    f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            with self.conn:
+                self.conn.execute(f'DELETE FROM {TABLE} WHERE seq <= ?', (rows[-1][0],))
+            self.stats['flushes'] += 1
+            self.stats['entries_written'] += len(rows)
+            self.stats['last_seq'] = rows[-1][0]
+            return len(rows)
+
+    def compact(self, snapshot_seq):
+        """Оставить в файле только записи новее снимка"""
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for entry in read_entries(self.path):
+                    if entry['seq'] > snapshot_seq:
+                        f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.stats['compactions'] += 1
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def status(self):
+        return {
+            'path': self.path,
+            'bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            **self.stats,
+        }
@@ -0,0 +1,301 @@
+"""
+Фоновое обслуживание базы данных SQLite
+
+Планировщик работает в отдельном потоке внутри сервера и в периоды
+низкой нагрузки выполняет короткие шаги обслуживания:
+- PRAGMA incremental_vacuum небольшими порциями страниц;
+- PRAGMA optimize / ANALYZE с ограничением analysis_limit;
+- контрольные точки WAL (PASSIVE всегда, TRUNCATE - в простое).
+
+Каждый шаг ограничен по времени, чтобы запись в базу блокировалась
+не дольше нескольких миллисекунд.
+
+Запуск из командной строки:
+    python maintenance.py status
+    python maintenance.py run
+    python maintenance.py enable-incremental
+    python maintenance.py move-bodies
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA optimize с флагом 0x10000 анализирует все таблицы, а не только
+# использованные этим соединением; флаг поддерживается с SQLite 3.46
+OPTIMIZE_ALL_TABLES = sqlite3.sqlite_version_info >= (3, 46, 0)
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+class MaintenanceScheduler(threading.Thread):
+    """Планировщик обслуживания базы в периоды низкой нагрузки"""
+    def __init__(self, database, tick=1.0, idle_after=2.0, slice_budget_ms=5.0,
+                 min_pages=8, max_pages=1024, optimize_interval=3600,
+                 checkpoint_interval=30, wal_truncate_bytes=16 * 1024 * 1024):
+        super().__init__(name='db-maintenance', daemon=True)
+        self.database = database
+        self.tick = tick
+        self.idle_after = idle_after
+        self.slice_budget_ms = slice_budget_ms
+        self.min_pages = min_pages
+        self.max_pages = max_pages
+        self.optimize_interval = optimize_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.wal_truncate_bytes = wal_truncate_bytes
+
+        self.pages_per_slice = min_pages
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.last_request = time.monotonic()
+        self.stop_event = threading.Event()
+
+        self.last_optimize = 0.0
+        self.last_checkpoint = 0.0
+        self.stats = {
+            'vacuum_slices': 0,
+            'vacuum_pages': 0,
+            'reclaimed_bytes': 0,
+            'wal_reclaimed_bytes': 0,
+            'optimize_runs': 0,
+            'checkpoints': 0,
+            'checkpoints_busy': 0,
+            'max_step_ms': 0.0,
+            'last_optimize_at': None,
+            'last_checkpoint_at': None,
+            'errors': 0,
+        }
+
+    # --- Сигналы нагрузки от сервера ---
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+            self.last_request = time.monotonic()
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.last_request = time.monotonic()
+
+    def is_idle(self):
+        with self.lock:
+            return self.in_flight == 0 and time.monotonic() - self.last_request >= self.idle_after
+
+    # --- Основной цикл ---
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        conn = self._connect()
+        try:
+            while not self.stop_event.wait(self.tick):
+                try:
+                    self.run_once(conn)
+                except sqlite3.Error as e:
+                    self.stats['errors'] += 1
+                    logger.warning("Ошибка обслуживания базы: %s", e)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, uri=True, isolation_level=None, check_same_thread=False)
+        # Не ждем чужих блокировок дольше бюджета одного шага
+        conn.execute(f'PRAGMA busy_timeout = {max(1, int(self.slice_budget_ms))}')
+        return conn
+
+    def run_once(self, conn, force=False):
+        """Один такт планировщика; force - выполнить все шаги без учета нагрузки"""
+        now = time.monotonic()
+
+        # PASSIVE не ждет ни читателей, ни писателей, поэтому выполняется всегда
+        if force or now - self.last_checkpoint >= self.checkpoint_interval:
+            truncate = force or (self.is_idle() and self._wal_size() >= self.wal_truncate_bytes)
+            self.checkpoint(conn, truncate=truncate)
+            self.last_checkpoint = now
+
+        if not force and not self.is_idle():
+            return
+
+        if force or now - self.last_optimize >= self.optimize_interval:
+            self.optimize(conn)
+            self.last_optimize = now
+
+        self.vacuum_slice(conn)
+
+    def _timed(self, conn, sql, script=False):
+        started = time.perf_counter()
+        if script:
+            # executescript прогоняет оператор до конца; incremental_vacuum
+            # через execute освобождает лишь одну страницу за шаг
+            conn.executescript(sql)
+            rows = []
+        else:
+            rows = conn.execute(sql).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['max_step_ms'] = max(self.stats['max_step_ms'], round(elapsed_ms, 2))
+        return rows, elapsed_ms
+
+    def vacuum_slice(self, conn):
+        """Вернуть в файловую систему порцию свободных страниц"""
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if auto_vacuum != 2 or freelist == 0:
+            return 0
+
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        before = conn.execute('PRAGMA page_count').fetchone()[0]
+        pages = min(self.pages_per_slice, freelist)
+        _, elapsed_ms = self._timed(conn, f'PRAGMA incremental_vacuum({pages});', script=True)
+        after = conn.execute('PRAGMA page_count').fetchone()[0]
+
+        # Подстраиваем размер порции под бюджет времени одного шага
+        if elapsed_ms > self.slice_budget_ms:
+            self.pages_per_slice = max(self.min_pages, self.pages_per_slice // 2)
+        elif elapsed_ms < self.slice_budget_ms / 4:
+            self.pages_per_slice = min(self.max_pages, self.pages_per_slice * 2)
+
+        reclaimed = max(0, before - after)
+        self.stats['vacuum_slices'] += 1
+        self.stats['vacuum_pages'] += reclaimed
+        self.stats['reclaimed_bytes'] += reclaimed * page_size
+        return reclaimed
+
+    def optimize(self, conn):
+        """Обновить статистику планировщика запросов"""
+        # analysis_limit ограничивает ANALYZE выборкой строк из каждого индекса
+        conn.execute('PRAGMA analysis_limit = 400')
+        if OPTIMIZE_ALL_TABLES:
+            self._timed(conn, 'PRAGMA optimize = 0x10002')
+        else:
+            self._timed(conn, 'ANALYZE')
+        self.stats['optimize_runs'] += 1
+        self.stats['last_optimize_at'] = time.time()
+
+    def _wal_size(self):
+        wal_path = self.database + '-wal'
+        return os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+    def checkpoint(self, conn, truncate=False):
+        """Перенести WAL в основной файл; truncate - заодно усечь файл WAL"""
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            return
+        wal_before = self._wal_size()
+        mode = 'TRUNCATE' if truncate else 'PASSIVE'
+        rows, _ = self._timed(conn, f'PRAGMA wal_checkpoint({mode})')
+        busy = rows[0][0] if rows else 0
+        wal_after = self._wal_size()
+
+        self.stats['checkpoints'] += 1
+        if busy:
+            self.stats['checkpoints_busy'] += 1
+        self.stats['wal_reclaimed_bytes'] += max(0, wal_before - wal_after)
+        self.stats['last_checkpoint_at'] = time.time()
+
+    # --- Отчет ---
+
+    def status(self):
+        """Состояние базы и статистика обслуживания"""
+        report = database_report(self.database)
+        with self.lock:
+            report['in_flight'] = self.in_flight
+        report['idle'] = self.is_idle()
+        report['pages_per_slice'] = self.pages_per_slice
+        report['maintenance'] = dict(self.stats)
+        return report
+
+
+def database_report(database):
+    """Размер, фрагментация и режимы базы"""
+    conn = sqlite3.connect(database, uri=True)
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    finally:
+        conn.close()
+
+    wal_path = database + '-wal'
+    return {
+        'database': database,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_pages': freelist,
+        'file_bytes': page_size * page_count,
+        'free_bytes': page_size * freelist,
+        'fragmentation': round(freelist / page_count, 4) if page_count else 0.0,
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+        'journal_mode': journal_mode,
+    }
+
+
+def enable_incremental_vacuum(database):
+    """Перевести существующую базу в auto_vacuum=INCREMENTAL (полный VACUUM)"""
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных заметок")
+    parser.add_argument('command', choices=('status', 'run', 'enable-incremental', 'move-bodies'))
+    parser.add_argument('--db', default=config.DATABASE, help="путь к базе SQLite")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"База данных не найдена: {args.db}")
+        return 1
+
+    if args.command == 'enable-incremental':
+        # VACUUM переписывает весь файл: выполнять при остановленном сервере
+        print("Перестроение базы (VACUUM)...")
+        if enable_incremental_vacuum(args.db):
+            print("✓ auto_vacuum = INCREMENTAL")
+        else:
+            print("✗ Не удалось включить auto_vacuum = INCREMENTAL")
+            return 1
+    elif args.command == 'move-bodies':
+        # Большие заметки, сохраненные до появления note_bodies
+        from app import init_db
+        from bodies import move_large_bodies
+        init_db(args.db)
+        conn = sqlite3.connect(args.db)
+        try:
+            moved = move_large_bodies(conn)
+        finally:
+            conn.close()
+        print(f"✓ Перенесено заметок: {moved}")
+    elif args.command == 'run':
+        scheduler = MaintenanceScheduler(args.db)
+        conn = scheduler._connect()
+        try:
+            scheduler.run_once(conn, force=True)
+            while scheduler.vacuum_slice(conn):
+                pass
+        finally:
+            conn.close()
+        print(f"✓ Освобождено: {scheduler.stats['reclaimed_bytes']} байт, "
+              f"WAL: {scheduler.stats['wal_reclaimed_bytes']} байт")
+
+    for key, value in database_report(args.db).items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
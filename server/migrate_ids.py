@@ -0,0 +1,250 @@
+"""
+Перевод базы с текстовых id заметок на rowid + uid (см. ids.py)
+
+В старых базах ключ notes - строка UUIDv4 (TEXT PRIMARY KEY), на нее же
+ссылаются note_tags, note_bodies и note_tombstones. Перенос выполняется
+онлайн, не останавливая старый сервер:
+1. триггеры на старых таблицах записывают id измененных заметок в журнал;
+2. заметки копируются порциями по rowid в таблицы notes_v2 и т.д.
+   (id = rowid старой строки, uid - 16 байт старого id), каждая порция -
+   отдельная короткая транзакция;
+3. заметки из журнала копируются заново, пока журнал не опустеет;
+4. в одной транзакции BEGIN IMMEDIATE доносится остаток журнала,
+   переносятся надгробия, старые таблицы удаляются, новые переименовываются.
+
+Перенос можно прервать и продолжить: копирование продолжается с
+последней перенесенной строки.
+
+Запуск из командной строки:
+    python migrate_ids.py --prepare   # шаги 1-3 при работающем старом сервере
+    python migrate_ids.py             # все шаги (старый сервер остановлен)
+
+После --prepare журнал продолжает пополняться триггерами; шаг 4 выполнит
+новый сервер при запуске (init_db) или повторный запуск без --prepare.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import config
+import ids
+import schema
+
+SUFFIX = '_v2'
+LOG_TABLE = 'note_id_migration_log'
+DEFAULT_BATCH = 5000
+DEFAULT_PAUSE = 0.01  # секунд между порциями: окно для записи старого сервера
+
+# Таблица -> события, после которых id заметки попадает в журнал
+LOGGED_EVENTS = {
+    'notes': ('INSERT', 'UPDATE', 'DELETE'),
+    'note_tags': ('INSERT', 'DELETE'),
+    'note_bodies': ('INSERT', 'UPDATE', 'DELETE'),
+}
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def needs_migration(conn):
+    """Есть ли в базе таблица notes со старым текстовым id"""
+    columns = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(notes)')}
+    return columns.get('id', '').upper() == 'TEXT'
+
+
+class _Migration:
+    """Перенос одной базы; conn - соединение в режиме по умолчанию"""
+    def __init__(self, conn, batch, pause, progress):
+        self.conn = conn
+        self.batch = batch
+        self.pause = pause
+        self.progress = progress or (lambda message: None)
+        self.stats = {'copied': 0, 'replayed': 0, 'tombstones': 0, 'seconds': 0.0}
+        conn.create_function('to_uid', 1, ids.to_uid, deterministic=True)
+
+        legacy = _tables(conn)
+        self.has_tags = 'note_tags' in legacy
+        self.has_bodies = 'note_bodies' in legacy
+        self.has_tombstones = 'note_tombstones' in legacy
+        # body_size появился вместе с note_bodies
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(notes)')}
+        self.body_size = 'n.body_size' if 'body_size' in columns else 'NULL'
+
+    def _scalar(self, sql, params=()):
+        # fetchall, а не fetchone: незавершенный SELECT не дает зафиксировать транзакцию
+        return self.conn.execute(sql, params).fetchall()[0][0]
+
+    def prepare(self):
+        """Журнал, триггеры и новые таблицы (если их еще нет)"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {LOG_TABLE} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                note_id TEXT NOT NULL
+            )
+        ''')
+        legacy = _tables(self.conn)
+        for table, events in LOGGED_EVENTS.items():
+            if table not in legacy:
+                continue
+            key = 'id' if table == 'notes' else 'note_id'
+            for event in events:
+                row = 'OLD' if event == 'DELETE' else 'NEW'
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS migrate_ids_{table}_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        INSERT INTO {LOG_TABLE} (note_id) VALUES ({row}.{key});
+                    END
+                ''')
+        # Индексы создаются сразу: порции дописываются в конец B-деревьев
+        schema.create_note_tables(cursor, SUFFIX)
+        self.conn.commit()
+
+    def _copy(self, where, params):
+        """Скопировать заметки старой таблицы (псевдоним n) с тегами и телами"""
+        cursor = self.conn.execute(f'''
+            INSERT INTO notes{SUFFIX} (id, uid, user_id, title, content, created_at, updated_at, body_size)
+            SELECT n.rowid, to_uid(n.id), n.user_id, n.title, n.content, n.created_at, n.updated_at,
+                   {self.body_size}
+            FROM notes n WHERE {where}
+        ''', params)
+        if self.has_tags:
+            self.conn.execute(f'''
+                INSERT INTO note_tags{SUFFIX} (note_id, user_id, tag)
+                SELECT n.rowid, t.user_id, t.tag
+                FROM notes n JOIN note_tags t ON t.note_id = n.id WHERE {where}
+            ''', params)
+        if self.has_bodies:
+            self.conn.execute(f'''
+                INSERT INTO note_bodies{SUFFIX} (note_id, body)
+                SELECT n.rowid, b.body
+                FROM notes n JOIN note_bodies b ON b.note_id = n.id WHERE {where}
+            ''', params)
+        return cursor.rowcount
+
+    def copy(self):
+        """Скопировать заметки порциями по rowid, продолжая с последней"""
+        last = self._scalar(f'SELECT COALESCE(MAX(id), 0) FROM notes{SUFFIX}')
+        total = self._scalar('SELECT COUNT(*) FROM notes WHERE rowid > ?', (last,))
+        while True:
+            upper = self._scalar(
+                'SELECT MAX(rowid) FROM (SELECT rowid FROM notes WHERE rowid > ? ORDER BY rowid LIMIT ?)',
+                (last, self.batch)
+            )
+            if upper is None:
+                break
+            with self.conn:
+                self.stats['copied'] += self._copy('n.rowid > ? AND n.rowid <= ?', (last, upper))
+            last = upper
+            self.progress(f"Скопировано заметок: {self.stats['copied']} из ~{total}")
+            time.sleep(self.pause)
+
+    def _replay_batch(self):
+        """Порция журнала в текущей транзакции; вернуть число записей
+
+        Сначала удаляются все заметки порции, затем копируются заново:
+        старая таблица могла выдать rowid удаленной заметки новой.
+        """
+        rows = self.conn.execute(
+            f'SELECT seq, note_id FROM {LOG_TABLE} ORDER BY seq LIMIT ?', (self.batch,)
+        ).fetchall()
+        note_ids = list(dict.fromkeys(note_id for _, note_id in rows))
+        for note_id in note_ids:
+            for row in self.conn.execute(
+                f'SELECT id FROM notes{SUFFIX} WHERE uid = ?', (ids.to_uid(note_id),)
+            ).fetchall():
+                self.conn.execute(f'DELETE FROM note_tags{SUFFIX} WHERE note_id = ?', row)
+                self.conn.execute(f'DELETE FROM note_bodies{SUFFIX} WHERE note_id = ?', row)
+                self.conn.execute(f'DELETE FROM notes{SUFFIX} WHERE id = ?', row)
+        for note_id in note_ids:
+            self._copy('n.id = ?', (note_id,))
+        if rows:
+            self.conn.execute(f'DELETE FROM {LOG_TABLE} WHERE seq <= ?', (rows[-1][0],))
+        self.stats['replayed'] += len(note_ids)
+        return len(rows)
+
+    def catch_up(self):
+        """Доносить журнал порциями, пока он не опустеет"""
+        while True:
+            with self.conn:
+                if not self._replay_batch():
+                    return
+            self.progress(f"Из журнала перенесено заметок: {self.stats['replayed']}")
+            time.sleep(self.pause)
+
+    def swap(self):
+        """Донести остаток журнала и заменить старые таблицы новыми"""
+        self.conn.commit()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Запись заблокирована - новых записей в журнале не появится
+            while self._replay_batch():
+                pass
+            if self.has_tombstones:
+                self.stats['tombstones'] = self.conn.execute(f'''
+                    INSERT OR REPLACE INTO note_tombstones{SUFFIX} (uid, user_id, deleted_at)
+                    SELECT to_uid(id), user_id, deleted_at FROM note_tombstones
+                ''').rowcount
+            # Вместе с таблицами удаляются их индексы и триггеры
+            self.conn.execute(f'DROP TABLE {LOG_TABLE}')
+            for table in ('note_tags', 'note_bodies', 'note_tombstones', 'notes'):
+                self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+            for table in schema.NOTE_TABLES:
+                self.conn.execute(f'ALTER TABLE {table}{SUFFIX} RENAME TO {table}')
+            schema.create_schema(self.conn.cursor())
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+
+def migrate(conn, batch=DEFAULT_BATCH, pause=DEFAULT_PAUSE, swap=True, progress=None):
+    """Перенести заметки в новые таблицы; с swap=False - без замены старых
+
+    Возвращает статистику: copied, replayed, tombstones, seconds.
+    """
+    started = time.monotonic()
+    migration = _Migration(conn, batch, pause, progress)
+    migration.prepare()
+    migration.copy()
+    migration.catch_up()
+    if swap:
+        migration.swap()
+    migration.stats['seconds'] = round(time.monotonic() - started, 2)
+    return migration.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перевод заметок на целочисленный ключ и UUIDv7")
+    parser.add_argument('--db', default=config.DATABASE, help="путь к базе SQLite")
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help="заметок в порции")
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE, help="пауза между порциями, с")
+    parser.add_argument('--prepare', action='store_true',
+                        help="только скопировать, не заменяя таблицы (старый сервер работает)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"База данных не найдена: {args.db}")
+        return 1
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if not needs_migration(conn):
+            print("✓ База уже использует новые id")
+            return 0
+        stats = migrate(conn, args.batch, args.pause, swap=not args.prepare, progress=print)
+    finally:
+        conn.close()
+
+    print(f"✓ Скопировано: {stats['copied']}, из журнала: {stats['replayed']}, "
+          f"надгробий: {stats['tombstones']}, {stats['seconds']} с")
+    if args.prepare:
+        print("Таблицы заменит новый сервер при запуске или запуск без --prepare")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
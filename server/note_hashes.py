@@ -0,0 +1,73 @@
+"""
+Дерево хешей заметок пользователя для сверки с клиентом
+
+Корзина и отпечаток каждой заметки (common/hashtree.py) хранятся в
+таблице note_hashes. Триггеры удаляют строку заметки при ее изменении
+(schema.TRIGGERS), а refresh() перед сверкой считает отпечатки только
+заметок без строки: содержимое неизмененных заметок не читается.
+
+Заметки узла выбираются диапазоном по индексу (user_id, bucket): все
+корзины под префиксом p лежат в [p, p + 'g'), так как 'g' больше любого
+hex-символа.
+"""
+from common import hashtree
+
+import bodies
+import ids
+
+MAX_NODES = 256  # узлов в одном запросе сверки
+
+
+def refresh(conn, user_id):
+    """Посчитать недостающие отпечатки заметок пользователя; вернуть их число"""
+    rows = conn.execute(f'''
+        SELECT notes.id AS note_key, {ids.ID_SQL} AS id, title, {bodies.CONTENT_SQL} AS content
+        FROM notes
+        WHERE user_id = ? AND NOT EXISTS (SELECT 1 FROM note_hashes h WHERE h.note_id = notes.id)
+    ''', (user_id,)).fetchall()
+    if not rows:
+        return 0
+    with conn:
+        # OR REPLACE: ту же заметку мог посчитать параллельный запрос
+        conn.executemany(
+            'INSERT OR REPLACE INTO note_hashes (note_id, user_id, bucket, digest) VALUES (?, ?, ?, ?)',
+            [(row['note_key'], user_id, hashtree.note_bucket(row['id']),
+              hashtree.note_digest(row['id'], row['title'], row['content'])) for row in rows]
+        )
+    return len(rows)
+
+
+def node_entries(conn, user_id, prefix):
+    """(корзина, отпечаток, notes.id) заметок под узлом prefix"""
+    cursor = conn.cursor()
+    # Кортежи, а не sqlite3.Row: строк может быть сотни тысяч
+    cursor.row_factory = None
+    return cursor.execute(
+        'SELECT bucket, digest, note_id FROM note_hashes WHERE user_id = ? AND bucket >= ? AND bucket < ?',
+        (user_id, prefix, prefix + 'g')
+    ).fetchall()
+
+
+def describe(conn, entries, prefix):
+    """Несовпавший узел: список отпечатков заметок или хеши детей"""
+    if len(entries) > hashtree.LEAF_SIZE and len(prefix) < hashtree.BUCKET_CHARS:
+        return {'children': hashtree.children_hashes(entries, prefix)}
+    digests = {note_key: digest for _, digest, note_key in entries}
+    notes = {}
+    if digests:
+        placeholders = ', '.join('?' * len(digests))
+        for note_key, note_id in conn.execute(
+            f'SELECT id, {ids.ID_SQL} FROM notes WHERE id IN ({placeholders})', list(digests)
+        ):
+            notes[note_id] = hashtree.format_hash(digests[note_key])
+    return {'notes': notes}
+
+
+def compare(conn, user_id, nodes):
+    """Узлы из nodes ({префикс: хеш клиента}), хеш которых на сервере другой"""
+    differing = {}
+    for prefix, client_hash in nodes.items():
+        entries = node_entries(conn, user_id, prefix)
+        if hashtree.node_hash(digest for _, digest, _ in entries) != client_hash:
+            differing[prefix] = describe(conn, entries, prefix)
+    return differing
@@ -0,0 +1,229 @@
+"""
+Построитель запросов списка заметок
+
+Собирает SELECT для GET /api/notes из фильтров (префикс заголовка,
+диапазоны дат создания и изменения, теги) и сортировки. Принимаются
+только сочетания, которые обслуживает один индекс (user_id, <столбец>)
+из schema.py (rowid - notes.id - неявно замыкает индекс):
+не больше одного столбца с диапазоном, и сортировка - по этому же
+столбцу. Так список читается по индексу без полного просмотра таблицы
+и без временного B-дерева для сортировки.
+
+Постраничная выдача - по ключу (keyset): курсор хранит значение столбца
+сортировки и внутренний id (rowid) последней заметки страницы, следующая
+страница начинается
+сразу за ним. Стоимость страницы не зависит от ее номера, в отличие от
+OFFSET.
+"""
+import base64
+import json
+from datetime import datetime
+
+from bodies import CONTENT_SQL
+from ids import ID_SQL
+
+# Ключ сортировки -> столбец; для каждого есть индекс (user_id, столбец)
+SORT_COLUMNS = {
+    'updated': 'updated_at',
+    'created': 'created_at',
+    'title': 'title',
+}
+
+# Размер страницы, если задан limit, не больше MAX_PAGE_SIZE
+MAX_PAGE_SIZE = 1000
+
+# Столбцы ответа: полный вид и краткий (fields=summary) - без содержимого
+NOTE_COLUMNS = ('id', 'title', 'content', 'created_at', 'updated_at')
+SUMMARY_COLUMNS = ('id', 'title', 'created_at', 'updated_at')
+# Выражения столбцов ответа: id - строка UUID из uid, content - с учетом
+# тел вне строки (bodies.py)
+COLUMN_SQL = {'id': f'{ID_SQL} AS id', 'content': f'{CONTENT_SQL} AS content'}
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+class QueryError(ValueError):
+    """Недопустимые параметры запроса списка"""
+
+
+def parse_timestamp(value, name):
+    """Привести дату к формату столбцов SQLite (YYYY-MM-DD HH:MM:SS)"""
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1]
+    value = value.split('.')[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise QueryError(f"Invalid date in {name}")
+
+
+def prefix_upper_bound(prefix):
+    """Наименьшая строка больше всех строк с данным префиксом"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def encode_cursor(value, note_id):
+    """Курсор страницы: значение столбца сортировки и notes.id последней заметки"""
+    raw = json.dumps([value, note_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разобрать курсор; QueryError, если он поврежден"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, note_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise QueryError("Invalid cursor")
+    if not isinstance(value, str) or type(note_id) is not int:
+        raise QueryError("Invalid cursor")
+    return value, note_id
+
+
+def select_columns(columns):
+    """Список выражений SELECT для столбцов ответа"""
+    return ', '.join(COLUMN_SQL.get(column, column) for column in columns)
+
+
+def parse_limit(value):
+    """Размер страницы из строки запроса"""
+    try:
+        limit = int(value)
+    except ValueError:
+        raise QueryError("Limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise QueryError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+class NoteListQuery:
+    """Фильтры и сортировка списка заметок одного пользователя"""
+    def __init__(self, user_id, title_prefix=None, created_from=None, created_to=None,
+                 updated_from=None, updated_to=None, sort=None, order='desc',
+                 tags=None, tag_mode='all', limit=None, after=None):
+        self.user_id = user_id
+        self.title_prefix = title_prefix or None
+        self.ranges = {}
+        if created_from or created_to:
+            self.ranges['created_at'] = (created_from, created_to)
+        if updated_from or updated_to:
+            self.ranges['updated_at'] = (updated_from, updated_to)
+        if self.title_prefix:
+            self.ranges['title'] = (self.title_prefix, prefix_upper_bound(self.title_prefix))
+        self.sort = sort
+        self.order = order
+        self.tags = tags or []
+        self.tag_mode = tag_mode
+        self.limit = limit
+        self.after = after
+        self._validate()
+
+    @classmethod
+    def from_args(cls, user_id, args, tags=None, tag_mode='all'):
+        """Разобрать параметры строки запроса"""
+        dates = {}
+        for name in ('created_from', 'created_to', 'updated_from', 'updated_to'):
+            value = args.get(name)
+            dates[name] = parse_timestamp(value, name) if value else None
+
+        sort = args.get('sort')
+        if sort is not None and sort not in SORT_COLUMNS:
+            raise QueryError(f"Unknown sort key: {sort}")
+        order = args.get('order', 'desc').lower()
+
+        limit = args.get('limit')
+        limit = parse_limit(limit) if limit else None
+        cursor = args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+
+        return cls(user_id, title_prefix=args.get('title_prefix'), sort=sort, order=order,
+                   tags=tags, tag_mode=tag_mode, limit=limit, after=after, **dates)
+
+    def _validate(self):
+        if self.order not in ('asc', 'desc'):
+            raise QueryError("Order must be asc or desc")
+        if len(self.ranges) > 1:
+            raise QueryError(
+                "Only one of title_prefix, created_* and updated_* filters can be combined: "
+                "no index serves ranges on several columns"
+            )
+        if self.ranges and self.sort is not None:
+            column = next(iter(self.ranges))
+            if SORT_COLUMNS[self.sort] != column:
+                raise QueryError(
+                    f"Sort must match the filtered column ({column}): "
+                    "no index serves this filter and sort together"
+                )
+
+    @property
+    def sort_column(self):
+        if self.sort is not None:
+            return SORT_COLUMNS[self.sort]
+        if self.ranges:
+            return next(iter(self.ranges))
+        return 'updated_at'
+
+    def where(self):
+        """Условие WHERE и параметры"""
+        clauses = ['user_id = ?']
+        params = [self.user_id]
+
+        # Префикс заголовка - тоже диапазон: [префикс, следующая строка)
+        for column, (low, high) in self.ranges.items():
+            if low:
+                clauses.append(f'{column} >= ?')
+                params.append(low)
+            if high:
+                clauses.append(f'{column} < ?')
+                params.append(high)
+
+        if self.after:
+            # Сравнение пар (столбец, id) - продолжение того же диапазона индекса.
+            # id везде с именем таблицы: в ответе id - это строка UUID
+            op = '<' if self.order == 'desc' else '>'
+            clauses.append(f'({self.sort_column}, notes.id) {op} (?, ?)')
+            params += list(self.after)
+
+        if self.tags:
+            # Подзапрос целиком обслуживается индексом idx_tags_user_tag
+            placeholders = ', '.join('?' * len(self.tags))
+            subquery = (f'SELECT note_id FROM note_tags '
+                        f'WHERE user_id = ? AND tag IN ({placeholders})')
+            params += [self.user_id] + self.tags
+            if self.tag_mode == 'all':
+                subquery += ' GROUP BY note_id HAVING COUNT(*) = ?'
+                params.append(len(self.tags))
+            clauses.append(f'notes.id IN ({subquery})')
+
+        return ' AND '.join(clauses), params
+
+    def order_by(self):
+        direction = self.order.upper()
+        return f'{self.sort_column} {direction}, notes.id {direction}'
+
+    def build(self, columns='*'):
+        """SQL и параметры запроса"""
+        where, params = self.where()
+        sql = (f'SELECT {columns}, notes.id AS note_key FROM notes '
+               f'WHERE {where} ORDER BY {self.order_by()}')
+        if self.limit:
+            # Лишняя строка показывает, есть ли следующая страница
+            sql += ' LIMIT ?'
+            params.append(self.limit + 1)
+        return sql, params
+
+    def paginate(self, rows):
+        """Обрезать лишнюю строку; вернуть (строки, курсор следующей страницы)"""
+        if not self.limit or len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        last = rows[-1]
+        return rows, encode_cursor(last[self.sort_column], last['note_key'])
+
+    def explain(self, conn):
+        """План выполнения запроса (для диагностики)"""
+        sql, params = self.build()
+        return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
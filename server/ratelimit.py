@@ -0,0 +1,172 @@
+"""
+Контроль допуска запросов: ограничение частоты и параллелизма
+
+- TokenBucket / RateLimiter - ограничение частоты запросов по ключу
+  (пользователь или IP-адрес) алгоритмом «корзины токенов»;
+- ConcurrencyLimiter - ограничение числа одновременно обрабатываемых
+  запросов с ограниченной очередью ожидания;
+- AdmissionControl - объединяет оба механизма и отсекает лишнюю нагрузку
+  заранее, отвечая 429/503 с заголовком Retry-After.
+
+Лимиты задаются в config.py; частота 0 отключает свой лимит, а
+NOTES_ADMISSION=off - контроль допуска целиком (для нагрузочных тестов).
+"""
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        """Взять токен; вернуть 0 или число секунд до появления токена"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Набор корзин токенов по ключам с вытеснением давно неактивных"""
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def check(self, key):
+        """0, если запрос разрешен, иначе рекомендуемая пауза в секундах"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self._evict(now)
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            return bucket.take(now)
+
+    def _evict(self, now):
+        # Полная корзина ничем не отличается от новой - такие можно удалить
+        idle = self.burst / self.rate
+        stale = [key for key, bucket in self.buckets.items() if now - bucket.updated >= idle]
+        for key in stale:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
+
+
+class ConcurrencyLimiter:
+    """Не больше max_active запросов одновременно, очередь - до max_queue"""
+    def __init__(self, max_active, max_queue, queue_timeout):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Занять слот; вернуть (успех, причина отказа, ждали ли в очереди)"""
+        with self.condition:
+            if self.active < self.max_active:
+                self.active += 1
+                return True, None, False
+            if self.waiting >= self.max_queue:
+                return False, 'queue_full', False
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False, 'queue_timeout', True
+                    self.condition.wait(remaining)
+                self.active += 1
+                return True, None, True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+class AdmissionControl:
+    """Решение о допуске запроса: лимиты по IP, по пользователю и параллелизму"""
+    def __init__(self, user_rate=20, user_burst=40, ip_rate=200, ip_burst=400,
+                 max_active=32, max_queue=64, queue_timeout=2.0, enabled=True):
+        # Выключенный контроль допуска пропускает все запросы (admit не вызывается)
+        self.enabled = enabled
+        self.users = RateLimiter(user_rate, user_burst)
+        self.ips = RateLimiter(ip_rate, ip_burst)
+        self.concurrency = ConcurrencyLimiter(max_active, max_queue, queue_timeout)
+        self.lock = threading.Lock()
+        self.counters = {
+            'admitted': 0,
+            'delayed': 0,
+            'rejected_ip': 0,
+            'rejected_user': 0,
+            'shed_queue_full': 0,
+            'shed_queue_timeout': 0,
+        }
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def admit(self, ip, user_id):
+        """None, если запрос допущен (слот занят), иначе (статус, Retry-After)"""
+        retry_after = self.ips.check(ip)
+        if retry_after:
+            self._count('rejected_ip')
+            return 429, retry_after
+
+        if user_id is not None:
+            retry_after = self.users.check(str(user_id))
+            if retry_after:
+                self._count('rejected_user')
+                return 429, retry_after
+
+        ok, reason, waited = self.concurrency.acquire()
+        if not ok:
+            self._count('shed_' + reason)
+            return 503, 1.0
+        self._count('delayed' if waited else 'admitted')
+        return None
+
+    def release(self):
+        self.concurrency.release()
+
+    def status(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            'enabled': self.enabled,
+            'user_rate': self.users.rate,
+            'ip_rate': self.ips.rate,
+            'active': self.concurrency.active,
+            'waiting': self.concurrency.waiting,
+            'max_active': self.concurrency.max_active,
+            'max_queue': self.concurrency.max_queue,
+            'counters': counters,
+        }
+
+
+def retry_after_header(seconds):
+    """Значение Retry-After в целых секундах (не меньше 1)"""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,322 @@
+"""
+Рендеринг Markdown в HTML
+
+Библиотека markdown (и Pygments, который подключает codehilite) грузится
+лениво - при первом рендеринге или в фоновом прогреве, а не при импорте
+сервера, чтобы процесс стартовал быстро.
+
+Рендеринг инкрементальный: текст делится на блоки верхнего уровня, HTML
+каждого блока кэшируется по хешу его текста. После правки одного абзаца
+большой заметки заново рендерится только этот абзац. Подсветка кода
+(codehilite) кэшируется отдельно по паре (язык, код).
+
+Конструкции, связывающие блоки:
+- определения ссылок ([id]: url) и сокращений (*[HTML]: ...) собираются
+  со всего текста и добавляются к каждому блоку, которому они нужны;
+  хеш определений входит в ключ кэша;
+- сноски нумеруются по всему документу, а сырой HTML может занимать
+  несколько блоков - такие заметки рендерятся целиком.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+EXTENSIONS = ['extra', 'codehilite']
+
+BLOCK_CACHE_SIZE = 20000
+CODE_CACHE_SIZE = 2000
+
+# Образец для прогрева: блоки кода с языком и без (угадывание языка
+# в codehilite загружает лексеры Pygments)
+WARM_UP_SAMPLE = """# Прогрев
+
+Текст с **выделением**, [ссылкой](http://example.com) и таблицей:
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+```python
+print("Hello, World!")
+```
+
+    def indented():
+        return 42
+"""
+
+# Разбор на блоки повторяет правила Python-Markdown там, где блоки
+# верхнего уровня влияют друг на друга
+FENCE_RE = re.compile(r'^(`{3,}|~{3,})')
+LIST_ITEM_RE = re.compile(r'^ {0,3}(?:[*+-]|\d+\.)[ \t]+')
+DEF_LINE_RE = re.compile(r'^ {0,3}:[ ]{1,3}')
+REFERENCE_RE = re.compile(
+    r'^[ ]{0,3}\[([^\[\]]*)\]:[ ]*\n?[ ]*([^\s]+)[ ]*(?:\n[ ]*)?((["\'])(.*)\4[ ]*|\((.*)\)[ ]*)?$',
+    re.MULTILINE
+)
+# Похожие на определения строки с любым отступом (например, в пункте списка)
+LOOSE_REFERENCE_RE = re.compile(r'^[ \t]*\[[^\[\]]*\]:', re.MULTILINE)
+ABBREVIATION_RE = re.compile(r'^[*]\[[^\]]*\][ ]?:[ ]*\n?[ ]*.*$', re.MULTILINE)
+LOOSE_ABBREVIATION_RE = re.compile(r'^[ \t]*[*]\[[^\]]*\][ ]?:', re.MULTILINE)
+FOOTNOTE_RE = re.compile(r'\[\^[^\]]+\]')
+RAW_HTML_RE = re.compile(r'^ {0,3}<[A-Za-z!?/]', re.MULTILINE)
+END_MARKER = '\x00'
+
+_lock = threading.Lock()
+_markdown = None
+_local = threading.local()
+_warm = threading.Event()
+
+
+class LRUCache:
+    """Потокобезопасный LRU кэш"""
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+
+block_cache = LRUCache(BLOCK_CACHE_SIZE)
+code_cache = LRUCache(CODE_CACHE_SIZE)
+
+
+def _load():
+    """Импортировать markdown при первом обращении"""
+    global _markdown
+    if _markdown is None:
+        with _lock:
+            if _markdown is None:
+                import markdown
+                _install_code_cache()
+                _markdown = markdown
+    return _markdown
+
+
+def _install_code_cache():
+    """Подменить CodeHilite в codehilite и fenced_code версией с кэшем"""
+    from markdown.extensions import codehilite, fenced_code
+
+    class CachedCodeHilite(codehilite.CodeHilite):
+        def hilite(self, shebang=True):
+            key = (self.src, self.lang, shebang, self.guess_lang, self.use_pygments,
+                   self.lang_prefix, repr(self.pygments_formatter), repr(sorted(self.options.items())))
+            html = code_cache.get(key)
+            if html is None:
+                html = super().hilite(shebang)
+                code_cache.put(key, html)
+            return html
+
+    codehilite.CodeHilite = CachedCodeHilite
+    fenced_code.CodeHilite = CachedCodeHilite
+
+
+class _EndMarker:
+    """Последний постпроцессор: метка в конце текста
+
+    Markdown.convert() обрезает пробелы по краям результата, в том числе
+    перевод строки после HTML блока кода. Без него склеенные блоки
+    отличались бы от рендеринга целиком, поэтому обрезаем сами.
+    """
+    def run(self, text):
+        return text + END_MARKER
+
+
+def _new_markdown():
+    md = _load().Markdown(extensions=EXTENSIONS)
+    md.postprocessors.register(_EndMarker(), 'end_marker', 0)
+    return md
+
+
+def _convert(text, fresh=False):
+    """HTML текста без обрезки пробелов в конце
+
+    Экземпляр Markdown - свой у каждого потока. Расширение abbr регистрирует
+    сокращения в самом экземпляре и не сбрасывает их, поэтому текст с
+    определениями сокращений рендерится новым экземпляром (fresh).
+    """
+    if fresh:
+        md = _new_markdown()
+    else:
+        md = getattr(_local, 'md', None)
+        if md is None:
+            md = _local.md = _new_markdown()
+        md.reset()
+    html = md.convert(text)
+    return html[:-len(END_MARKER)] if html.endswith(END_MARKER) else html
+
+
+def _fenced_lines(lines):
+    """Признак для каждой строки: внутри блока кода ``` / ~~~ (включая ограждения)"""
+    flags = [False] * len(lines)
+    # Ограждения начинаются с ` или ~ - остальные строки не проверяем.
+    # Закрывающее ограждение ищем заранее: без него ``` - обычный текст
+    candidates = [i for i, line in enumerate(lines) if line[:1] in ('`', '~')]
+    closers = {}
+    for i in candidates:
+        closers.setdefault(lines[i].rstrip(' '), []).append(i)
+    after = -1
+    for i in candidates:
+        if i <= after:
+            continue
+        match = FENCE_RE.match(lines[i])
+        if match:
+            end = next((j for j in closers.get(match.group(1), ()) if j > i), None)
+            if end is not None:
+                flags[i:end + 1] = [True] * (end + 1 - i)
+                after = end
+    return flags
+
+
+def split_blocks(text):
+    """Разбить текст на блоки верхнего уровня, которые рендерятся независимо
+
+    Граница - пустая строка вне блока кода, если следующий фрагмент не
+    продолжает предыдущий блок (отступ, цитата, пункт того же списка,
+    определение). Блоки - точные куски исходного текста. Возвращает
+    (блоки, определения ссылок и сокращений, текст вне блоков ```).
+    """
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    fenced = _fenced_lines(lines)
+
+    # Фрагменты между пустыми строками: (первая строка, строка после последней)
+    chunks = []
+    start = None
+    for i, line in enumerate(lines):
+        if fenced[i] or line.strip():
+            if start is None:
+                start = i
+        elif start is not None:
+            chunks.append((start, i))
+            start = None
+    if start is not None:
+        chunks.append((start, len(lines)))
+
+    # Блок: [первая строка, конец, есть список, есть список определений]
+    blocks = []
+    definitions = []
+    for start, end in chunks:
+        # Определения внутри ``` - это код, а не определения
+        plain = [lines[i] for i in range(start, end) if not fenced[i]]
+        plain_text = '\n'.join(plain)
+        rest = REFERENCE_RE.sub('', ABBREVIATION_RE.sub('', plain_text)).strip('\n')
+        only_definitions = not (fenced[start] or rest.strip())
+        if only_definitions:
+            # Внутри других фрагментов такие строки могут оказаться заголовком,
+            # строкой таблицы или термином - их учитывает _needs_full_render
+            definitions += [m.group(0) for m in REFERENCE_RE.finditer(plain_text)]
+            definitions += [m.group(0) for m in ABBREVIATION_RE.finditer(plain_text)]
+        first = lines[start] if fenced[start] else plain[0]
+        has_list = any(LIST_ITEM_RE.match(line) for line in plain)
+        has_defs = any(DEF_LINE_RE.match(line) for line in plain)
+        previous = blocks[-1] if blocks else None
+        joins = previous and (
+            only_definitions
+            or first[:1] in (' ', '\t', '>')         # продолжение, код с отступом, цитата
+            or (has_list and previous[2])            # пункты того же списка
+            or DEF_LINE_RE.match(first)              # определение к предыдущему абзацу-термину
+            or (has_defs and previous[3])            # следующий термин того же списка
+        )
+        if not joins:
+            blocks.append([start, end, has_list, has_defs])
+            continue
+        previous[1] = end
+        previous[2] = previous[2] or has_list
+        previous[3] = previous[3] or has_defs
+        if DEF_LINE_RE.match(first) and len(blocks) > 1 and blocks[-2][3]:
+            # Абзац-термин и определение продолжают список определений перед ним
+            blocks[-2][1:] = [end, blocks[-2][2] or previous[2], True]
+            blocks.pop()
+
+    outside = '\n'.join(line for line, flag in zip(lines, fenced) if not flag)
+    return ['\n'.join(lines[block[0]:block[1]]) for block in blocks], definitions, outside
+
+
+def _needs_full_render(outside, definitions):
+    if FOOTNOTE_RE.search(outside) or RAW_HTML_RE.search(outside):
+        return True
+    # Похожие на определения строки вне фрагментов из одних определений
+    abbreviations = sum(1 for d in definitions if d.startswith('*'))
+    references = len(definitions) - abbreviations
+    return (len(LOOSE_REFERENCE_RE.findall(outside)) > references
+            or len(LOOSE_ABBREVIATION_RE.findall(outside)) > abbreviations)
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.digest()
+
+
+def render_markdown(text):
+    """Преобразовать Markdown в HTML (по блокам, с кэшем)"""
+    blocks, definitions, outside = split_blocks(text)
+    references = '\n'.join(d for d in definitions if not d.startswith('*'))
+    abbreviations = '\n'.join(d for d in definitions if d.startswith('*'))
+    if len(blocks) <= 1 or _needs_full_render(outside, definitions):
+        html = _convert(text, fresh=bool(LOOSE_ABBREVIATION_RE.search(text))).strip()
+        _warm.set()
+        return html
+
+    parts = []
+    for block in blocks:
+        # Определения добавляются только к тем блокам, на которые они могут влиять
+        context = abbreviations
+        if references and '[' in block:
+            context = (context + '\n' + references).strip('\n')
+        key = _digest(block, context)
+        html = block_cache.get(key)
+        if html is None:
+            html = _convert(block + '\n\n' + context if context else block, fresh=bool(abbreviations))
+            block_cache.put(key, html)
+        if html.strip():
+            parts.append(html)
+    _warm.set()
+    return '\n'.join(parts).strip()
+
+
+def render_full(text):
+    """Рендеринг без разбиения на блоки (для сравнения и бенчмарка)"""
+    return _convert(text, fresh=bool(LOOSE_ABBREVIATION_RE.search(text))).strip()
+
+
+def cache_stats():
+    """Размер и попадания кэшей блоков и подсветки кода этого процесса"""
+    return {
+        'blocks': {'size': len(block_cache.data), 'hits': block_cache.hits, 'misses': block_cache.misses},
+        'code': {'size': len(code_cache.data), 'hits': code_cache.hits, 'misses': code_cache.misses},
+    }
+
+
+def warm_up():
+    """Загрузить markdown, расширения и лексеры Pygments заранее"""
+    render_markdown(WARM_UP_SAMPLE)
+
+
+def is_warm():
+    return _warm.is_set()
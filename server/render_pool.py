@@ -0,0 +1,341 @@
+"""
+Пул процессов для рендеринга Markdown
+
+Рендеринг выполняется в отдельных процессах: он не держит GIL потоков,
+обрабатывающих запросы, и пакет заметок рендерится на всех ядрах.
+
+Ограничения каждого задания:
+- время: если процесс не ответил за timeout секунд, он убивается и
+  заменяется новым, а заданию возвращается ошибка 'timeout';
+- память: адресное пространство процесса ограничено RLIMIT_AS (где есть
+  модуль resource); при MemoryError процесс тоже заменяется.
+
+Один процесс выполняет одно задание за раз, поэтому медленная заметка
+занимает только свой процесс. Пакет занимает не больше workers - 1
+процессов одновременно - остальным запросам всегда остается процесс.
+
+Кэши блоков и подсветки кода (render.py) у каждого процесса свои. Процесс
+прикладывает их статистику к каждому ответу; status() суммирует ее по живым
+процессам, а попадания и промахи замененных процессов копятся отдельно.
+
+Пока пул не запущен (тесты, create_app без фоновых служб), рендеринг
+выполняется в потоке запроса.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import render
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = max(1, min(os.cpu_count() or 1, 8))
+DEFAULT_TIMEOUT = 5.0                      # секунд на одно задание
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024   # байт адресного пространства процесса
+DEFAULT_QUEUE_TIMEOUT = 2.0                # секунд ожидания свободного процесса
+STARTUP_TIMEOUT = 30.0
+RESTART_DELAY = 1.0
+
+
+class RenderError(Exception):
+    """Заметку не удалось отрендерить: timeout, memory, failed или busy"""
+    def __init__(self, reason):
+        super().__init__(f"Rendering failed: {reason}")
+        self.reason = reason
+
+
+def _limit_memory(limit):
+    if resource is None or not limit:
+        return
+    try:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, OSError) as e:
+        logger.warning("Не удалось ограничить память процесса рендеринга: %s", e)
+
+
+def _send(conn, status, value):
+    conn.send((status, value, render.cache_stats()))
+
+
+def _worker_main(conn, memory_limit):
+    """Цикл процесса рендеринга: текст -> ('ok', html, кэши) или ('error', причина, кэши)"""
+    # Ctrl+C в терминале обрабатывает сервер, он и завершит процессы
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limit_memory(memory_limit)
+    render.warm_up()
+    _send(conn, 'ready', None)
+    while True:
+        text = None
+        try:
+            text = conn.recv()
+            _send(conn, 'ok', render.render_markdown(text))
+        except (EOFError, OSError):
+            return
+        except MemoryError:
+            # После нехватки памяти состояние процесса ненадежно - его заменят
+            text = None
+            _send(conn, 'error', 'memory')
+            return
+        except Exception:
+            logger.exception("Ошибка рендеринга")
+            _send(conn, 'error', 'failed')
+
+
+class _Worker:
+    """Процесс рендеринга и его конец канала"""
+    def __init__(self, context, memory_limit):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, memory_limit),
+            name='render-worker', daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.caches = None
+
+    def recv(self):
+        """(статус, значение) ответа; статистика кэшей запоминается"""
+        status, value, self.caches = self.conn.recv()
+        return status, value
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class RenderPool:
+    """Пул процессов рендеринга с ограничением времени и памяти заданий"""
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 memory_limit=DEFAULT_MEMORY_LIMIT, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.queue_timeout = queue_timeout
+        # spawn, а не fork: сервер многопоточный, а дочерний процесс после
+        # fork наследует захваченные другими потоками блокировки
+        self.context = multiprocessing.get_context('spawn')
+        self.idle = queue.Queue()
+        self.executor = None
+        self.all_workers = set()
+        self.lock = threading.Lock()
+        self.warm = threading.Event()
+        self.stopped = False
+        self.stats = {
+            'jobs': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'memory_errors': 0,
+            'busy': 0,
+            'restarts': 0,
+            'max_job_ms': 0.0,
+        }
+        # Попадания и промахи кэшей замененных процессов
+        self.retired_caches = {name: {'hits': 0, 'misses': 0} for name in ('blocks', 'code')}
+
+    @property
+    def started(self):
+        return self.executor is not None
+
+    def start(self):
+        """Запустить процессы; они прогреваются в фоне"""
+        if self.started or not self.workers:
+            return
+        # Потоков столько же, сколько процессов: свободный процесс есть у каждого
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+        for _ in range(self.workers):
+            self._spawn()
+
+    def stop(self):
+        self.stopped = True
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            workers = list(self.all_workers)
+            self.all_workers.clear()
+        for worker in workers:
+            worker.kill()
+
+    def is_warm(self):
+        return self.warm.is_set() if self.started else render.is_warm()
+
+    # --- Процессы ---
+
+    def _spawn(self):
+        """Запустить процесс и отдать его в работу после прогрева (в фоне)"""
+        threading.Thread(target=self._start_worker, name='render-spawn', daemon=True).start()
+
+    def _start_worker(self):
+        while not self.stopped:
+            try:
+                worker = _Worker(self.context, self.memory_limit)
+            except OSError as e:
+                logger.error("Не удалось запустить процесс рендеринга: %s", e)
+                time.sleep(RESTART_DELAY)
+                continue
+            with self.lock:
+                self.all_workers.add(worker)
+            try:
+                if worker.conn.poll(STARTUP_TIMEOUT) and worker.recv()[0] == 'ready':
+                    self.idle.put(worker)
+                    self.warm.set()
+                    return
+            except (EOFError, OSError):
+                pass
+            logger.error("Процесс рендеринга не запустился, повтор через %s с", RESTART_DELAY)
+            self._discard(worker)
+            time.sleep(RESTART_DELAY)
+
+    def _discard(self, worker):
+        with self.lock:
+            if worker in self.all_workers and worker.caches:
+                for name, totals in self.retired_caches.items():
+                    totals['hits'] += worker.caches[name]['hits']
+                    totals['misses'] += worker.caches[name]['misses']
+            self.all_workers.discard(worker)
+        worker.kill()
+
+    def _count(self, name):
+        # Счетчики меняют потоки executor одновременно
+        with self.lock:
+            self.stats[name] += 1
+
+    def _replace(self, worker):
+        self._discard(worker)
+        self._count('restarts')
+        if not self.stopped:
+            self._spawn()
+
+    @staticmethod
+    def _last_words(worker):
+        """Причина из последнего сообщения завершившегося процесса"""
+        try:
+            if worker.conn.poll(0.1):
+                status, value = worker.recv()
+                if status == 'error':
+                    return value
+        except (EOFError, OSError):
+            pass
+        return 'failed'
+
+    # --- Задания ---
+
+    def _run(self, text):
+        """Выполнить задание в свободном процессе (в потоке executor)"""
+        worker = self.idle.get()
+        started = time.perf_counter()
+        try:
+            worker.conn.send(text)
+            if not worker.conn.poll(self.timeout):
+                self._count('timeouts')
+                self._replace(worker)
+                raise RenderError('timeout')
+            status, value = worker.recv()
+        except (EOFError, OSError):
+            # Процесс завершился: успел сообщить о нехватке памяти или упал
+            reason = self._last_words(worker)
+            self._count('memory_errors' if reason == 'memory' else 'failed')
+            self._replace(worker)
+            raise RenderError(reason)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.stats['jobs'] += 1
+                self.stats['max_job_ms'] = max(self.stats['max_job_ms'], round(elapsed, 2))
+
+        if status == 'ok':
+            self.idle.put(worker)
+            return value
+        if value == 'memory':
+            self._count('memory_errors')
+            self._replace(worker)
+        else:
+            self._count('failed')
+            self.idle.put(worker)
+        raise RenderError(value)
+
+    def render(self, text):
+        """HTML заметки; RenderError, если рендеринг не удался"""
+        if not self.started:
+            return render.render_markdown(text)
+        future = self.executor.submit(self._run, text)
+        try:
+            return future.result(timeout=self.queue_timeout + self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count('busy')
+            raise RenderError('busy')
+
+    def render_many(self, texts):
+        """Отрендерить тексты параллельно; список HTML или RenderError по порядку"""
+        if not self.started:
+            return [render.render_markdown(text) for text in texts]
+        results = [None] * len(texts)
+        window = max(1, self.workers - 1)
+        deadline = (time.monotonic() + self.queue_timeout
+                    + self.timeout * -(-len(texts) // window))
+        pending = {}
+        position = 0
+        while position < len(texts) or pending:
+            # Не больше window заданий пакета в очереди одновременно
+            while position < len(texts) and len(pending) < window:
+                pending[self.executor.submit(self._run, texts[position])] = position
+                position += 1
+            done, _ = wait(pending, timeout=max(0, deadline - time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    results[i] = future.result()
+                except RenderError as e:
+                    results[i] = e
+        # Не успевшие к сроку задания
+        for future in pending:
+            future.cancel()
+        for i, result in enumerate(results):
+            if result is None:
+                self._count('busy')
+                results[i] = RenderError('busy')
+        return results
+
+    def cache_stats(self):
+        """Кэши рендеринга, суммированные по процессам (или кэши этого процесса)"""
+        if not self.started:
+            return render.cache_stats()
+        with self.lock:
+            reports = [worker.caches for worker in self.all_workers if worker.caches]
+            totals = {name: {'size': 0, **counters}
+                      for name, counters in self.retired_caches.items()}
+        for report in reports:
+            for name, total in totals.items():
+                for field in total:
+                    total[field] += report[name][field]
+        return totals
+
+    def status(self):
+        with self.lock:
+            stats = dict(self.stats)
+        return {
+            'workers': self.workers if self.started else 0,
+            'idle': self.idle.qsize(),
+            'timeout': self.timeout,
+            'memory_limit': self.memory_limit,
+            **stats,
+            'caches': self.cache_stats(),
+        }
@@ -0,0 +1,393 @@
+"""
+Репликация заметок на узлы только для чтения
+
+Основной сервер (NOTES_ROLE=primary) ведет журнал изменений change_log:
+триггеры на REPLICATED_TABLES записывают образ каждой измененной строки
+(как journal.py) с возрастающим номером seq и временем записи. Журнал
+только дополняется; записи старше срока хранения удаляются.
+
+Реплика (NOTES_ROLE=replica) - тот же сервер со своей базой:
+1. при первом запуске загружает копию базы основного сервера
+   (GET /api/replication/snapshot, номер последнего изменения копии - в
+   заголовке X-Replication-Seq);
+2. запрашивает изменения после примененного номера
+   (GET /api/replication/changes?after=N&wait=...): основной сервер
+   держит запрос до wait секунд, пока изменений нет;
+3. применяет каждую порцию в одной транзакции вместе с номером в
+   replication_state, поэтому после перезапуска продолжает с него же.
+Если нужных записей в журнале уже нет (410), копия загружается заново.
+
+Чтение своих записей: основной сервер возвращает номер последнего
+изменения в заголовке X-Replication-Seq ответа на изменяющий запрос;
+запрос к реплике с min_seq=<номер> ждет, пока реплика его применит.
+
+В режиме базы в памяти с журналом (journal.py) change_log не
+журналируется: при восстановлении изменения применяются в том же
+порядке, и триггеры выдают им те же номера.
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import journal
+
+logger = logging.getLogger(__name__)
+
+LOG_TABLE = 'change_log'
+STATE_TABLE = 'replication_state'
+TRIGGER_PREFIX = 'replicate'
+# tag_counts не реплицируется: на реплике ее поддерживают триггеры note_tags
+REPLICATED_TABLES = ('notes', 'note_tags', 'note_bodies', 'note_tombstones', 'note_revisions')
+SEQ_HEADER = 'X-Replication-Seq'
+
+MAX_CHANGES = 1000      # изменений в одном ответе
+MAX_WAIT = 30.0         # предел ожидания новых изменений основным сервером, с
+POLL_WAIT = 10.0        # сколько реплика просит ждать изменений, с
+READ_WAIT = 2.0         # сколько запрос с min_seq ждет реплику, с
+RETRY_DELAYS = (0.5, 1, 2, 5, 10)  # паузы после ошибок связи с основным сервером
+PRUNE_INTERVAL = 60.0   # секунд между очистками журнала
+
+
+class ChangeLogGap(Exception):
+    """Запрошенных изменений в журнале нет: реплике нужна новая копия"""
+
+
+def install(conn):
+    """Таблица журнала репликации и триггеры по текущей схеме таблиц"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {LOG_TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row TEXT NOT NULL,
+            ts REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_change_log_ts ON {LOG_TABLE} (ts)')
+    journal.create_triggers(conn, LOG_TABLE, REPLICATED_TABLES, TRIGGER_PREFIX)
+    conn.commit()
+
+
+def uninstall(conn):
+    """Удалить триггеры и журнал репликации (сервер не основной)"""
+    journal.drop_triggers(conn, REPLICATED_TABLES, TRIGGER_PREFIX)
+    conn.execute(f'DROP TABLE IF EXISTS {LOG_TABLE}')
+    conn.commit()
+
+
+def _create_state(conn):
+    """Номер последнего примененного изменения реплики (одна строка)"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL,
+            primary_url TEXT NOT NULL
+        )
+    ''')
+
+
+class ChangeLog:
+    """Журнал изменений основного сервера: выдача изменений и копии базы"""
+    role = 'primary'
+
+    def __init__(self, connect, retention=24 * 3600.0):
+        self.connect = connect
+        self.retention = retention
+        self.conn = None
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()
+        self.generation = 0  # число изменяющих запросов: будит ожидающих
+        self.stop_event = threading.Event()
+        self.stats = {
+            'requests': 0,
+            'changes_sent': 0,
+            'snapshots': 0,
+            'gaps': 0,
+            'pruned': 0,
+        }
+
+    def open(self):
+        conn = self.connect()
+        try:
+            install(conn)
+        finally:
+            conn.close()
+        self.conn = self.connect(check_same_thread=False)
+
+    def current_seq(self):
+        """Номер последнего изменения"""
+        with self.lock:
+            return journal.last_seq(self.conn, LOG_TABLE)
+
+    def after_write(self):
+        """Вызывается после изменяющего запроса: будит ожидающие реплики"""
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+        return self.current_seq()
+
+    def _bounds(self, conn):
+        last = journal.last_seq(conn, LOG_TABLE)
+        oldest = conn.execute(f'SELECT MIN(seq) FROM {LOG_TABLE}').fetchall()[0][0]
+        return last, oldest if oldest is not None else last + 1
+
+    def changes(self, after, limit=MAX_CHANGES, wait=0.0):
+        """Изменения с номером больше after; без них ждать до wait секунд
+
+        limit приводится к 1..MAX_CHANGES, wait - к 0..MAX_WAIT (nan - 0):
+        отрицательный LIMIT в SQLite снимает ограничение.
+        """
+        limit = max(1, min(limit, MAX_CHANGES))
+        wait = max(0.0, min(wait, MAX_WAIT)) if math.isfinite(wait) else 0.0
+        deadline = time.monotonic() + wait
+        conn = self.connect()
+        try:
+            while True:
+                generation = self.generation
+                last, oldest = self._bounds(conn)
+                # Записи удалены или реплика скопирована с другой базы
+                if after < oldest - 1 or after > last:
+                    self.stats['gaps'] += 1
+                    raise ChangeLogGap(f"Changes after {after} are not available "
+                                       f"(log holds {oldest}..{last})")
+                remaining = deadline - time.monotonic()
+                if last > after or remaining <= 0:
+                    break
+                with self.changed:
+                    self.changed.wait_for(lambda: self.generation != generation, remaining)
+            rows = conn.execute(
+                f'SELECT seq, tbl, op, row, ts FROM {LOG_TABLE} WHERE seq > ? ORDER BY seq LIMIT ?',
+                (after, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        self.stats['requests'] += 1
+        self.stats['changes_sent'] += len(rows)
+        return {
+            'changes': [{'seq': seq, 'tbl': table, 'op': op, 'row': json.loads(row), 'ts': ts}
+                        for seq, table, op, row, ts in rows],
+            'last_seq': last,
+        }
+
+    def snapshot(self, path):
+        """Копия базы в файл path; вернуть номер последнего изменения в ней"""
+        source = self.connect()
+        target = sqlite3.connect(path)
+        try:
+            # За один шаг: копия согласована с номером в ней
+            source.backup(target)
+            seq = journal.last_seq(target, LOG_TABLE)
+        finally:
+            target.close()
+            source.close()
+        self.stats['snapshots'] += 1
+        return seq
+
+    def prune(self):
+        """Удалить записи старше срока хранения; вернуть их число"""
+        with self.lock:
+            with self.conn:
+                deleted = self.conn.execute(
+                    f"DELETE FROM {LOG_TABLE} WHERE ts < (julianday('now') - 2440587.5) * 86400.0 - ?",
+                    (self.retention,)
+                ).rowcount
+        self.stats['pruned'] += deleted
+        return deleted
+
+    def start(self):
+        """Очистка журнала в фоновом потоке"""
+        def loop():
+            while not self.stop_event.wait(PRUNE_INTERVAL):
+                try:
+                    self.prune()
+                except sqlite3.Error as e:
+                    logger.warning("Ошибка очистки журнала репликации: %s", e)
+
+        thread = threading.Thread(target=loop, name='change-log-prune', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def status(self):
+        with self.lock:
+            last, oldest = self._bounds(self.conn)
+            entries = self.conn.execute(f'SELECT COUNT(*) FROM {LOG_TABLE}').fetchall()[0][0]
+        return {
+            'role': self.role,
+            'last_seq': last,
+            'oldest_seq': oldest,
+            'entries': entries,
+            'retention': self.retention,
+            **self.stats,
+        }
+
+
+class Replica:
+    """Применение изменений основного сервера к базе реплики"""
+    role = 'replica'
+
+    def __init__(self, connect, primary_url, poll_wait=POLL_WAIT):
+        self.connect = connect
+        self.primary_url = primary_url
+        self.poll_wait = poll_wait
+        self.conn = None
+        self.applied = threading.Condition()
+        self.applied_seq = None
+        self.stop_event = threading.Event()
+        self.state = 'starting'
+        self.primary_seq = None
+        self.last_applied_ts = None
+        self.last_contact_at = None
+        self.stats = {
+            'bootstraps': 0,
+            'batches': 0,
+            'changes_applied': 0,
+            'errors': 0,
+            'last_error': None,
+        }
+
+    def open(self):
+        """Номер, с которого продолжать (None - нужна копия базы)"""
+        self.conn = self.connect(check_same_thread=False)
+        with self.conn:
+            _create_state(self.conn)
+        rows = self.conn.execute(f'SELECT seq, primary_url FROM {STATE_TABLE}').fetchall()
+        # Копия другого основного сервера не продолжается
+        if rows and rows[0][1] == self.primary_url:
+            self.applied_seq = rows[0][0]
+            self.state = 'streaming'
+
+    def _get(self, path, timeout):
+        return urllib.request.urlopen(self.primary_url + path, timeout=timeout)
+
+    def bootstrap(self):
+        """Загрузить копию базы основного сервера и заменить ею свою"""
+        self.state = 'bootstrapping'
+        fd, path = tempfile.mkstemp(prefix='notes-replica-', suffix='.db')
+        try:
+            with os.fdopen(fd, 'wb') as f, self._get('/api/replication/snapshot', 60) as response:
+                seq = int(response.headers[SEQ_HEADER])
+                shutil.copyfileobj(response, f)
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self.conn)
+            finally:
+                source.close()
+        finally:
+            os.remove(path)
+        # Журналы основного сервера реплике не нужны
+        uninstall(self.conn)
+        journal.uninstall(self.conn)
+        with self.conn:
+            _create_state(self.conn)
+            self.conn.execute(f'INSERT OR REPLACE INTO {STATE_TABLE} (id, seq, primary_url) VALUES (1, ?, ?)',
+                              (seq, self.primary_url))
+        self.stats['bootstraps'] += 1
+        self.primary_seq = seq
+        self.last_contact_at = time.time()
+        self._set_applied(seq)
+        self.state = 'streaming'
+        logger.info("Реплика загрузила копию базы, изменение %s", seq)
+
+    def _set_applied(self, seq):
+        with self.applied:
+            self.applied_seq = seq
+            self.applied.notify_all()
+
+    def poll(self):
+        """Запросить и применить одну порцию изменений; вернуть их число"""
+        query = urllib.parse.urlencode({'after': self.applied_seq, 'wait': self.poll_wait})
+        with self._get(f'/api/replication/changes?{query}', self.poll_wait + 10) as response:
+            data = json.loads(response.read())
+        self.last_contact_at = time.time()
+        self.primary_seq = data['last_seq']
+        changes = data['changes']
+        if not changes:
+            return 0
+        schemas = {}
+        with self.conn:
+            for entry in changes:
+                journal.apply_entry(self.conn, entry, schemas)
+            self.conn.execute(f'UPDATE {STATE_TABLE} SET seq = ? WHERE id = 1', (changes[-1]['seq'],))
+        self.stats['batches'] += 1
+        self.stats['changes_applied'] += len(changes)
+        self.last_applied_ts = changes[-1]['ts']
+        self._set_applied(changes[-1]['seq'])
+        return len(changes)
+
+    def run(self):
+        failures = 0
+        while not self.stop_event.is_set():
+            try:
+                if self.applied_seq is None:
+                    self.bootstrap()
+                self.poll()
+                failures = 0
+                continue
+            except urllib.error.HTTPError as e:
+                if e.code == 410:
+                    logger.warning("Изменений после %s на основном сервере нет, копия загружается заново",
+                                   self.applied_seq)
+                    self.applied_seq = None
+                    continue
+                error = f'HTTP {e.code}'
+            except (urllib.error.URLError, OSError, ValueError, KeyError, sqlite3.Error) as e:
+                error = str(e)
+            self.state = 'error'
+            self.stats['errors'] += 1
+            self.stats['last_error'] = error
+            delay = RETRY_DELAYS[min(failures, len(RETRY_DELAYS) - 1)]
+            failures += 1
+            logger.warning("Ошибка репликации: %s; повтор через %s с", error, delay)
+            self.stop_event.wait(delay)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='replica', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def current_seq(self):
+        return self.applied_seq
+
+    def wait_for(self, seq, timeout=READ_WAIT):
+        """Дождаться применения изменения seq; False - не дождались"""
+        with self.applied:
+            return self.applied.wait_for(
+                lambda: self.applied_seq is not None and self.applied_seq >= seq, timeout
+            )
+
+    def status(self):
+        behind = (self.primary_seq is not None and self.applied_seq is not None
+                  and self.primary_seq > self.applied_seq)
+        if not behind:
+            lag_seconds = 0.0 if self.applied_seq is not None else None
+        elif self.last_applied_ts is not None:
+            # Верхняя оценка: неприменные изменения записаны не раньше последнего примененного
+            lag_seconds = round(max(0.0, time.time() - self.last_applied_ts), 3)
+        else:
+            lag_seconds = None
+        return {
+            'role': self.role,
+            'state': self.state,
+            'primary': self.primary_url,
+            'applied_seq': self.applied_seq,
+            'primary_seq': self.primary_seq,
+            'lag_seq': self.primary_seq - self.applied_seq if behind else 0,
+            'lag_seconds': lag_seconds,
+            'last_contact_at': self.last_contact_at,
+            **self.stats,
+        }
@@ -0,0 +1,160 @@
+"""
+История изменений заметок (таблица note_revisions)
+
+Каждое изменение заголовка или содержимого заметки записывается ревизией
+с номером по порядку. Храним не копии текста, а:
+- снимок - полный текст, сжатый zlib;
+- дельту - патч common/textdiff.py от предыдущей ревизии (JSON, zlib).
+
+Снимок записывается не реже чем через SNAPSHOT_EVERY дельт, а также когда
+патч не меньше половины текста. Ревизия восстанавливается от ближайшего
+снимка не дальше SNAPSHOT_EVERY патчами.
+
+Ревизии создаются при правках: первая правка заметки записывает и исходную
+версию, поэтому последняя ревизия всегда совпадает с заметкой. Каждые
+THIN_EVERY ревизий история заметки прореживается (THINNING): чем старше
+ревизии, тем реже они сохраняются; старше MAX_AGE и сверх MAX_REVISIONS
+удаляются. Оставшиеся ревизии перекодируются заново - цепочки дельт не
+рвутся.
+"""
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from common.textdiff import apply_patch, make_patch, patch_size
+
+SNAPSHOT_EVERY = 16
+MAX_REVISIONS = 100
+MAX_AGE = timedelta(days=90)
+THIN_EVERY = 20
+# (возраст до, не чаще одной ревизии в): последний час - все правки,
+# сутки - раз в 10 минут, неделя - раз в час, дальше - раз в сутки
+THINNING = (
+    (timedelta(hours=1), timedelta(0)),
+    (timedelta(days=1), timedelta(minutes=10)),
+    (timedelta(days=7), timedelta(hours=1)),
+    (MAX_AGE, timedelta(days=1)),
+)
+COMPRESS_LEVEL = 6
+
+
+def _encode(previous, content, since_snapshot):
+    """(это снимок, данные) ревизии с текстом content после previous"""
+    if previous is not None and since_snapshot < SNAPSHOT_EVERY:
+        patch = make_patch(previous, content)
+        if patch_size(patch) * 2 < len(content):
+            data = json.dumps(patch, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            return False, zlib.compress(data, COMPRESS_LEVEL)
+    return True, zlib.compress(content.encode('utf-8'), COMPRESS_LEVEL)
+
+
+def _decode(previous, snapshot, data):
+    data = zlib.decompress(data).decode('utf-8')
+    if snapshot:
+        return data
+    return apply_patch(previous, json.loads(data))
+
+
+def _insert(conn, note_key, revision, title, content, previous, since_snapshot, created_at=None):
+    """Записать ревизию; вернуть число дельт после последнего снимка"""
+    snapshot, data = _encode(previous, content, since_snapshot)
+    conn.execute(
+        'INSERT INTO note_revisions (note_id, revision, snapshot, title, size, data, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+        (note_key, revision, int(snapshot), title, len(content), data, created_at)
+    )
+    return 0 if snapshot else since_snapshot + 1
+
+
+def record(conn, note_key, previous, title, content):
+    """Записать ревизию после изменения заметки
+
+    previous - строка заметки до изменения (title, content, updated_at).
+    Вызывается в транзакции изменения.
+    """
+    if title == previous['title'] and content == previous['content']:
+        return None
+    last = conn.execute('''
+        SELECT revision,
+               revision - (SELECT MAX(revision) FROM note_revisions s
+                           WHERE s.note_id = r.note_id AND s.snapshot = 1)
+        FROM note_revisions r WHERE note_id = ? ORDER BY revision DESC LIMIT 1
+    ''', (note_key,)).fetchone()
+    if last is None:
+        # Первая правка: исходная версия заметки - первая ревизия
+        since_snapshot = _insert(conn, note_key, 1, previous['title'], previous['content'],
+                                 None, 0, previous['updated_at'])
+        revision = 2
+    else:
+        revision, since_snapshot = last[0] + 1, last[1]
+    _insert(conn, note_key, revision, title, content, previous['content'], since_snapshot)
+    if revision % THIN_EVERY == 0:
+        thin(conn, note_key)
+    return revision
+
+
+def _keep(times, now):
+    """Индексы ревизий (по возрастанию времени), которые оставляет прореживание"""
+    kept = [len(times) - 1]
+    for index in range(len(times) - 2, -1, -1):
+        age = now - times[index]
+        if age > MAX_AGE or len(kept) >= MAX_REVISIONS:
+            break
+        spacing = next(spacing for limit, spacing in THINNING if age <= limit)
+        if times[kept[-1]] - times[index] >= spacing:
+            kept.append(index)
+    return kept[::-1]
+
+
+def thin(conn, note_key, now=None):
+    """Проредить историю заметки; вернуть число удаленных ревизий"""
+    rows = conn.execute(
+        'SELECT revision, snapshot, title, data, created_at FROM note_revisions '
+        'WHERE note_id = ? ORDER BY revision', (note_key,)
+    ).fetchall()
+    if not rows:
+        return 0
+    kept = _keep([datetime.fromisoformat(row[4]) for row in rows], now or datetime.utcnow())
+    if len(kept) == len(rows):
+        return 0
+
+    contents = []
+    content = None
+    for row in rows:
+        content = _decode(content, row[1], row[3])
+        contents.append(content)
+    conn.execute('DELETE FROM note_revisions WHERE note_id = ?', (note_key,))
+    previous, since_snapshot = None, 0
+    for index in kept:
+        revision, _, title, _, created_at = rows[index]
+        since_snapshot = _insert(conn, note_key, revision, title, contents[index],
+                                 previous, since_snapshot, created_at)
+        previous = contents[index]
+    return len(rows) - len(kept)
+
+
+def list_revisions(conn, note_key):
+    """Ревизии заметки, новые первыми"""
+    return conn.execute(
+        'SELECT revision, title, size, created_at FROM note_revisions '
+        'WHERE note_id = ? ORDER BY revision DESC', (note_key,)
+    ).fetchall()
+
+
+def reconstruct(conn, note_key, revision):
+    """Заголовок и текст ревизии: от ближайшего снимка по дельтам; None, если ее нет"""
+    rows = conn.execute('''
+        SELECT revision, snapshot, title, data, created_at FROM note_revisions
+        WHERE note_id = ? AND revision <= ? AND revision >= (
+            SELECT MAX(revision) FROM note_revisions
+            WHERE note_id = ? AND revision <= ? AND snapshot = 1
+        )
+        ORDER BY revision
+    ''', (note_key, revision, note_key, revision)).fetchall()
+    if not rows or rows[-1][0] != revision:
+        return None
+    content = None
+    for row in rows:
+        content = _decode(content, row[1], row[3])
+    return {'revision': revision, 'title': rows[-1][2], 'content': content,
+            'created_at': rows[-1][4]}
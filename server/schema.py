@@ -0,0 +1,223 @@
+"""
+Схема базы данных
+
+Таблицы, ключом которых служит заметка, описаны шаблонами с именем
+таблицы: migrate_ids.py создает их копии под временными именами и
+переименовывает после переноса данных. Имена индексов от имени таблицы
+не зависят - при переименовании индексы переходят вместе с таблицей.
+"""
+
+# Таблицы с ключом-заметкой: имя -> CREATE TABLE с {table}
+NOTE_TABLES = {
+    # id - внутренний ключ (rowid), uid - публичный id, 16 байт (см. ids.py)
+    'notes': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid BLOB NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            body_size INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    # Теги заметок
+    'note_tags': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            note_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (note_id, tag),
+            FOREIGN KEY (note_id) REFERENCES notes (id)
+        ) WITHOUT ROWID
+    ''',
+    # Надгробия удаленных заметок: по ним клиенты узнают об удалении при синхронизации
+    'note_tombstones': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            uid BLOB PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''',
+    # Содержимое больших заметок вне строк notes (см. bodies.py); rowid
+    # совпадает с notes.id - по нему тело открывает blobopen
+    'note_bodies': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            note_id INTEGER PRIMARY KEY,
+            body BLOB NOT NULL
+        )
+    ''',
+}
+
+# Индексы таблиц NOTE_TABLES: имя -> (таблица, столбцы). Индексы notes для
+# фильтров и сортировки списка заметок (см. query.py); rowid (notes.id)
+# неявно замыкает каждый индекс, поэтому порядок (столбец, id) обслуживается
+# без явного id. Индекс (user_id, tag, note_id) отвечает на фильтры по тегам.
+NOTE_INDEXES = {
+    'idx_notes_updated': ('notes', ('user_id', 'updated_at')),
+    'idx_notes_created': ('notes', ('user_id', 'created_at')),
+    'idx_notes_title': ('notes', ('user_id', 'title')),
+    'idx_tags_user_tag': ('note_tags', ('user_id', 'tag', 'note_id')),
+    'idx_tombstones_user_deleted': ('note_tombstones', ('user_id', 'deleted_at')),
+}
+
+TRIGGERS = [
+    # Число заметок с каждым тегом
+    '''
+    CREATE TRIGGER IF NOT EXISTS note_tags_count_insert AFTER INSERT ON note_tags
+    BEGIN
+        INSERT INTO tag_counts (user_id, tag, count) VALUES (NEW.user_id, NEW.tag, 1)
+        ON CONFLICT (user_id, tag) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS note_tags_count_delete AFTER DELETE ON note_tags
+    BEGIN
+        UPDATE tag_counts SET count = count - 1
+        WHERE user_id = OLD.user_id AND tag = OLD.tag;
+        DELETE FROM tag_counts
+        WHERE user_id = OLD.user_id AND tag = OLD.tag AND count <= 0;
+    END
+    ''',
+    # Удаление заметки: теги, тело вне строки, история, надгробие
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_delete_tags AFTER DELETE ON notes
+    BEGIN
+        DELETE FROM note_tags WHERE note_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_delete_body AFTER DELETE ON notes
+    WHEN OLD.body_size IS NOT NULL
+    BEGIN
+        DELETE FROM note_bodies WHERE note_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_delete_revisions AFTER DELETE ON notes
+    BEGIN
+        DELETE FROM note_revisions WHERE note_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_delete_tombstone AFTER DELETE ON notes
+    BEGIN
+        INSERT OR REPLACE INTO note_tombstones (uid, user_id) VALUES (OLD.uid, OLD.user_id);
+    END
+    ''',
+    # Отпечаток измененной заметки пересчитывается при следующей сверке (note_hashes.py)
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_hash_update AFTER UPDATE OF title, content, body_size ON notes
+    BEGIN
+        DELETE FROM note_hashes WHERE note_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_hash_delete AFTER DELETE ON notes
+    BEGIN
+        DELETE FROM note_hashes WHERE note_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS note_bodies_hash_insert AFTER INSERT ON note_bodies
+    BEGIN
+        DELETE FROM note_hashes WHERE note_id = NEW.note_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS note_bodies_hash_update AFTER UPDATE ON note_bodies
+    BEGIN
+        DELETE FROM note_hashes WHERE note_id = NEW.note_id;
+    END
+    ''',
+]
+
+
+def create_note_tables(cursor, suffix=''):
+    """Таблицы NOTE_TABLES (с суффиксом имени) и их индексы"""
+    for table, sql in NOTE_TABLES.items():
+        cursor.execute(sql.format(table=table + suffix))
+    for name, (table, columns) in NOTE_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table + suffix} ({", ".join(columns)})')
+
+
+def create_schema(cursor):
+    """Все таблицы, индексы и триггеры (существующие не меняются)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    create_note_tables(cursor)
+    # Число заметок с каждым тегом, поддерживается триггерами
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            user_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, tag)
+        ) WITHOUT ROWID
+    ''')
+    # Корзина и отпечаток заметки для сверки с клиентом (note_hashes.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS note_hashes (
+            note_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            digest INTEGER NOT NULL
+        )
+    ''')
+    # Покрывающий: узел дерева читается только из индекса
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_hashes_bucket ON note_hashes (user_id, bucket, digest)')
+    # История изменений заметок: снимки и дельты, сжатые zlib (revisions.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS note_revisions (
+            note_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            snapshot INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (note_id, revision)
+        )
+    ''')
+    # Очередь фоновых заданий и их результаты (jobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid BLOB NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, status)')
+    # rowid совпадает с jobs.id - результат отдается через blobopen
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            content_type TEXT NOT NULL,
+            filename TEXT NOT NULL
+        )
+    ''')
+    for sql in TRIGGERS:
+        cursor.execute(sql)
@@ -0,0 +1,198 @@
+"""
+Режимы хранения базы данных
+
+- file - база в файле (по умолчанию);
+- memory - база в памяти процесса, при остановке данные теряются
+  (тестовые стенды, бенчмарки);
+- memory-snapshot - база в памяти, которая загружается из файла при
+  запуске и периодически сохраняется в него через backup API.
+
+База в памяти открывается через VFS memdb (`file:/имя?vfs=memdb`): все
+соединения процесса видят одну базу, а блокировки работают как у файла -
+писатели ждут друг друга (busy timeout), а не получают SQLITE_LOCKED,
+как с общим кэшем `:memory:`. Одно соединение держится открытым все
+время работы: с последним соединением база в памяти исчезает.
+
+В режимах в памяти можно включить журнал изменений (journal.py): снимок
+плюс журнал восстанавливают базу после сбоя без потери подтвержденных
+записей.
+
+Все соединения открываются с uri=True: обычный путь к файлу при этом
+остается путем, а адрес memdb распознается.
+"""
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import journal
+from journal import MutationJournal
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PAGES = 1024      # страниц за шаг копирования снимка
+SNAPSHOT_MAX_RESTARTS = 3  # затем снимок копируется за один шаг
+
+_names = itertools.count()
+
+
+class _TooManyRestarts(Exception):
+    """Порционное копирование снимка слишком часто начинается заново"""
+
+
+class Storage:
+    """База данных сервера в выбранном режиме хранения"""
+    def __init__(self, mode='file', path=None, snapshot_interval=60.0, journal_path=None):
+        self.mode = mode
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        if mode == 'file':
+            self.database = path
+        else:
+            self.database = f'file:/notes-{os.getpid()}-{next(_names)}?vfs=memdb'
+        # Журнал имеет смысл только для базы в памяти
+        self.journal = MutationJournal(journal_path) if journal_path and mode != 'file' else None
+        if journal_path and mode == 'file':
+            logger.warning("Журнал изменений нужен только базе в памяти, NOTES_JOURNAL не используется")
+        self.keeper = None
+        self.snapshot_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stats = {
+            'snapshots': 0,
+            'snapshot_failures': 0,
+            'last_snapshot_at': None,
+            'last_snapshot_ms': None,
+            'last_snapshot_bytes': None,
+            'snapshot_restarts': 0,
+            'last_error': None,
+        }
+
+    @property
+    def in_memory(self):
+        return self.mode != 'file'
+
+    def connect(self, **kwargs):
+        return sqlite3.connect(self.database, uri=True, **kwargs)
+
+    def open(self, init_db):
+        """Подготовить базу: загрузить снимок, создать схему, применить журнал"""
+        if self.in_memory:
+            self.keeper = self.connect(check_same_thread=False)
+            if self.mode == 'memory-snapshot' and os.path.exists(self.path):
+                source = sqlite3.connect(self.path)
+                try:
+                    source.backup(self.keeper)
+                finally:
+                    source.close()
+                logger.info("База загружена из снимка %s", self.path)
+        init_db(self.database)
+        conn = self.connect()
+        try:
+            if self.journal:
+                self.journal.open(conn, self.connect)
+            else:
+                # Снимок мог быть снят с включенным журналом
+                journal.uninstall(conn)
+        finally:
+            conn.close()
+
+    def after_write(self):
+        """Вызывается после изменяющего запроса: записи журнала - на диск"""
+        if self.journal:
+            self.journal.flush()
+
+    # --- Снимки ---
+
+    def snapshot(self):
+        """Сохранить базу в памяти в файл (через временный файл); вернуть размер"""
+        if self.mode != 'memory-snapshot':
+            return None
+        with self.snapshot_lock:
+            started = time.perf_counter()
+            try:
+                size = self._snapshot()
+            except (sqlite3.Error, OSError) as e:
+                self.stats['snapshot_failures'] += 1
+                self.stats['last_error'] = str(e)
+                raise
+            self.stats['snapshots'] += 1
+            self.stats['last_snapshot_at'] = time.time()
+            self.stats['last_snapshot_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self.stats['last_snapshot_bytes'] = size
+            self.stats['last_error'] = None
+            return size
+
+    def _snapshot(self):
+        if self.journal:
+            self.journal.flush()
+        tmp_path = self.path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        state = {'remaining': None, 'restarts': 0, 'pages': SNAPSHOT_PAGES}
+
+        def progress(status, remaining, total):
+            if state['remaining'] is not None and remaining > state['remaining']:
+                # Базу изменили во время копирования: SQLite начал заново
+                state['restarts'] += 1
+                self.stats['snapshot_restarts'] += 1
+                if state['restarts'] >= SNAPSHOT_MAX_RESTARTS and state['pages'] != -1:
+                    raise _TooManyRestarts()
+            state['remaining'] = remaining
+
+        target = sqlite3.connect(tmp_path)
+        try:
+            # Порциями, чтобы не задерживать запись; при постоянной записи
+            # копия не сходится - тогда за один шаг
+            while True:
+                state['remaining'] = None
+                try:
+                    self.keeper.backup(target, pages=state['pages'], progress=progress)
+                    break
+                except _TooManyRestarts:
+                    state['pages'] = -1
+            snapshot_seq = journal.last_seq(target) if self.journal else None
+        finally:
+            target.close()
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self.journal:
+            # Записи до снимка в нем учтены
+            self.journal.compact(snapshot_seq)
+        return os.path.getsize(self.path)
+
+    def start(self):
+        """Периодические снимки в фоновом потоке"""
+        if self.mode != 'memory-snapshot' or not self.snapshot_interval:
+            return None
+
+        def loop():
+            while not self.stop_event.wait(self.snapshot_interval):
+                try:
+                    self.snapshot()
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning("Ошибка сохранения снимка: %s", e)
+
+        thread = threading.Thread(target=loop, name='db-snapshot', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Остановить снимки; база в памяти сохраняется последним снимком"""
+        self.stop_event.set()
+        if self.mode == 'memory-snapshot' and self.keeper is not None:
+            self.snapshot()
+        if self.journal:
+            self.journal.close()
+
+    def status(self):
+        report = {
+            'mode': self.mode,
+            'path': self.path,
+            'snapshot_interval': self.snapshot_interval if self.mode == 'memory-snapshot' else None,
+            **self.stats,
+            'journal': self.journal.status() if self.journal else None,
+        }
+        return report
@@ -2,10 +2,34 @@
 """
 Тестирование API сервиса синхронизированных заметок
 """
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
 import requests
 import json
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'client'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+import job_kinds
+import jobs
+import revisions
+import schema
+from common import cbor
+from common.api_client import ApiClient
+from common.textdiff import PatchError, apply_patch, content_hash, make_patch
+from bulk import DirectoryMirror
+from local_store import CONFLICT_SUFFIX, LocalStore
+from sync import SyncEngine
+
 BASE_URL = 'http://localhost:5000/api'
 
 def test_api():
@@ -84,6 +108,16 @@ def test_api():
         else:
             print(f"  ✗ Ошибка получения заметок: {response.json()}")
             return False
+        
+        # Постраничный краткий список
+        response = requests.get(f"{BASE_URL}/notes?user_id={user_id}&limit=1&fields=summary")
+        page = response.json()
+        if response.status_code == 200 and 'next_cursor' in page and \
+                all('content' not in note for note in page['notes']):
+            print(f"  ✓ Страница списка: {len(page['notes'])} заметок")
+        else:
+            print(f"  ✗ Ошибка постраничного списка: {page}")
+            return False
     except Exception as e:
         print(f"  ✗ Ошибка подключения: {e}")
         return False
@@ -139,8 +173,39 @@ def test_api():
         print(f"  ✗ Ошибка подключения: {e}")
         return False
     
+    # Теги заметки
+    print("\n8. Теги заметки...")
+    try:
+        response = requests.post(f"{BASE_URL}/notes/{note_id}/tags", json={
+            'user_id': user_id,
+            'tags': ['Тест', 'markdown']
+        })
+        if response.status_code != 200:
+            print(f"  ✗ Ошибка добавления тегов: {response.json()}")
+            return False
+        print(f"  ✓ Теги добавлены: {', '.join(response.json()['tags'])}")
+        
+        response = requests.get(f"{BASE_URL}/notes?user_id={user_id}&tag=тест&tag=markdown")
+        notes = response.json()['notes']
+        if response.status_code == 200 and [n['id'] for n in notes] == [note_id]:
+            print(f"  ✓ Фильтр по тегам вернул заметку")
+        else:
+            print(f"  ✗ Ошибка фильтра по тегам: {response.json()}")
+            return False
+        
+        response = requests.get(f"{BASE_URL}/tags?user_id={user_id}")
+        if response.status_code == 200:
+            counts = {t['tag']: t['count'] for t in response.json()['tags']}
+            print(f"  ✓ Облако тегов: {counts}")
+        else:
+            print(f"  ✗ Ошибка получения тегов: {response.json()}")
+            return False
+    except Exception as e:
+        print(f"  ✗ Ошибка подключения: {e}")
+        return False
+    
     # Удаление заметки
-    print("\n8. Удаление заметки...")
+    print("\n9. Удаление заметки...")
     try:
         response = requests.delete(f"{BASE_URL}/notes/{note_id}?user_id={user_id}")
         if response.status_code == 200:
@@ -153,7 +218,7 @@ def test_api():
         return False
     
     # Проверка, что заметка действительно удалена
-    print("\n9. Проверка удаления заметки...")
+    print("\n10. Проверка удаления заметки...")
     try:
         response = requests.get(f"{BASE_URL}/notes/{note_id}?user_id={user_id}")
         if response.status_code == 404:
@@ -165,8 +230,456 @@ def test_api():
         print(f"  ✗ Ошибка подключения: {e}")
         return False
     
+    # Пакет изменений офлайн-клиента и получение изменений
+    print("\n11. Пакетные изменения и синхронизация...")
+    try:
+        response = requests.post(f"{BASE_URL}/notes/batch", json={
+            'user_id': user_id,
+            'operations': [
+                {'op': 'create', 'id': 'local-1', 'title': 'Офлайн', 'content': 'Текст'},
+                {'op': 'update', 'id': 'local-1', 'content': 'Новый текст'}
+            ]
+        })
+        result = response.json()
+        if response.status_code != 200 or 'local-1' not in result['ids']:
+            print(f"  ✗ Ошибка пакетных изменений: {result}")
+            return False
+        batch_note_id = result['ids']['local-1']
+        print(f"  ✓ Пакет применен, временный id заменен: {batch_note_id}")
+        
+        response = requests.get(f"{BASE_URL}/sync?user_id={user_id}&since=2000-01-01")
+        changes = response.json()
+        synced = {note['id']: note for note in changes.get('notes', [])}
+        if response.status_code == 200 and note_id in changes['deleted'] and \
+                synced.get(batch_note_id, {}).get('content') == 'Новый текст':
+            print(f"  ✓ Изменения получены: {len(synced)} заметок, {len(changes['deleted'])} удалений")
+        else:
+            print(f"  ✗ Ошибка синхронизации: {changes}")
+            return False
+    except Exception as e:
+        print(f"  ✗ Ошибка подключения: {e}")
+        return False
+    
+    # Офлайн-клиенты: две локальные копии одного пользователя
+    if not test_offline_devices():
+        return False
+    
+    if not test_cbor(user_id):
+        return False
+    
+    if not test_reconcile():
+        return False
+    
+    if not test_textdiff():
+        return False
+    
+    if not test_revisions(user_id):
+        return False
+    
+    if not test_coalesced_after_write():
+        return False
+    
+    if not test_job_limits():
+        return False
+    
+    if not test_bulk_push():
+        return False
+    
     print("\n✓ Все тесты пройдены успешно!")
     return True
 
+def test_cbor(user_id):
+    print("\n14. Кодек CBOR...")
+    values = [
+        None, True, False, 0, 23, 24, 255, 65536, 2 ** 63, -1, -2 ** 63, 1.5, -0.0,
+        '', 'Заметка ✓', b'\x00\xff', [], [1, [2, [3]]], {},
+        {'id': 'x', 'tags': ['a', 'b'], 'nested': {'n': None}},
+    ]
+    broken = [v for v in values if cbor.loads(cbor.dumps(v)) != v]
+    # Неопределенная длина (строки кусками, массив, словарь) и теги
+    samples = {
+        b'\x7f\x62ab\x61c\xff': 'abc',
+        b'\x9f\x01\x02\xff': [1, 2],
+        b'\xbf\x61a\x01\xff': {'a': 1},
+        b'\xc1\x1a\x00\x01\x00\x00': 65536,
+        b'\xf9\x3c\x00': 1.0,
+    }
+    broken += [data for data, value in samples.items() if cbor.loads(data) != value]
+    if broken:
+        print(f"  ✗ Ошибка кодирования/декодирования: {broken}")
+        return False
+    print(f"  ✓ Значения совпадают после кодирования и декодирования ({len(values) + len(samples)})")
+    
+    malformed = {
+        'обрыв данных': b'\x62a',
+        'лишние данные': b'\x01\x02',
+        'неверный UTF-8': b'\x61\xff',
+        'массив как ключ': b'\xa1\x80\x01',
+        'словарь как ключ': b'\xbf\xa0\x01\xff',
+        'глубокая вложенность': b'\x81' * 100000,
+        'цепочка тегов': b'\xc0' * 100000,
+    }
+    for name, data in malformed.items():
+        try:
+            cbor.loads(data)
+        except cbor.CBORError:
+            pass
+        else:
+            print(f"  ✗ Нет ошибки декодирования: {name}")
+            return False
+        response = requests.post(f"{BASE_URL}/notes", data=data,
+                                 headers={'Content-Type': cbor.MIMETYPE})
+        if response.status_code != 400:
+            print(f"  ✗ Сервер ответил {response.status_code} на {name}")
+            return False
+    print(f"  ✓ Некорректные данные отклонены (CBORError, ответ 400): {len(malformed)}")
+    
+    response = requests.post(f"{BASE_URL}/notes", data=cbor.dumps({'user_id': user_id, 'title': 'CBOR'}),
+                             headers={'Content-Type': cbor.MIMETYPE, 'Accept': cbor.MIMETYPE})
+    if response.status_code == 201 and cbor.loads(response.content)['title'] == 'CBOR':
+        print(f"  ✓ Заметка создана запросом и ответом в CBOR")
+    else:
+        print(f"  ✗ Ошибка запроса в CBOR: {response.status_code}")
+        return False
+    return True
+
+def open_device(directory, name):
+    """Локальная копия заметок и движок синхронизации (без фонового потока)"""
+    api = ApiClient(BASE_URL)
+    api.login('test_user', 'test_password')
+    store = LocalStore(os.path.join(directory, f'{name}.db'))
+    return store, SyncEngine(store, api)
+
+def test_offline_devices():
+    print("\n12. Правка заметки, удаленной на другом устройстве...")
+    with tempfile.TemporaryDirectory() as directory:
+        store_a, sync_a = open_device(directory, 'a')
+        store_b, sync_b = open_device(directory, 'b')
+        note = store_a.create_note('Общая', 'Текст с первого устройства')
+        sync_a.sync_once()
+        sync_b.sync_once()
+        note_id = store_a.resolve(note['id'])
+        
+        # Устройство B правит заметку без сети, A тем временем ее удаляет
+        store_b.update_note(note_id, content='Офлайн-правка')
+        store_a.delete_note(note_id)
+        sync_a.sync_once()
+        if not sync_b.sync_once():
+            print(f"  ✗ Ошибка синхронизации: {sync_b.last_error}")
+            return False
+        restored = store_b.get_note(note_id)
+        server_copy = restored and sync_b.api.get_note(restored['id'])
+        if restored and restored['id'] != note_id and restored['content'] == 'Офлайн-правка' \
+                and server_copy['content'] == 'Офлайн-правка' and not store_b.pending_count():
+            print(f"  ✓ Правка сохранена, заметка создана заново: {restored['id']}")
+        else:
+            print(f"  ✗ Правка потеряна: {restored}")
+            return False
+        
+        print("\n13. Одновременная правка заметки на двух устройствах...")
+        note_id = restored['id']
+        sync_a.sync_once()
+        base = '\n'.join(f'Строка {i}' for i in range(40))
+        store_b.update_note(note_id, content=base)
+        sync_b.sync_once()
+        sync_a.sync_once()
+        # Обе правки сделаны от одной версии; A отправляет свою первой
+        store_a.update_note(note_id, content=base.replace('Строка 1\n', 'Строка 1 (A)\n'))
+        store_b.update_note(note_id, content=base.replace('Строка 30', 'Строка 30 (B)'))
+        sync_a.sync_once()
+        sync_b.sync_once()
+        server_note = sync_b.api.get_note(note_id)
+        copies = [n for n in store_b.list_notes() if n['title'].endswith(CONFLICT_SUFFIX)]
+        copy = copies and store_b.get_note(copies[0]['id'])
+        if server_note['content'] == store_a.get_note(note_id)['content'] \
+                and store_b.get_note(note_id)['content'] == server_note['content'] \
+                and copy and 'Строка 30 (B)' in copy['content'] and not copy['id'].startswith('local-'):
+            print(f"  ✓ Правка A сохранена на сервере, правка B - копией {copy['id']}")
+        else:
+            print(f"  ✗ Конфликт разрешен неверно: {server_note['content'][:40]!r}, копии: {copies}")
+            return False
+        store_a.close()
+        store_b.close()
+    return True
+
+def test_reconcile():
+    print("\n15. Сверка по дереву хешей...")
+    with tempfile.TemporaryDirectory() as directory:
+        store_a, sync_a = open_device(directory, 'a')
+        store_b, sync_b = open_device(directory, 'b')
+        for i in range(30):
+            store_a.create_note(f'Сверка {i}', f'Текст {i}')
+        sync_a.sync_once()
+        sync_b.sync_once()
+        
+        # Одна правка на сервере; B потерял курсор синхронизации
+        note_id = store_b.list_notes()[0]['id']
+        sync_a.api.update_note(note_id, content='Изменено на сервере')
+        store_b.set_meta('since', '')
+        stats = sync_b.reconcile()
+        if stats['fetched'] == 1 and stats['deleted'] == 0 \
+                and store_b.get_note(note_id)['content'] == 'Изменено на сервере':
+            print(f"  ✓ Загружена только измененная заметка (запросов: {stats['requests']})")
+        else:
+            print(f"  ✗ Ошибка сверки после правки: {stats}")
+            return False
+        
+        sync_a.api.delete_note(note_id)
+        stats = sync_b.reconcile()
+        if stats['fetched'] == 0 and stats['deleted'] == 1 and store_b.get_note(note_id) is None:
+            print(f"  ✓ Удаленная на сервере заметка удалена локально")
+        else:
+            print(f"  ✗ Ошибка сверки после удаления: {stats}")
+            return False
+        
+        stats = sync_b.reconcile()
+        if stats['fetched'] == 0 and stats['deleted'] == 0 and stats['requests'] == 1:
+            print(f"  ✓ Совпадающие копии сверены одним запросом")
+        else:
+            print(f"  ✗ Лишняя работа при совпадающих копиях: {stats}")
+            return False
+        store_a.close()
+        store_b.close()
+    return True
+
+def edited_versions(count, seed=1):
+    """Версии текста: каждая следующая - небольшая правка предыдущей"""
+    rng = random.Random(seed)
+    lines = [f'Строка {i}: исходный текст' for i in range(60)]
+    versions = ['\n'.join(lines)]
+    for n in range(1, count):
+        i = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.6:
+            lines[i] = f'Строка {i}: правка {n} ✓'
+        elif action < 0.8:
+            lines.insert(i, f'Вставка {n}')
+        else:
+            del lines[i]
+        versions.append('\n'.join(lines))
+    return versions
+
+def test_textdiff():
+    print("\n16. Патчи текста...")
+    pairs = [
+        ('', ''), ('', 'новый текст'), ('старый текст', ''), ('abc', 'abc'),
+        ('одна строка', 'одна строка!'), ('a\nb\nc\n', 'a\nb\nc'), ('a\r\nb', 'a\nb'),
+        ('x\n' * 50, 'y\n' * 50), ('😀 эмодзи\nи текст', 'текст\n😀 эмодзи'),
+    ]
+    versions = edited_versions(50)
+    pairs += list(zip(versions, versions[1:])) + [(versions[0], versions[-1]), (versions[-1], versions[0])]
+    broken = [(old, new) for old, new in pairs if apply_patch(old, make_patch(old, new)) != new]
+    if broken:
+        print(f"  ✗ Патч не воспроизводит текст: {broken[0]}")
+        return False
+    print(f"  ✓ Патч воспроизводит новый текст ({len(pairs)} пар)")
+    
+    # Патч от другого текста: замены вне текста или в неверном формате
+    for old, patch in [('abc', [[2, 10, 'x']]), ('abc', [[2, 3, 'x'], [1, 2, 'y']]),
+                       ('abc', [[0, 1]]), ('abc', {'0': 'x'})]:
+        try:
+            apply_patch(old, patch)
+        except PatchError:
+            pass
+        else:
+            print(f"  ✗ Нет ошибки для неподходящего патча: {patch}")
+            return False
+    print(f"  ✓ Неподходящий патч отклонен (PatchError)")
+    return True
+
+def limited(method, url, **kwargs):
+    """Запрос, повторенный после 429 через Retry-After (лимит частоты пользователя)"""
+    while True:
+        response = requests.request(method, url, **kwargs)
+        if response.status_code != 429:
+            return response
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+
+def test_revisions(user_id):
+    print("\n17. История изменений заметки...")
+    versions = edited_versions(10, seed=2)
+    response = limited('POST', f"{BASE_URL}/notes", json={
+        'user_id': user_id, 'title': 'История', 'content': versions[0]
+    })
+    note_id = response.json()['id']
+    for content in versions[1:-1]:
+        limited('PUT', f"{BASE_URL}/notes/{note_id}", json={'user_id': user_id, 'content': content})
+    
+    # Патч от устаревшей версии отклоняется с хешем текущего текста
+    patch = make_patch(versions[-3], versions[-1])
+    response = limited('PATCH', f"{BASE_URL}/notes/{note_id}", json={
+        'user_id': user_id, 'base_hash': content_hash(versions[-3]), 'patch': patch
+    })
+    if response.status_code != 409 or response.json().get('hash') != content_hash(versions[-2]):
+        print(f"  ✗ Патч от устаревшей версии: {response.status_code} {response.json()}")
+        return False
+    response = limited('PATCH', f"{BASE_URL}/notes/{note_id}", json={
+        'user_id': user_id, 'base_hash': content_hash(versions[-2]),
+        'patch': make_patch(versions[-2], versions[-1])
+    })
+    if response.status_code != 200 or response.json().get('hash') != content_hash(versions[-1]):
+        print(f"  ✗ Ошибка применения патча: {response.status_code} {response.json()}")
+        return False
+    print(f"  ✓ Патч от устаревшей версии отклонен (409), от текущей - применен")
+    
+    listed = limited('GET', f"{BASE_URL}/notes/{note_id}/revisions?user_id={user_id}").json()['revisions']
+    wrong = []
+    for n, content in enumerate(versions, 1):
+        revision = limited('GET', f"{BASE_URL}/notes/{note_id}/revisions/{n}?user_id={user_id}").json()
+        if revision.get('content') != content or revision.get('hash') != content_hash(content):
+            wrong.append(n)
+    if len(listed) != len(versions) or wrong:
+        print(f"  ✗ Ревизии не совпадают с версиями: {wrong}, всего {len(listed)}")
+        return False
+    print(f"  ✓ Все {len(versions)} ревизий восстанавливаются точно")
+    
+    # Прореживание старой истории на отдельной базе: оставшиеся ревизии
+    # восстанавливаются точно, хотя цепочки дельт перестроены
+    conn = sqlite3.connect(':memory:')
+    schema.create_schema(conn.cursor())
+    versions = edited_versions(80, seed=3)
+    now = datetime(2025, 1, 1)
+    previous = {'title': 'Старая', 'content': versions[0], 'updated_at': None}
+    for content in versions[1:]:
+        revisions.record(conn, 1, previous, 'Старая', content)
+        previous = {'title': 'Старая', 'content': content, 'updated_at': None}
+    # Правки раз в 6 часов за последние 20 дней, последние три - в последний час
+    for n in range(1, len(versions) + 1):
+        age = timedelta(minutes=10 * (len(versions) - n)) if n > len(versions) - 3 \
+            else timedelta(hours=6 * (len(versions) - n))
+        conn.execute('UPDATE note_revisions SET created_at = ? WHERE note_id = 1 AND revision = ?',
+                     ((now - age).strftime('%Y-%m-%d %H:%M:%S'), n))
+    deltas = conn.execute('SELECT COUNT(*) FROM note_revisions WHERE snapshot = 0').fetchone()[0]
+    removed = revisions.thin(conn, 1, now)
+    kept = [row[0] for row in revisions.list_revisions(conn, 1)]
+    wrong = [n for n in kept if (revisions.reconstruct(conn, 1, n) or {}).get('content') != versions[n - 1]]
+    conn.close()
+    if not deltas or not removed or kept[0] != len(versions) or wrong:
+        print(f"  ✗ Ошибка прореживания: дельт {deltas}, удалено {removed}, неверные {wrong}")
+        return False
+    print(f"  ✓ После прореживания осталось {len(kept)} из {len(versions)} ревизий, все точны")
+    return True
+
+def test_coalesced_after_write():
+    print("\n18. Чтение после записи без ограничения нагрузки...")
+    import app as server_app
+    with tempfile.TemporaryDirectory() as directory:
+        application = server_app.create_app(os.path.join(directory, 'notes.db'), start_background=False)
+        application.extensions['admission'].enabled = False
+        client = application.test_client()
+        user_id = client.post('/api/register', json={'username': 'coalesce', 'password': 'secret123'}).get_json()['user_id']
+        note_id = client.post('/api/notes', json={'user_id': user_id, 'title': 'До', 'content': 'старый'}).get_json()['id']
+        
+        # Первое чтение прочитало базу и задержано до конца записи
+        coalescing = application.extensions['coalescing']
+        do = coalescing.do
+        read, release = threading.Event(), threading.Event()
+        def held_do(key, func, label=None):
+            def held():
+                result = func()
+                if not read.is_set():
+                    read.set()
+                    release.wait(5)
+                return result
+            return do(key, held, label)
+        coalescing.do = held_do
+        
+        url = f'/api/notes/{note_id}?user_id={user_id}'
+        results = {}
+        def get(name):
+            results[name] = application.test_client().get(url).get_json()
+        first = threading.Thread(target=get, args=('first',))
+        first.start()
+        read.wait(5)
+        client.put(f'/api/notes/{note_id}', json={'user_id': user_id, 'content': 'новый'})
+        second = threading.Thread(target=get, args=('second',))
+        second.start()
+        second.join(1)
+        release.set()
+        first.join(5)
+        second.join(5)
+        application.extensions['storage'].stop()
+    if results.get('first', {}).get('content') == 'старый' and results.get('second', {}).get('content') == 'новый':
+        print(f"  ✓ Чтение после записи не присоединилось к начатому до нее")
+    else:
+        print(f"  ✗ Чтение после записи вернуло старые данные: {results}")
+        return False
+    return True
+
+def test_job_limits():
+    print("\n19. Лимит очереди заданий при одновременной постановке...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'jobs.db')
+        conn = sqlite3.connect(path)
+        schema.create_schema(conn.cursor())
+        conn.commit()
+        conn.close()
+        queue = jobs.JobQueue(lambda: sqlite3.connect(path, timeout=10), job_kinds.JOB_KINDS,
+                              max_queued_per_user=3)
+        
+        start = threading.Barrier(12)
+        outcomes = []
+        def submit():
+            conn = queue.connect()
+            start.wait()
+            try:
+                queue.submit(conn, 1, 'reindex', {})
+                outcomes.append('queued')
+            except jobs.QueueFull:
+                outcomes.append('full')
+            except sqlite3.Error as e:
+                outcomes.append(str(e))
+            finally:
+                conn.close()
+        threads = [threading.Thread(target=submit) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        conn = queue.connect()
+        queued = conn.execute('SELECT COUNT(*) FROM jobs WHERE user_id = 1').fetchone()[0]
+        
+        rejected = []
+        for priority in (True, False, 1.5, '5'):
+            try:
+                queue.submit(conn, 2, 'reindex', {}, priority)
+            except jobs.JobError:
+                rejected.append(priority)
+        conn.close()
+    if queued == 3 and outcomes.count('queued') == 3 and outcomes.count('full') == 9:
+        print(f"  ✓ Поставлено 3 задания из 12 одновременных, остальные отклонены")
+    else:
+        print(f"  ✗ Лимит очереди нарушен: в очереди {queued}, ответы {outcomes}")
+        return False
+    if len(rejected) == 4:
+        print(f"  ✓ Приоритет не целым числом (в том числе True/False) отклонен")
+    else:
+        print(f"  ✗ Принят неверный приоритет: отклонены только {rejected}")
+        return False
+    return True
+
+def test_bulk_push():
+    print("\n20. Отправка каталога с файлом не в UTF-8...")
+    api = ApiClient(BASE_URL)
+    api.login('test_user', 'test_password')
+    with tempfile.TemporaryDirectory() as directory:
+        files = {'Первый.md': 'Текст'.encode('utf-8'), 'Второй.md': b'# OK',
+                 'Сломанный.md': 'cp1251'.encode('utf-8') + 'Текст'.encode('cp1251')}
+        for name, data in files.items():
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+        mirror = DirectoryMirror(api, directory)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ok = mirror.push()
+        sent = {path: entry['id'] for path, entry in mirror.files.items() if entry.get('id')}
+    if not ok and set(sent) == {'Первый.md', 'Второй.md'} \
+            and api.get_note(sent['Второй.md'])['content'] == '# OK' and 'Сломанный.md: файл не в' in output.getvalue():
+        print(f"  ✓ Остальные файлы пакета отправлены, ошибка записана для одного файла")
+    else:
+        print(f"  ✗ Ошибка пакетной отправки: {sent}\n{output.getvalue()}")
+        return False
+    return True
+
 if __name__ == "__main__":
-    test_api()
\ No newline at end of file
+    sys.exit(0 if test_api() else 1)